@@ -0,0 +1,166 @@
+"""内存准入控制：峰值内存估算的准确度，以及并发大图请求下的进程峰值 RSS
+
+accuracy: 每个用例在独立子进程中渲染一次，比较估算值与渲染期间 ru_maxrss 的增长。
+concurrent: 模拟插件进程（gevent monkey patch、多个渲染线程），并发调用 _invoke，
+分别在默认预算和不限预算下报告进程峰值 RSS、总耗时以及排队/降级次数。
+缓存全部关闭。
+
+    python -m benchmarks.bench_admission [--calls 12] [--threads 4] [--budget-mb N]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run_benchmarks import COLD_CACHE_ENV, synthetic_annotations, synthetic_image
+
+# (尺寸, 输入格式, 参数)
+ACCURACY_CASES = [
+    ('1080p', 'PNG', {}),
+    ('1080p', 'JPEG', {}),
+    ('4k', 'JPEG', {}),
+    ('4k', 'PNG', {'output_format': 'png'}),
+    ('4k', 'PNG', {'output_format': 'webp'}),
+    ('4096sq', 'PNG', {}),
+    ('4096sq', 'JPEG', {'output_max_side': 1024}),
+    ('4096sq', 'PNG', {'output_max_side': 1024}),
+    ('4k', 'PNG', {'output_mode': 'overlay'}),
+]
+# 并发用例轮流使用的输入
+CONCURRENT_INPUTS = [('4096sq', 'PNG'), ('4k', 'JPEG'), ('4k', 'PNG')]
+
+
+def generate(directory: str) -> None:
+    """生成全部输入图像（ru_maxrss 会跨 fork/exec 继承，因此在单独的子进程中生成）"""
+    inputs = {(size, image_format) for size, image_format, _ in ACCURACY_CASES} | set(CONCURRENT_INPUTS)
+    inputs.add(('512', 'PNG'))
+    for size, image_format in inputs:
+        with open(input_path(directory, size, image_format), 'wb') as f:
+            f.write(synthetic_image(size, image_format))
+
+
+def input_path(directory: str, size: str, image_format: str) -> str:
+    return os.path.join(directory, f'{size}.{image_format.lower()}')
+
+
+def read_input(directory: str, size: str, image_format: str) -> bytes:
+    with open(input_path(directory, size, image_format), 'rb') as f:
+        return f.read()
+
+
+def run_accuracy_case(index: int, directory: str) -> dict:
+    from dify_plugin.file.file import File
+
+    from tools.draw_boxes import ImageMarkTool
+    from utils.admission import memory_budget
+
+    size, image_format, params = ACCURACY_CASES[index]
+    tool = ImageMarkTool.from_credentials({})
+    # 预热字体和编码器，只测量渲染本身
+    warm = File(url='http://localhost/warm.png', type='image')
+    warm._blob = read_input(directory, '512', 'PNG')
+    list(tool._invoke({'image_file': warm, 'annotations': synthetic_annotations(10, 'relative', '512')}))
+
+    image_file = File(url='http://localhost/bench', type='image')
+    image_file._blob = read_input(directory, size, image_format)
+    annotations = synthetic_annotations(100, 'relative', size)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    messages = list(tool._invoke({'image_file': image_file, 'annotations': annotations, **params}))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = messages[-1].message.json_object
+    return {
+        "case": f"{size}/{image_format}" + ''.join(f" {k}={v}" for k, v in params.items()),
+        "estimated_mb": result['admission']['estimated_mb'],
+        "measured_mb": round((peak - baseline) / 1024, 1),
+        "budget_peak_mb": memory_budget.stats()['peak_reserved_mb'],
+    }
+
+
+def run_concurrent(calls: int, directory: str) -> dict:
+    from gevent import monkey
+    monkey.patch_all()
+
+    import gevent
+    from dify_plugin.file.file import File
+
+    from tools.draw_boxes import ImageMarkTool
+    from utils.admission import memory_budget
+
+    tool = ImageMarkTool.from_credentials({})
+    blobs = {key: read_input(directory, *key) for key in CONCURRENT_INPUTS}
+    annotations = synthetic_annotations(100, 'relative', '4k')
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def invoke(index: int) -> dict:
+        image_file = File(url=f'http://localhost/{index}', type='image')
+        image_file._blob = blobs[CONCURRENT_INPUTS[index % len(CONCURRENT_INPUTS)]]
+        messages = list(tool._invoke({'image_file': image_file, 'annotations': annotations}))
+        return messages[-1].message.json_object
+
+    start = time.perf_counter()
+    jobs = [gevent.spawn(invoke, index) for index in range(calls)]
+    gevent.joinall(jobs)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stats = memory_budget.stats()
+    return {
+        "budget_mb": stats['budget_mb'],
+        "calls": calls,
+        "succeeded": sum(1 for job in jobs if job.value and job.value.get('success')),
+        "wall_s": round(elapsed, 2),
+        "peak_rss_delta_mb": round((peak - baseline) / 1024, 1),
+        "peak_reserved_mb": stats['peak_reserved_mb'],
+        "queued": stats['queued'],
+        "degraded": stats['degraded'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=12)
+    parser.add_argument('--threads', type=int, default=4, help='DRAW_BOXES_RENDER_THREADS')
+    parser.add_argument('--budget-mb', type=int, help='DRAW_BOXES_MEMORY_BUDGET（默认按插件内存上限推算）')
+    parser.add_argument('--case', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--concurrent', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--generate', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.dir)
+        return
+    if args.case is not None:
+        print(json.dumps(run_accuracy_case(args.case, args.dir)))
+        return
+    if args.concurrent:
+        print(json.dumps(run_concurrent(args.calls, args.dir)))
+        return
+
+    env = {**os.environ, **COLD_CACHE_ENV}
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run([sys.executable, '-m', 'benchmarks.bench_admission', '--generate', '--dir', tmp], check=True)
+        for index in range(len(ACCURACY_CASES)):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_admission', '--case', str(index), '--dir', tmp],
+                capture_output=True, text=True, check=True, env=env,
+            ).stdout
+            print(output.strip().splitlines()[-1])
+
+        # 不限预算时所有请求立即进入渲染线程，对照默认预算下的峰值内存
+        for budget_mb in (1 << 20, args.budget_mb):
+            budget_env = {} if budget_mb is None else {'DRAW_BOXES_MEMORY_BUDGET': str(budget_mb * 1024 * 1024)}
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_admission', '--concurrent',
+                 '--calls', str(args.calls), '--dir', tmp],
+                capture_output=True, text=True, check=True,
+                env={**env, 'DRAW_BOXES_RENDER_THREADS': str(args.threads), **budget_env},
+            ).stdout
+            print(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
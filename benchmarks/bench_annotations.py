@@ -0,0 +1,65 @@
+"""比较整体 json.loads 与增量解析标注 JSON 的内存峰值和耗时
+
+使用 tracemalloc 统计解析阶段新分配内存的峰值（不含输入字符串本身）。
+
+    python -m benchmarks.bench_annotations [--count 5000]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+
+def build_payload(count: int) -> str:
+    return json.dumps({"annotations": [
+        {
+            "bbox_2d": [i % 900, (i * 7) % 900, i % 900 + 60, (i * 7) % 900 + 40],
+            "label": f"object_{i % 80}",
+            "confidence": round(0.5 + (i % 50) / 100, 2),
+            "attributes": {"track_id": i, "occluded": i % 3 == 0},
+        }
+        for i in range(count)
+    ]})
+
+
+def measure(name: str, parse, payload: str, repeat: int) -> dict:
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        total, batch = parse(payload)
+        timings.append((time.perf_counter() - start) * 1000)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del batch
+    return {
+        "mode": name,
+        "annotations": total,
+        "parse_ms": round(min(timings), 2),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from tools.draw_boxes import ImageMarkTool
+
+    tool = ImageMarkTool.from_credentials({})
+    payload = build_payload(args.count)
+    print(json.dumps({"payload_kb": round(len(payload) / 1024, 1)}))
+
+    def materialized(text):
+        # 旧流程：整体解析为字典列表后再规范化
+        return tool._normalize_annotations(tool._parse_annotations_json(text))
+
+    for name, parse in (('json.loads', materialized), ('incremental', tool._normalize_annotations)):
+        print(json.dumps(measure(name, parse, payload, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""并发调用下 CPU 工作放入原生线程池与在 greenlet 中直接执行的对比
+
+模拟 Dify 插件进程：gevent monkey patch 后并发启动多个 _invoke，每个调用
+从带延迟的本地 HTTP 服务器（独立子进程）下载图像后绘制。报告总耗时和事件
+循环的最大停顿（停顿期间其他调用的网络 I/O 无法推进）。
+
+    python -m benchmarks.bench_concurrency [--calls 16] [--delay 0.2] [--size 1080p]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def serve(port_file: str, delay: float, size: str) -> None:
+    """在子进程中运行的 HTTP 服务器：每个请求延迟 delay 秒后返回图像"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from benchmarks.run_benchmarks import synthetic_image
+
+    body = synthetic_image(size, 'PNG')
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    with open(port_file, 'w') as f:
+        f.write(str(server.server_address[1]))
+    server.serve_forever()
+
+
+def run_mode(name: str, url: str, calls: int, offload: bool) -> dict:
+    import gevent
+
+    from benchmarks.run_benchmarks import synthetic_annotations
+    from tools import draw_boxes
+
+    tool = draw_boxes.ImageMarkTool.from_credentials({})
+    annotations = synthetic_annotations(100, 'relative', '1080p')
+    original = draw_boxes.run_in_thread
+    if not offload:
+        draw_boxes.run_in_thread = lambda func, *args: func(*args)
+
+    stalls = []
+    running = True
+
+    def ticker():
+        # 每 5ms 醒来一次，实际间隔与预期之差即事件循环被阻塞的时间
+        while running:
+            start = time.perf_counter()
+            gevent.sleep(0.005)
+            stalls.append(time.perf_counter() - start - 0.005)
+
+    def invoke(index: int):
+        # URL 附带序号，避免 HTTP 缓存合并请求
+        messages = list(tool._invoke({'image_file': f'{url}?i={index}', 'annotations': annotations}))
+        return messages[-1].message.json_object.get('success')
+
+    try:
+        monitor = gevent.spawn(ticker)
+        start = time.perf_counter()
+        jobs = [gevent.spawn(invoke, index) for index in range(calls)]
+        gevent.joinall(jobs)
+        elapsed = time.perf_counter() - start
+        running = False
+        monitor.join()
+    finally:
+        draw_boxes.run_in_thread = original
+
+    return {
+        "mode": name,
+        "calls": calls,
+        "succeeded": sum(1 for job in jobs if job.value),
+        "wall_s": round(elapsed, 3),
+        "max_loop_stall_ms": round(max(stalls, default=0) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=16)
+    parser.add_argument('--delay', type=float, default=0.2, help='server latency in seconds')
+    parser.add_argument('--size', default='1080p')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.delay, args.size)
+        return
+
+    port_file = os.path.join(tempfile.gettempdir(), f'draw_boxes_bench_port_{os.getpid()}')
+    server = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.bench_concurrency',
+        '--serve', port_file, '--delay', str(args.delay), '--size', args.size,
+    ])
+    try:
+        while not os.path.exists(port_file) or not open(port_file).read():
+            time.sleep(0.05)
+        url = f'http://127.0.0.1:{open(port_file).read()}/image.png'
+
+        # 每次调用都完整下载、解码，不命中跨调用缓存
+        os.environ.update({
+            'DRAW_BOXES_RESULT_CACHE_MAX_BYTES': '0',
+            'DRAW_BOXES_IMAGE_CACHE_MAX_BYTES': '0',
+            'DRAW_BOXES_HTTP_CACHE_MAX_BYTES': '0',
+        })
+        for name, offload in (('inline', False), ('threadpool', True)):
+            print(json.dumps(run_mode(name, url, args.calls, offload)))
+    finally:
+        server.terminate()
+        if os.path.exists(port_file):
+            os.remove(port_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""比较多帧图像逐帧流式渲染与先收集全部帧再由 Pillow 保存的耗时和峰值内存
+
+输入为合成的 GIF 动图（移动的方块），每 4 帧有一个单帧标注，另有一个
+绘制在所有帧上的标注。每种模式在独立子进程中运行并读取 ru_maxrss；
+ru_maxrss 会跨 fork/exec 继承，因此输入也在单独的子进程中生成。
+
+    python -m benchmarks.bench_frames [--frames 50 200 800] [--width 640] [--height 480]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def generate(path: str, frames: int, width: int, height: int) -> None:
+    from PIL import Image, ImageDraw
+
+    palette = [0, 0, 0, 40, 90, 160, 230, 200, 40, 255, 255, 255] + [0] * (256 * 3 - 12)
+    images = []
+    for index in range(frames):
+        image = Image.new('P', (width, height), 1)
+        image.putpalette(palette)
+        x = index * 8 % (width - 60)
+        ImageDraw.Draw(image).rectangle([x, height // 3, x + 60, height // 3 + 60], fill=2)
+        images.append(image)
+    images[0].save(path, format='GIF', save_all=True, append_images=images[1:], duration=40, loop=0)
+
+
+def annotations(frames: int) -> list[dict]:
+    items = [{"bbox": [50, 50, 950, 150], "label": "title"}]
+    for index in range(0, frames, 4):
+        x = index * 8 % 580
+        items.append({
+            "bbox": [x * 1000 // 640, 300, (x + 60) * 1000 // 640, 480], "label": f"f{index}", "frame": index,
+        })
+    return items
+
+
+def run_mode(mode: str, path: str) -> dict:
+    from PIL import Image, ImageSequence
+
+    from tools.draw_boxes import ImageMarkTool
+    from utils.options import RenderOptions
+
+    with open(path, 'rb') as f:
+        image_bytes = f.read()
+    frames = Image.open(path).n_frames
+    items = annotations(frames)
+    options = RenderOptions(multi_frame=True)
+    tool = ImageMarkTool.from_credentials({})
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if mode == 'streamed':
+        encoded, result = tool._render_bytes(image_bytes, items, options)
+        output_bytes, encoded_frames = len(encoded.data), result['frames']['encoded']
+    else:
+        # 对照：全部帧绘制完成后由 Pillow 一次性保存
+        _, batch = tool._normalize_annotations(items)
+        source = Image.open(path)
+        pixel_batch = batch.to_pixels(source.width, source.height)
+        rendered = []
+        for index, frame in enumerate(ImageSequence.Iterator(source)):
+            image = frame.convert('RGB')
+            selected = pixel_batch.select((pixel_batch.frames < 0) | (pixel_batch.frames == index))
+            tool._draw_annotations(
+                image, selected, options.box_color, options.text_color,
+                options.line_width, options.font_size, in_place=True,
+            )
+            rendered.append(image)
+        output = tempfile.SpooledTemporaryFile()
+        rendered[0].save(output, format='GIF', save_all=True, append_images=rendered[1:], duration=40, loop=0)
+        output_bytes, encoded_frames = output.tell(), None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "mode": mode,
+        "frames": frames,
+        "encoded_frames": encoded_frames,
+        "render_ms": round(elapsed_ms, 1),
+        "ms_per_frame": round(elapsed_ms / frames, 2),
+        "output_bytes": output_bytes,
+        "render_delta_mb": round((peak - baseline) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, nargs='+', default=[50, 200, 800])
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--mode', choices=['streamed', 'pillow'], help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    parser.add_argument('--generate', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.path, args.frames[0], args.width, args.height)
+        return
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.path)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for frames in args.frames:
+            path = os.path.join(tmp, f'bench_{frames}.gif')
+            subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_frames', '--generate', '--path', path,
+                 '--frames', str(frames), '--width', str(args.width), '--height', str(args.height)],
+                check=True,
+            )
+            for mode in ('pillow', 'streamed'):
+                output = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_frames', '--mode', mode, '--path', path],
+                    capture_output=True, text=True, check=True,
+                ).stdout
+                print(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""比较旧的字符串图像解析流程与分块 Base64 解码的内存峰值和耗时
+
+使用 tracemalloc 统计从输入字符串到 Pillow 读完文件头之间新分配内存的峰值
+（不含输入字符串本身）。
+
+    python -m benchmarks.bench_ingest [--mb 10]
+"""
+import argparse
+import base64
+import json
+import os
+import time
+import tracemalloc
+from io import BytesIO
+
+from PIL import Image
+
+
+def build_payloads(size_mb: float) -> dict[str, str]:
+    # 随机像素的未压缩 BMP，Base64 后约为指定大小
+    side = int((size_mb * 1024 * 1024 * 3 / 4 / 3) ** 0.5)
+    buffer = BytesIO()
+    Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(buffer, format='BMP')
+    encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return {
+        'base64': encoded,
+        'data_uri': 'data:image/bmp;base64,' + encoded,
+    }
+
+
+def legacy_load(image_data: str):
+    # 旧流程：strip 后整体 json.loads 尝试，再 split / b64decode，最后包装 BytesIO
+    cleaned = image_data.strip().strip('`').strip()
+    try:
+        json.loads(cleaned)
+    except ValueError:
+        pass
+    if cleaned.startswith('data:image'):
+        cleaned = cleaned.split(',')[1]
+    return base64.b64decode(cleaned)
+
+
+def measure(name: str, load, wrap, payload: str, repeat: int) -> dict:
+    timings = []
+    peak = 0
+    size = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        image_bytes = load(payload)
+        image = Image.open(wrap(image_bytes))
+        size = image.size
+        timings.append((time.perf_counter() - start) * 1000)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del image, image_bytes
+    return {
+        "mode": name,
+        "size": size,
+        "load_ms": round(min(timings), 2),
+        "peak_mb": round(peak / (1024 * 1024), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mb', type=float, default=10, help='Base64 payload size in MB')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from tools.draw_boxes import ImageMarkTool
+    from utils.ingest import open_buffer
+
+    tool = ImageMarkTool.from_credentials({})
+    modes = (
+        ('legacy', legacy_load, BytesIO),
+        ('chunked', tool._load_image_bytes, open_buffer),
+    )
+
+    for source, payload in build_payloads(args.mb).items():
+        assert bytes(tool._load_image_bytes(payload)) == legacy_load(payload)
+        print(json.dumps({"source": source, "payload_mb": round(len(payload) / (1024 * 1024), 2)}))
+        for name, load, wrap in modes:
+            print(json.dumps(measure(name, load, wrap, payload, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
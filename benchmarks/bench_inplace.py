@@ -0,0 +1,64 @@
+"""比较复制绘制与原地绘制的峰值内存
+
+每种模式在独立子进程中运行，读取 ru_maxrss 作为峰值 RSS。
+
+    python -m benchmarks.bench_inplace [--width 3840] [--height 2160]
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+def run_mode(mode: str, width: int, height: int, boxes: int) -> dict:
+    from PIL import Image
+
+    from tools.draw_boxes import ImageMarkTool
+    from utils.annotations import AnnotationBatch
+
+    tool = ImageMarkTool.from_credentials({})
+    image = Image.new('RGB', (width, height), (40, 90, 160))
+    annotations = AnnotationBatch.from_annotations([
+        {"bbox": [i * 7 % 900, i * 11 % 900, i * 7 % 900 + 80, i * 11 % 900 + 80], "label": f"obj{i}"}
+        for i in range(boxes)
+    ]).to_pixels(width, height)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    tool._draw_annotations(image, annotations, '#ff0000', '#ffffff', 2, 16, in_place=(mode == 'in_place'))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "mode": mode,
+        "draw_ms": round(elapsed_ms, 2),
+        "peak_rss_mb": round(peak / 1024, 1),
+        "draw_delta_mb": round((peak - baseline) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--width', type=int, default=3840)
+    parser.add_argument('--height', type=int, default=2160)
+    parser.add_argument('--boxes', type=int, default=20)
+    parser.add_argument('--mode', choices=['copy', 'in_place'])
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.width, args.height, args.boxes)))
+        return
+
+    for mode in ('copy', 'in_place'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_inplace', '--mode', mode,
+             '--width', str(args.width), '--height', str(args.height), '--boxes', str(args.boxes)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        print(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
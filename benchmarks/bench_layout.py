@@ -0,0 +1,65 @@
+"""标签布局耗时与标注数量的关系
+
+对比网格索引布局与逐对检测的朴素布局，输出每个数量级的放置耗时。
+
+    python -m benchmarks.bench_layout [--counts 100 500 1000 2000 5000]
+"""
+import argparse
+import json
+import random
+import time
+
+from utils.layout import LabelLayout
+
+
+class PairwiseLayout(LabelLayout):
+    """朴素实现：与所有已放置标签逐一比较（O(n²)，仅用于对比）"""
+
+    def __init__(self, width: int, height: int, cell_size: int = 64):
+        super().__init__(width, height, cell_size)
+        self._rects = []
+
+    def _collides(self, rect) -> bool:
+        x0, y0, x1, y1 = rect
+        return any(x0 < ox1 and ox0 < x1 and y0 < oy1 and oy0 < y1 for ox0, oy0, ox1, oy1 in self._rects)
+
+    def _insert(self, rect) -> None:
+        self._rects.append(rect)
+
+
+def make_boxes(count: int, width: int, height: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    boxes = []
+    for _ in range(count):
+        w, h = rng.randint(20, 200), rng.randint(20, 200)
+        x, y = rng.randint(0, width - w), rng.randint(0, height - h)
+        boxes.append((x, y, x + w, y + h))
+    return boxes
+
+
+def time_layout(layout_cls, boxes: list, width: int, height: int) -> float:
+    layout = layout_cls(width, height, cell_size=64)
+    start = time.perf_counter()
+    for box in boxes:
+        layout.place(box, 60, 12, 5, (-2, 1, 62, 15))
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--counts', type=int, nargs='+', default=[100, 500, 1000, 2000, 5000])
+    parser.add_argument('--width', type=int, default=3840)
+    parser.add_argument('--height', type=int, default=2160)
+    parser.add_argument('--skip-pairwise', action='store_true')
+    args = parser.parse_args()
+
+    for count in args.counts:
+        boxes = make_boxes(count, args.width, args.height)
+        result = {"boxes": count, "grid_ms": round(time_layout(LabelLayout, boxes, args.width, args.height), 2)}
+        if not args.skip_pairwise:
+            result["pairwise_ms"] = round(time_layout(PairwiseLayout, boxes, args.width, args.height), 2)
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""比较完整图像输出与只输出标注层（SVG / 透明 PNG 图层）的耗时
+
+输入为 File blob 形式的合成 JPEG，缓存全部关闭。render_ms 为 fetch 和
+cache_lookup（与输入字节数成正比）之外各阶段耗时之和。
+
+    python -m benchmarks.bench_output_modes [--count 100] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import statistics
+
+from benchmarks.run_benchmarks import COLD_CACHE_ENV, SIZES, synthetic_annotations, synthetic_image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ.update(COLD_CACHE_ENV)
+    from dify_plugin.file.file import File
+
+    from tools.draw_boxes import ImageMarkTool
+
+    tool = ImageMarkTool.from_credentials({})
+    for size in SIZES:
+        image_file = File(url='http://localhost/bench.jpg', type='image')
+        image_file._blob = synthetic_image(size, 'JPEG')
+        annotations = synthetic_annotations(args.count, 'relative', size)
+        for mode in ('image', 'overlay', 'svg'):
+            totals, renders = [], []
+            for _ in range(args.repeat):
+                messages = list(tool._invoke({
+                    'image_file': image_file, 'annotations': annotations, 'output_mode': mode,
+                    'include_metrics': True,
+                }))
+                result = messages[-1].message.json_object
+                stages = result['metrics']['stages']
+                totals.append(result['metrics']['total_ms'])
+                renders.append(sum(
+                    stage['ms'] for name, stage in stages.items() if name not in ('fetch', 'cache_lookup')
+                ))
+            print(json.dumps({
+                "size": size,
+                "mode": mode,
+                "total_ms": round(statistics.median(totals), 1),
+                "render_ms": round(statistics.median(renders), 1),
+                "output_bytes": result['output']['bytes'],
+            }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""比较大量实例掩码一次性合成与逐个解码、逐个合成的耗时和峰值内存
+
+输入为 1920x1080 的合成图像和 N 个 COCO RLE 掩码（随机位置的椭圆），每种
+模式在独立子进程中运行并读取 ru_maxrss。对照模式先把每个掩码解码为整幅
+布尔数组，再逐个缩放并合成到图像上。
+
+    python -m benchmarks.bench_shapes [--masks 50 200 1000] [--width 1920] [--height 1080]
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def rle_annotations(count: int, width: int, height: int) -> list[dict]:
+    """随机椭圆掩码的 COCO RLE（每列一个前景游程），直接按列计算，不生成整幅数组"""
+    rng = np.random.default_rng(0)
+    annotations = []
+    for index in range(count):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        rx, ry = rng.uniform(10, width / 8), rng.uniform(10, height / 8)
+        counts, previous = [], 0
+        for x in range(max(0, int(cx - rx)), min(width, int(cx + rx) + 1)):
+            half = ry * np.sqrt(max(0.0, 1 - ((x - cx) / rx) ** 2))
+            top, bottom = max(0, int(np.ceil(cy - half))), min(height, int(cy + half) + 1)
+            if top < bottom:
+                start = x * height + top
+                counts += [start - previous, bottom - top]
+                previous = x * height + bottom
+        annotations.append({
+            "mask": {"size": [height, width], "counts": counts}, "label": f"obj{index % 10}",
+        })
+    return annotations
+
+
+def run_mode(mode: str, count: int, width: int, height: int) -> dict:
+    from PIL import Image
+
+    from tools.draw_boxes import ImageMarkTool
+    from utils.options import RenderOptions
+
+    items = rle_annotations(count, width, height)
+    image = Image.new('RGB', (width, height), (40, 90, 160))
+    tool = ImageMarkTool.from_credentials({})
+    options = RenderOptions(color_by_class=True)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    _, batch = tool._normalize_annotations(items)
+    pixel_batch = batch.to_pixels(width, height)
+    if mode == 'single_pass':
+        tool._draw_annotations(
+            image, pixel_batch, options.box_color, options.text_color,
+            options.line_width, options.font_size, in_place=True, color_by_class=True,
+        )
+    else:
+        # 对照：每个掩码解码为整幅数组，缩放后单独合成一次
+        from PIL import ImageColor
+
+        from utils.styles import palette_color
+
+        for shape, label in zip(pixel_batch.shapes, pixel_batch.labels):
+            mask = shape.mask
+            full = np.zeros(mask.width * mask.height, dtype=bool)
+            for run_start, run_end in zip(mask.starts.tolist(), mask.ends.tolist()):
+                full[run_start:run_end] = True
+            alpha = Image.fromarray(full.reshape(mask.width, mask.height).T.astype(np.uint8) * 128)
+            alpha = alpha.resize((width, height), Image.NEAREST)
+            layer = Image.new('RGB', (width, height), ImageColor.getrgb(palette_color(label)))
+            image.paste(layer, (0, 0), alpha)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "mode": mode,
+        "masks": count,
+        "render_ms": round(elapsed_ms, 1),
+        "ms_per_mask": round(elapsed_ms / count, 2),
+        "render_delta_mb": round((peak - baseline) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--masks', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--mode', choices=['single_pass', 'per_mask'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.masks[0], args.width, args.height)))
+        return
+
+    for count in args.masks:
+        for mode in ('per_mask', 'single_pass'):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_shapes', '--mode', mode, '--masks', str(count),
+                 '--width', str(args.width), '--height', str(args.height)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            print(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
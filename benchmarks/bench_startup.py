@@ -0,0 +1,81 @@
+"""测量插件冷启动和首个请求的延迟，对比启动预热前后的差异
+
+每次测量都在全新的子进程中进行：记录导入 SDK 与工具模块的耗时、预热耗时、
+首个请求和第二个请求的延迟，取多次运行的中位数。
+
+    python -m benchmarks.bench_startup [--runs 5] [--size 1080p]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+def child(warm: bool, size: str) -> dict:
+    start = time.perf_counter()
+    import dify_plugin  # noqa: F401
+    sdk_ms = (time.perf_counter() - start) * 1000
+
+    from tools.draw_boxes import ImageMarkTool
+    import_ms = (time.perf_counter() - start) * 1000 - sdk_ms
+
+    warmup_ms = 0.0
+    if warm:
+        from utils.warmup import warm_up
+        warmup_ms = sum(warm_up().values())
+
+    import base64
+
+    from benchmarks.run_benchmarks import synthetic_annotations, synthetic_image
+
+    params = {
+        'image_file': base64.b64encode(synthetic_image(size, 'PNG')).decode('ascii'),
+        'annotations': synthetic_annotations(10, 'relative', size),
+    }
+    tool = ImageMarkTool.from_credentials({})
+    requests_ms = []
+    for font_size in (16, 18):
+        # 第二个请求换字号，避免命中结果缓存
+        begin = time.perf_counter()
+        messages = list(tool._invoke({**params, 'font_size': font_size}))
+        requests_ms.append((time.perf_counter() - begin) * 1000)
+        assert messages[-1].message.json_object.get('success')
+
+    return {
+        "sdk_import_ms": sdk_ms,
+        "plugin_import_ms": import_ms,
+        "warmup_ms": warmup_ms,
+        "first_request_ms": requests_ms[0],
+        "second_request_ms": requests_ms[1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--size', default='1080p')
+    parser.add_argument('--child', choices=('cold', 'warm'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child == 'warm', args.size)))
+        return
+
+    for mode in ('cold', 'warm'):
+        samples = []
+        for _ in range(args.runs):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_startup', '--child', mode, '--size', args.size],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        print(json.dumps({
+            "mode": mode,
+            **{key: round(statistics.median(sample[key] for sample in samples), 1) for key in samples[0]},
+        }))
+
+
+if __name__ == '__main__':
+    main()
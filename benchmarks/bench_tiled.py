@@ -0,0 +1,96 @@
+"""比较整帧渲染与分条渲染的峰值内存
+
+输入为未压缩 BMP。每种模式在独立子进程中运行（full 模式通过环境变量
+放宽整帧上限），读取 ru_maxrss 作为峰值 RSS。ru_maxrss 会跨 fork/exec
+继承，因此输入也在单独的子进程中生成。
+
+    python -m benchmarks.bench_tiled [--width 8000] [--height 6000]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def run_mode(mode: str, path: str, boxes: int) -> dict:
+    from dify_plugin.file.file import File
+
+    from tools.draw_boxes import ImageMarkTool
+    from utils.options import RenderOptions
+
+    image_file = File(url='http://localhost/bench.bmp', type='image')
+    with open(path, 'rb') as f:
+        image_file._blob = f.read()
+
+    annotations = [
+        {"bbox": [i * 7 % 900, i * 11 % 900, i * 7 % 900 + 80, i * 11 % 900 + 80], "label": f"obj{i}"}
+        for i in range(boxes)
+    ]
+    options = RenderOptions(
+        box_color='#ff0000', text_color='#ffffff', line_width=2, font_size=16,
+        coordinate_type='relative', output_format='png', png_compress_level=1,
+    )
+    tool = ImageMarkTool.from_credentials({})
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    encoded, result = tool._render(image_file, annotations, options)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "mode": mode,
+        "tiled": result.get("tiled"),
+        "render_ms": round(elapsed_ms, 2),
+        "output_bytes": len(encoded.data),
+        "peak_rss_mb": round(peak / 1024, 1),
+        "render_delta_mb": round((peak - baseline) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--width', type=int, default=8000)
+    parser.add_argument('--height', type=int, default=6000)
+    parser.add_argument('--boxes', type=int, default=200)
+    parser.add_argument('--mode', choices=['full', 'tiled'])
+    parser.add_argument('--path')
+    parser.add_argument('--generate', action='store_true')
+    args = parser.parse_args()
+
+    if args.generate:
+        from PIL import Image
+
+        Image.new('RGB', (args.width, args.height), (40, 90, 160)).save(args.path, format='BMP')
+        return
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.path, args.boxes)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.bmp')
+        subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_tiled', '--generate', '--path', path,
+             '--width', str(args.width), '--height', str(args.height)],
+            check=True,
+        )
+
+        for mode in ('full', 'tiled'):
+            env = dict(os.environ)
+            if mode == 'full':
+                env['DRAW_BOXES_MAX_IMAGE_SIZE'] = str(max(args.width, args.height))
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_tiled', '--mode', mode,
+                 '--path', path, '--boxes', str(args.boxes)],
+                capture_output=True, text=True, check=True, env=env,
+            ).stdout
+            print(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
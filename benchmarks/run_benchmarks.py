@@ -0,0 +1,356 @@
+"""draw_boxes 端到端基准测试
+
+通过 ImageMarkTool._invoke 驱动完整流程（获取、解析、解码、绘制、编码），
+覆盖不同图像尺寸、标注数量、坐标类型和图像来源（base64、data URI、
+Dify File blob、本地 HTTP 服务器 URL）。每个用例在独立子进程中运行，
+默认关闭结果/解码帧/HTTP 缓存，报告延迟分位数、吞吐量以及各阶段耗时与
+RSS 高水位，并写出可跨提交比较的 JSON 结果。
+
+ru_maxrss 会跨 fork/exec 继承，因此输入图像也在单独的子进程中生成，
+父进程保持很小的内存占用；各阶段的 RSS 高水位取自子进程的第一次调用。
+
+    python -m benchmarks.run_benchmarks [--quick] [--output results.json]
+    python -m benchmarks.run_benchmarks --compare base.json head.json [--threshold 0.1]
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+
+SIZES = {
+    '512': (512, 512),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+    '4096sq': (4096, 4096),
+}
+COUNTS = (1, 100, 1000)
+COORDINATE_TYPES = ('relative', 'absolute')
+SOURCES = ('base64', 'data_uri', 'file', 'url')
+
+QUICK_SIZES = ('512', '1080p')
+QUICK_COUNTS = (1, 100)
+
+# 默认关闭跨调用缓存，每次迭代都走完整流程
+COLD_CACHE_ENV = {
+    'DRAW_BOXES_RESULT_CACHE_MAX_BYTES': '0',
+    'DRAW_BOXES_IMAGE_CACHE_MAX_BYTES': '0',
+    'DRAW_BOXES_HTTP_CACHE_MAX_BYTES': '0',
+}
+
+
+def synthetic_image(size: str, image_format: str) -> bytes:
+    """生成确定性的合成图像（渐变 + 噪声，接近真实照片的编码开销）"""
+    import numpy as np
+    from PIL import Image
+
+    width, height = SIZES[size]
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.empty((height, width, 3), dtype=np.float32)
+    pixels[..., 0] = x
+    pixels[..., 1] = y
+    pixels[..., 2] = (x + y) / 2
+    pixels += rng.normal(0, 12, pixels.shape).astype(np.float32)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def synthetic_annotations(count: int, coordinate_type: str, size: str) -> str:
+    """生成确定性的标注 JSON"""
+    import numpy as np
+
+    width, height = SIZES[size] if coordinate_type == 'absolute' else (1000, 1000)
+    rng = np.random.default_rng(count)
+    classes = ['person', 'car', 'bicycle', 'traffic light', '行人']
+    annotations = []
+    for i in range(count):
+        w, h = rng.uniform(0.02, 0.2) * width, rng.uniform(0.02, 0.2) * height
+        x, y = rng.uniform(0, width - w), rng.uniform(0, height - h)
+        annotations.append({
+            "bbox": [round(x, 1), round(y, 1), round(x + w, 1), round(y + h, 1)],
+            "label": classes[i % len(classes)],
+            "confidence": round(float(rng.uniform(0.3, 1.0)), 2),
+        })
+    return json.dumps({"annotations": annotations}, ensure_ascii=False)
+
+
+def serve_bytes(data: bytes, mime_type: str) -> tuple[ThreadingHTTPServer, str]:
+    """在本地端口上提供图像字节，返回 (服务器, URL)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', mime_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/image'
+
+
+def percentile(values: list[float], q: float) -> float:
+    """线性插值分位数"""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "p50": round(percentile(values, 0.5), 3),
+        "p90": round(percentile(values, 0.9), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "mean": round(statistics.fmean(values), 3),
+        "min": round(min(values), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def run_case(size: str, count: int, coordinate_type: str, source: str,
+             iterations: int, warmup: int, image_format: str, input_path: str) -> dict:
+    """在当前进程中运行单个用例（由子进程调用）"""
+    from dify_plugin.file.file import File
+
+    from tools.draw_boxes import ImageMarkTool
+    from utils.metrics import peak_rss_bytes
+
+    with open(input_path, 'rb') as f:
+        image_bytes = f.read()
+    mime_type = f'image/{image_format.lower()}'
+    annotations = synthetic_annotations(count, coordinate_type, size)
+
+    server = None
+    if source == 'base64':
+        image_file = base64.b64encode(image_bytes).decode('ascii')
+    elif source == 'data_uri':
+        image_file = f'data:{mime_type};base64,' + base64.b64encode(image_bytes).decode('ascii')
+    elif source == 'url':
+        server, image_file = serve_bytes(image_bytes, mime_type)
+    else:
+        image_file = File(url='http://localhost/image', type='image', mime_type=mime_type)
+        image_file._blob = image_bytes
+
+    tool = ImageMarkTool.from_credentials({})
+    parameters = {
+        'image_file': image_file,
+        'annotations': annotations,
+        'coordinate_type': coordinate_type,
+        'include_metrics': True,
+        'metrics_format': 'json',
+    }
+
+    baseline_rss = peak_rss_bytes()
+    latencies, stages, output_bytes = [], {}, 0
+    try:
+        for iteration in range(warmup + iterations):
+            start = time.perf_counter()
+            result = None
+            for message in tool._invoke(parameters):
+                if message.type.value == 'json':
+                    result = message.message.json_object
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            if not result or not result.get('success'):
+                raise RuntimeError(f"Invocation failed: {result}")
+            if iteration == 0:
+                # 高水位只增不减，阶段内存取第一次调用的记录
+                for name, stage in result['metrics']['stages'].items():
+                    stages[name] = {"ms": [], "peak_rss_mb": stage["peak_rss_mb"]}
+            if iteration < warmup:
+                continue
+
+            latencies.append(elapsed_ms)
+            output_bytes = result['output']['bytes']
+            for name, stage in result['metrics']['stages'].items():
+                stages.setdefault(name, {"ms": [], "peak_rss_mb": None})["ms"].append(stage["ms"])
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    total_s = sum(latencies) / 1000
+    peak_rss = peak_rss_bytes()
+    return {
+        "case": case_id(size, count, coordinate_type, source),
+        "size": size,
+        "annotations": count,
+        "coordinate_type": coordinate_type,
+        "source": source,
+        "iterations": iterations,
+        "input_bytes": len(image_bytes),
+        "output_bytes": output_bytes,
+        "latency_ms": summarize(latencies),
+        "throughput": {
+            "images_per_s": round(iterations / total_s, 3),
+            "megapixels_per_s": round(iterations * SIZES[size][0] * SIZES[size][1] / 1e6 / total_s, 3),
+        },
+        "stages": {
+            name: {**summarize(entry["ms"]), "peak_rss_mb": entry["peak_rss_mb"]}
+            for name, entry in stages.items() if entry["ms"]
+        },
+        "baseline_rss_mb": round(baseline_rss / (1024 * 1024), 1) if baseline_rss else None,
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1) if peak_rss else None,
+    }
+
+
+def case_id(size: str, count: int, coordinate_type: str, source: str) -> str:
+    return f'{size}/{count}/{coordinate_type}/{source}'
+
+
+def environment_info() -> dict:
+    import numpy
+    import PIL
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pillow": PIL.__version__,
+        "numpy": numpy.__version__,
+    }
+
+
+def run_suite(args) -> dict:
+    sizes = QUICK_SIZES if args.quick else args.sizes
+    counts = QUICK_COUNTS if args.quick else args.counts
+    env = dict(os.environ)
+    if not args.warm_caches:
+        env.update(COLD_CACHE_ENV)
+
+    cases = []
+    input_dir = tempfile.TemporaryDirectory()
+    for size in sizes:
+        # 输入图像在父进程中生成，子进程的 RSS 只反映插件本身
+        input_path = os.path.join(input_dir.name, f'{size}.{args.image_format.lower()}')
+        subprocess.run(
+            [sys.executable, '-m', 'benchmarks.run_benchmarks', '--generate', size,
+             '--image-format', args.image_format, '--input', input_path],
+            check=True,
+        )
+
+        for count in counts:
+            for coordinate_type in args.coords:
+                for source in args.sources:
+                    command = [
+                        sys.executable, '-m', 'benchmarks.run_benchmarks', '--case',
+                        case_id(size, count, coordinate_type, source),
+                        '--iterations', str(args.iterations), '--warmup', str(args.warmup),
+                        '--image-format', args.image_format, '--input', input_path,
+                    ]
+                    output = subprocess.run(command, capture_output=True, text=True, check=True, env=env).stdout
+                    case = json.loads(output.strip().splitlines()[-1])
+                    cases.append(case)
+                    latency = case["latency_ms"]
+                    print(f'{case["case"]:<36} p50 {latency["p50"]:>9.2f} ms  p90 {latency["p90"]:>9.2f} ms  '
+                          f'{case["throughput"]["images_per_s"]:>8.2f} img/s  peak {case["peak_rss_mb"]} MB')
+    input_dir.cleanup()
+
+    return {
+        "environment": environment_info(),
+        "config": {
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "image_format": args.image_format,
+            "warm_caches": args.warm_caches,
+        },
+        "cases": cases,
+    }
+
+
+def compare(base_path: str, head_path: str, threshold: float) -> int:
+    """比较两次结果的 p50 延迟，超过阈值的回退返回非零退出码"""
+    with open(base_path, encoding='utf-8') as f:
+        base = {case["case"]: case for case in json.load(f)["cases"]}
+    with open(head_path, encoding='utf-8') as f:
+        head = {case["case"]: case for case in json.load(f)["cases"]}
+
+    regressions = 0
+    print(f'{"case":<36} {"base p50":>10} {"head p50":>10} {"change":>8}  {"base MB":>8} {"head MB":>8}')
+    for name in sorted(base.keys() & head.keys()):
+        before, after = base[name]["latency_ms"]["p50"], head[name]["latency_ms"]["p50"]
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif change < -threshold:
+            flag = '  improved'
+        print(f'{name:<36} {before:>10.2f} {after:>10.2f} {change:>+8.1%}  '
+              f'{base[name]["peak_rss_mb"]:>8} {head[name]["peak_rss_mb"]:>8}{flag}')
+
+    for name in sorted(base.keys() ^ head.keys()):
+        print(f'{name:<36} only in {"base" if name in base else "head"}')
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=lambda v: v.split(','), default=list(SIZES))
+    parser.add_argument('--counts', type=lambda v: [int(c) for c in v.split(',')], default=list(COUNTS))
+    parser.add_argument('--coords', type=lambda v: v.split(','), default=list(COORDINATE_TYPES))
+    parser.add_argument('--sources', type=lambda v: v.split(','), default=list(SOURCES))
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--image-format', default='JPEG', choices=['JPEG', 'PNG'])
+    parser.add_argument('--warm-caches', action='store_true', help='keep result/frame/HTTP caches enabled')
+    parser.add_argument('--quick', action='store_true', help=f'only sizes {QUICK_SIZES} and counts {QUICK_COUNTS}')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'))
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative p50 change counted as a regression')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    parser.add_argument('--generate', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold))
+
+    if args.generate:
+        with open(args.input, 'wb') as f:
+            f.write(synthetic_image(args.generate, args.image_format))
+        return
+
+    if args.case:
+        size, count, coordinate_type, source = args.case.split('/')
+        print(json.dumps(run_case(size, int(count), coordinate_type, source,
+                                  args.iterations, args.warmup, args.image_format, args.input)))
+        return
+
+    results = run_suite(args)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f'Wrote {len(results["cases"])} cases to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,4 +3,9 @@ from dify_plugin import Plugin, DifyPluginEnv
 plugin = Plugin(DifyPluginEnv(MAX_REQUEST_TIMEOUT=120))
 
 if __name__ == '__main__':
+    from utils.warmup import WARMUP_ENABLED, warm_up
+
+    # 在接收请求之前完成字体、编解码器和连接池的初始化
+    if WARMUP_ENABLED:
+        warm_up()
     plugin.run()
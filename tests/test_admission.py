@@ -0,0 +1,56 @@
+import pytest
+from PIL import Image
+
+from utils.admission import MemoryBudget
+from utils.errors import ImageTooLargeError
+from utils.image_cache import DecodedImageCache
+
+MB = 1024 * 1024
+
+
+def _frame(side: int) -> Image.Image:
+    # 每像素按 4 字节计：side=512 时 1MB
+    return Image.new('RGB', (side, side))
+
+
+def _fill(cache: DecodedImageCache, count: int) -> None:
+    for index in range(count):
+        # 第二次出现才缓存
+        cache.put(('key', index), _frame(512))
+        cache.put(('key', index), _frame(512))
+
+
+def test_rejects_reservation_larger_than_capacity():
+    budget = MemoryBudget(4 * MB)
+    with pytest.raises(ImageTooLargeError):
+        budget.acquire(5 * MB)
+    assert budget.stats()['reserved_mb'] == 0
+
+
+def test_reservation_within_capacity_is_not_clamped():
+    budget = MemoryBudget(4 * MB)
+    assert budget.acquire(3 * MB) == 3 * MB
+    budget.release(3 * MB)
+
+
+def test_caches_shrink_to_unreserved_room():
+    cache = DecodedImageCache(max_bytes=16 * MB)
+    _fill(cache, 6)
+    assert cache.nbytes == 6 * MB
+
+    budget = MemoryBudget(8 * MB, caches=lambda: [cache])
+    reserved = budget.acquire(5 * MB)
+    # 预留 5MB 后只剩 3MB 可供缓存，最早的条目被淘汰
+    assert cache.nbytes == 3 * MB
+    assert cache.get(('key', 0)) is None
+    assert cache.get(('key', 5)) is not None
+    assert budget.stats()['cached_mb'] == 3.0
+    budget.release(reserved)
+
+
+def test_caches_untouched_when_room_remains():
+    cache = DecodedImageCache(max_bytes=16 * MB)
+    _fill(cache, 2)
+    budget = MemoryBudget(8 * MB, caches=lambda: [cache])
+    budget.release(budget.acquire(4 * MB))
+    assert cache.nbytes == 2 * MB
@@ -0,0 +1,163 @@
+"""图像下载器：在本地 HTTP 服务上检查条件重验证和下载上限
+
+    python -m pytest tests
+"""
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 导入 SDK 时会 monkey patch；须在启动服务线程之前完成，服务与下载器都运行在 gevent 中
+import dify_plugin  # noqa: F401
+import pytest
+
+from utils import fetcher as fetcher_module
+from utils.errors import ImageFetchError, ImageTooLargeError
+from utils.fetcher import FetchCache, ImageFetcher
+
+IMAGE = hashlib.sha256(b'image').digest() * 4096
+MAX_BYTES = len(IMAGE) * 2
+OVERSIZED = b'\0' * (MAX_BYTES * 2)
+LAST_MODIFIED = 'Wed, 21 Oct 2026 07:28:00 GMT'
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+
+
+class ImageServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ImageHandler)
+        self.image = IMAGE
+        self.statuses: list[int] = []
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def take_statuses(self) -> list[int]:
+        statuses, self.statuses = self.statuses, []
+        return statuses
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server: ImageServer = self.server
+        etag = make_etag(server.image)
+        if self.path == '/etag.png':
+            if self.headers.get('If-None-Match') == etag:
+                return self.reply(304, headers={'ETag': etag})
+            return self.reply(200, server.image, headers={'ETag': etag})
+        if self.path == '/modified.png':
+            if self.headers.get('If-Modified-Since') == LAST_MODIFIED:
+                return self.reply(304, headers={'Last-Modified': LAST_MODIFIED})
+            return self.reply(200, server.image, headers={'Last-Modified': LAST_MODIFIED})
+        if self.path == '/plain.png':
+            return self.reply(200, server.image)
+        if self.path == '/large.png':
+            return self.reply(200, OVERSIZED)
+        if self.path == '/chunked.png':
+            return self.reply_chunked(OVERSIZED)
+        if self.path == '/page.html':
+            return self.reply(200, b'<html></html>', content_type='text/html')
+        self.reply(404)
+
+    def reply(self, status: int, body: bytes = b'', content_type: str = 'image/png',
+              headers: dict[str, str] | None = None) -> None:
+        self.server.statuses.append(status)
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端超限后提前断开
+            self.close_connection = True
+
+    def reply_chunked(self, body: bytes, chunk_size: int = 64 * 1024) -> None:
+        """不声明 Content-Length，只能在读取过程中发现超限"""
+        self.server.statuses.append(200)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for start in range(0, len(body), chunk_size):
+                chunk = body[start:start + chunk_size]
+                self.wfile.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ImageServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher():
+    return ImageFetcher(max_bytes=MAX_BYTES, cache=FetchCache(16 * 1024 * 1024))
+
+
+@pytest.mark.parametrize('path, statuses', [('etag.png', [200, 304, 304]), ('modified.png', [200, 304, 304])])
+def test_revalidation_returns_cached_body(server, fetcher, path, statuses):
+    bodies = [fetcher.fetch(f'{server.base_url}/{path}') for _ in range(3)]
+    assert server.take_statuses() == statuses
+    assert all(body == IMAGE for body in bodies)
+
+
+def test_changed_etag_downloads_again(server, fetcher):
+    fetcher.fetch(f'{server.base_url}/etag.png')
+    server.image = IMAGE[::-1]
+    assert fetcher.fetch(f'{server.base_url}/etag.png') == IMAGE[::-1]
+    assert server.take_statuses() == [200, 200]
+
+
+def test_response_without_validators_is_not_cached(server, fetcher):
+    for _ in range(2):
+        fetcher.fetch(f'{server.base_url}/plain.png')
+    assert server.take_statuses() == [200, 200]
+
+
+@pytest.mark.parametrize('path', ['large.png', 'chunked.png'])
+def test_download_over_cap_is_rejected(server, fetcher, path):
+    with pytest.raises(ImageTooLargeError):
+        fetcher.fetch(f'{server.base_url}/{path}')
+
+
+def test_non_image_response_is_rejected(server, fetcher):
+    with pytest.raises(ImageFetchError):
+        fetcher.fetch(f'{server.base_url}/page.html')
+
+
+def test_reserve_called_with_content_length(server, fetcher):
+    reserved = []
+    fetcher.fetch(f'{server.base_url}/plain.png', reserve=reserved.append)
+    assert reserved == [len(IMAGE)]
+
+
+@pytest.mark.parametrize('path', ['large.png', 'chunked.png'])
+def test_invoke_returns_413_over_cap(server, fetcher, monkeypatch, path):
+    from tools.draw_boxes import ImageMarkTool
+
+    monkeypatch.setattr(fetcher_module, '_fetcher', fetcher)
+    tool = ImageMarkTool.from_credentials({})
+    annotations = json.dumps({"annotations": [{"bbox": [100, 100, 500, 500], "label": "a"}]})
+    result = list(tool._invoke({'image_file': f'{server.base_url}/{path}', 'annotations': annotations}))[-1]
+    assert result.message.json_object['error_code'] == 413
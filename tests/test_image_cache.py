@@ -0,0 +1,26 @@
+"""解码帧缓存：键第二次出现时才缓存，首次返回的帧可直接原地绘制"""
+from PIL import Image
+
+from utils.image_cache import DecodedImageCache
+
+
+def test_first_sighting_is_not_cached():
+    cache = DecodedImageCache(16 * 1024 * 1024)
+    image = Image.new('RGB', (64, 64))
+    assert cache.put(('a', 0), image) is image
+    assert not image.readonly
+    assert cache.get(('a', 0)) is None
+
+
+def test_second_sighting_is_cached_as_read_only_view():
+    cache = DecodedImageCache(16 * 1024 * 1024)
+    cache.put(('a', 0), Image.new('RGB', (64, 64)))
+    view = cache.put(('a', 0), Image.new('RGB', (64, 64), (1, 2, 3)))
+    assert view.readonly
+
+    hit = cache.get(('a', 0))
+    assert hit.readonly and hit.getpixel((0, 0)) == (1, 2, 3)
+    # 在视图上绘制不影响缓存中的帧
+    hit.paste((9, 9, 9), (0, 0, 64, 64))
+    assert cache.get(('a', 0)).getpixel((0, 0)) == (1, 2, 3)
+    assert cache.stats()["entries"] == 1
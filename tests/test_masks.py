@@ -0,0 +1,78 @@
+import base64
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import utils.annotations as annotations_module
+from utils.admission import input_budget, input_reservation
+from utils.annotations import AnnotationBatch
+from utils.errors import AnnotationFormatError
+from utils.shapes import RLEMask, parse_shape
+
+
+def _png_mask(pixels: np.ndarray) -> str:
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8) * 255).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _reference_runs(pixels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # 整幅列优先展开后求差分
+    flat = np.concatenate(([0], pixels.T.ravel().astype(np.int8), [0]))
+    edges = np.diff(flat)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _checkerboard(side: int) -> np.ndarray:
+    return (np.indices((side, side)).sum(axis=0) % 2).astype(bool)
+
+
+@pytest.mark.parametrize('width', [1, 255, 256, 600])
+def test_image_mask_runs_match_whole_array(width):
+    rng = np.random.default_rng(width)
+    pixels = rng.random((37, width)) > 0.7
+    # 最后一列全为前景：游程延续到末尾
+    pixels[:, -1] = True
+    mask = RLEMask.from_image(Image.fromarray(pixels.astype(np.uint8) * 255), max_runs=10 ** 6)
+    starts, ends = _reference_runs(pixels)
+    np.testing.assert_array_equal(mask.starts, starts)
+    np.testing.assert_array_equal(mask.ends, ends)
+
+
+def test_checkerboard_image_mask_is_rejected():
+    with pytest.raises(AnnotationFormatError):
+        parse_shape({'mask': _png_mask(_checkerboard(64))}, max_mask_runs=100)
+
+
+def test_rle_counts_over_cap_are_rejected():
+    counts = [1] * 401
+    with pytest.raises(AnnotationFormatError):
+        parse_shape({'mask': {'size': [30, 30], 'counts': counts}}, max_mask_runs=100)
+    shape = parse_shape({'mask': {'size': [30, 30], 'counts': counts}}, max_mask_runs=200)
+    assert shape.mask.runs == 200
+
+
+def test_compressed_rle_over_cap_stops_decoding():
+    # 每个计数为 1 的压缩字符（'1'），4000 个计数
+    with pytest.raises(AnnotationFormatError):
+        parse_shape({'mask': {'size': [100, 100], 'counts': '1' * 4000}}, max_mask_runs=100)
+
+
+def test_total_runs_per_request_are_capped(monkeypatch):
+    monkeypatch.setattr(annotations_module, 'MAX_TOTAL_MASK_RUNS', 250)
+    item = {'mask': {'size': [30, 30], 'counts': [1] * 401}}
+    assert len(AnnotationBatch.from_annotations([item, {'bbox': [0, 0, 1, 1]}])) == 2
+    with pytest.raises(AnnotationFormatError):
+        AnnotationBatch.from_annotations([item, item])
+
+
+def test_mask_runs_are_charged_to_input_budget():
+    item = {'mask': _png_mask(_checkerboard(32))}
+    before = input_budget.stats()['admitted']
+    with input_reservation():
+        shape = parse_shape(item)
+        assert input_budget.stats()['admitted'] == before + 1
+        assert shape.mask.nbytes == shape.mask.runs * 16
+    assert input_budget.stats()['reserved_mb'] == 0
@@ -1,17 +1,80 @@
 import base64
 import json
 import requests
-import os
+import time
+from dataclasses import replace
 from io import BytesIO
 from collections.abc import Generator
+from itertools import repeat
 from typing import Any
-from pathlib import Path
 
-from PIL import Image, ImageDraw, ImageFont
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageSequence
 from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
 from dify_plugin.file.file import File
 
+from utils.admission import (
+    MIN_DEGRADED_SIDE,
+    account_input,
+    estimate_render_bytes,
+    input_reservation,
+    memory_budget,
+    reserve_input,
+)
+from utils.annotation_parser import iter_annotations, strip_markdown_fence
+from utils.annotations import MAX_ANNOTATIONS, AnnotationBatch
+from utils.concurrency import inflight_slot, run_in_thread
+from utils.encoder import (
+    DEFAULT_FRAME_DURATION,
+    OUTPUT_FORMATS,
+    EncodedImage,
+    GIFStreamEncoder,
+    PNGStripEncoder,
+    encode_image,
+    resolve_output_format,
+)
+from utils.errors import (
+    AnnotationFormatError,
+    DrawBoxesError,
+    ImageLoadError,
+    ImageTooLargeError,
+    ParameterError,
+)
+from utils.fetcher import get_fetcher
+from utils.fonts import font_cache
+from utils.glyphs import label_cache
+from utils.image_cache import image_cache, image_digest
+from utils.ingest import data_uri_payload_start, decode_base64, sniff_image_string
+from utils.layout import LabelLayout
+from utils.logger import get_logger
+from utils.metrics import METRIC_FORMATS, PerfRecorder, add_bytes, recording, span
+from utils.options import RenderOptions
+from utils.overlay import OUTPUT_MODES, annotation_bounds, encode_svg, item_extent
+from utils.probe import (
+    MAX_FRAMES,
+    MAX_IMAGE_PIXELS,
+    MAX_IMAGE_SIZE,
+    TILED_MAX_IMAGE_PIXELS,
+    TILED_MAX_IMAGE_SIZE,
+    open_image,
+)
+from utils.result_cache import make_cache_key, result_cache
+from utils.shapes import MASK_ALPHA, draw_keypoints, draw_polygons, fill_polygons, paint_masks
+from utils.strips import STRIP_HEIGHT, StripReader, open_strip_reader
+from utils.styles import DrawStyle, draw_dashed_rectangle, palette_color
+
+
+logger = get_logger(__name__)
+
+IMAGE_LOAD_ERROR = (
+    "Failed to load image. The image file may be invalid or corrupted. Please check the image file and try again."
+)
+
+
+def _default_if_none(value, default):
+    return default if value is None else value
+
 
 class ImageMarkTool(Tool):
     def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage]:
@@ -19,14 +82,9 @@ class ImageMarkTool(Tool):
             # 获取参数 - 使用新的 image_file 参数名
             image_file = tool_parameters.get('image_file')
             annotations_str = tool_parameters.get('annotations', '')
-            box_color = tool_parameters.get('box_color', '#ff0000')
-            text_color = tool_parameters.get('text_color', '#ffffff')
-            line_width = int(tool_parameters.get('line_width', 2))
-            font_size = int(tool_parameters.get('font_size', 16))
-            coordinate_type = tool_parameters.get('coordinate_type', 'relative')
             
-            # 调试日志
-            print(f"Debug: image_file type = {type(image_file)}, value = {image_file}")
+            # 调试日志（只记录类型，不格式化整个 File 对象）
+            logger.debug("image_file type = %s", type(image_file).__name__)
             
             # 验证必需参数
             if not image_file:
@@ -45,196 +103,590 @@ class ImageMarkTool(Tool):
                 })
                 return
             
-            # 清理 annotations_str (去除可能的反引号或空格)
-            if isinstance(annotations_str, str):
-                annotations_str = annotations_str.strip().strip('`').strip()
-                # 处理可能的 markdown json 块 ```json ... ```
-                if annotations_str.startswith('json'):
-                    annotations_str = annotations_str[4:].strip()
+            options = self._parse_options(tool_parameters)
+            metrics_format = self._parse_metrics_format(tool_parameters)
             
-            # 验证参数范围
-            if line_width < 1 or line_width > 20:
-                yield self.create_json_message({
-                    "success": False,
-                    "error": "line_width must be between 1 and 20",
-                    "error_code": 400
-                })
-                return
-                
-            if font_size < 8 or font_size > 72:
-                yield self.create_json_message({
-                    "success": False,
-                    "error": "font_size must be between 8 and 72",
-                    "error_code": 400
-                })
-                return
-            
-            # 验证颜色格式
-            if not self._is_valid_color(box_color):
-                yield self.create_json_message({
-                    "success": False,
-                    "error": "Invalid box_color format. Use hex format like #ff0000",
-                    "error_code": 400
-                })
-                return
-                
-            if not self._is_valid_color(text_color):
-                yield self.create_json_message({
-                    "success": False,
-                    "error": "Invalid text_color format. Use hex format like #ffffff",
-                    "error_code": 400
-                })
-                return
+            # 标注 JSON 在绘制前增量解析（结果缓存命中时无需解析）
+            recorder = PerfRecorder() if metrics_format else None
+            # 名额用尽时在此等待，限制同时下载和解码的图像数量
+            with inflight_slot(), recording(recorder):
+                encoded, result = self._render(image_file, annotations_str, options)
             
-            # 加载图像
-            image = self._load_image(image_file)
-            if image is None:
-                yield self.create_json_message({
-                    "success": False,
-                    "error": "Failed to load image. The image file may be invalid or corrupted. Please check the image file and try again.",
-                    "error_code": 404
-                })
-                return
+            # 使用blob消息返回图像（Dify标准方式）
+            yield self.create_blob_message(
+                blob=encoded.data,
+                meta={"mime_type": encoded.mime_type}
+            )
             
-            # 检查图像尺寸限制
-            max_size = 4096
-            if image.width > max_size or image.height > max_size:
-                yield self.create_json_message({
-                    "success": False,
-                    "error": f"Image size too large. Maximum size is {max_size}x{max_size}",
-                    "error_code": 413
-                })
-                return
+            # 返回处理结果信息
+            result["font_cache"] = font_cache.stats()
+            result["label_cache"] = label_cache.stats()
+            result["image_cache"] = image_cache.stats()
+            result["memory_budget"] = memory_budget.stats()
+            if recorder is not None:
+                result["metrics"] = recorder.export(metrics_format)
+            yield self.create_json_message(result)
             
-            # 解析标注数据
-            try:
-                annotations_data = json.loads(annotations_str)
-                
-                # 支持两种格式：
-                # 1. 包含annotations字段的对象: {"annotations": [...]}
-                # 2. 直接的标注对象或数组: {...} 或 [...]
-                if isinstance(annotations_data, dict) and 'annotations' in annotations_data:
-                    # 格式1: {"annotations": [...]}
-                    annotations = annotations_data['annotations']
-                elif isinstance(annotations_data, list):
-                    # 格式2: 直接的数组 [...]
-                    annotations = annotations_data
-                elif isinstance(annotations_data, dict):
-                    # 格式3: 单个标注对象 {...}，转换为数组
-                    annotations = [annotations_data]
-                else:
-                    yield self.create_json_message({
-                        "success": False,
-                        "error": "Invalid annotations format. Expected object or array",
-                        "error_code": 422
-                    })
-                    return
-                
-                if not isinstance(annotations, list):
-                    yield self.create_json_message({
-                        "success": False,
-                        "error": "annotations must be a list",
-                        "error_code": 422
-                    })
-                    return
-                    
-                if len(annotations) > 100:
-                    yield self.create_json_message({
-                        "success": False,
-                        "error": "Too many annotations. Maximum is 100",
-                        "error_code": 422
-                    })
-                    return
-                    
-            except json.JSONDecodeError as e:
-                yield self.create_json_message({
-                    "success": False,
-                    "error": f"Invalid JSON format in annotations: {str(e)}",
-                    "error_code": 422
-                })
-                return
+        except Exception as e:
+            yield self.create_json_message(self._error_payload(e))
+    
+    def _error_payload(self, e: Exception) -> dict:
+        """将异常转换为统一的错误结果"""
+        if isinstance(e, DrawBoxesError):
+            return {"success": False, "error": str(e), "error_code": e.error_code}
+        if isinstance(e, requests.exceptions.RequestException):
+            return {"success": False, "error": f"Network error when loading image: {str(e)}", "error_code": 404}
+        if isinstance(e, ValueError):
+            return {"success": False, "error": f"Invalid parameter value: {str(e)}", "error_code": 400}
+        if isinstance(e, MemoryError):
+            return {"success": False, "error": "Image too large to process", "error_code": 413}
+        return {"success": False, "error": f"Processing failed: {str(e)}", "error_code": 500}
+    
+    def _parse_options(self, tool_parameters: dict[str, Any]) -> RenderOptions:
+        """读取并验证绘制/编码参数"""
+        options = RenderOptions(
+            box_color=tool_parameters.get('box_color', '#ff0000'),
+            text_color=tool_parameters.get('text_color', '#ffffff'),
+            line_width=int(tool_parameters.get('line_width', 2)),
+            fill_opacity=float(tool_parameters.get('fill_opacity') or 0),
+            color_by_class=bool(tool_parameters.get('color_by_class', False)),
+            font_size=int(tool_parameters.get('font_size', 16)),
+            coordinate_type=tool_parameters.get('coordinate_type', 'relative'),
+            output_max_side=int(tool_parameters.get('output_max_side') or 0),
+            output_format=tool_parameters.get('output_format') or 'auto',
+            quality=int(tool_parameters.get('quality') or 85),
+            # 未设置的可选参数传入 None；压缩级别 0 是有效值，不能用 or 取默认值
+            png_compress_level=int(_default_if_none(tool_parameters.get('png_compress_level'), 6)),
+            png_optimize=bool(tool_parameters.get('png_optimize') or False),
+            multi_frame=bool(tool_parameters.get('multi_frame', False)),
+            output_mode=tool_parameters.get('output_mode') or 'image',
+            confidence_threshold=float(tool_parameters.get('confidence_threshold') or 0),
+        )
+        
+        # 验证参数范围
+        if options.line_width < 1 or options.line_width > 20:
+            raise ParameterError("line_width must be between 1 and 20")
+        
+        if options.fill_opacity < 0 or options.fill_opacity > 1:
+            raise ParameterError("fill_opacity must be between 0 and 1")
             
-            # 验证标注数据格式
-            valid_annotations = []
-            for i, annotation in enumerate(annotations):
-                if not isinstance(annotation, dict):
-                    continue
-                
-                # 支持多种边界框字段名称
-                bbox = None
-                for bbox_field in ['bbox', 'bbox_2d', 'bounding_box', 'box']:
-                    if bbox_field in annotation:
-                        bbox = annotation[bbox_field]
-                        break
-                
-                if bbox is None or not isinstance(bbox, list) or len(bbox) != 4:
-                    continue
-                    
-                try:
-                    bbox = [float(x) for x in bbox]
-                    # 统一使用bbox字段名
-                    annotation['bbox'] = bbox
-                    valid_annotations.append(annotation)
-                except (ValueError, TypeError):
-                    continue
+        if options.font_size < 8 or options.font_size > 72:
+            raise ParameterError("font_size must be between 8 and 72")
+        
+        if options.confidence_threshold < 0 or options.confidence_threshold > 1:
+            raise ParameterError("confidence_threshold must be between 0 and 1")
+        
+        if options.output_max_side and (options.output_max_side < 16 or options.output_max_side > 4096):
+            raise ParameterError("output_max_side must be between 16 and 4096")
+        
+        if options.output_format not in OUTPUT_FORMATS:
+            raise ParameterError(f"output_format must be one of: {', '.join(OUTPUT_FORMATS)}")
+        
+        if options.output_mode not in OUTPUT_MODES:
+            raise ParameterError(f"output_mode must be one of: {', '.join(OUTPUT_MODES)}")
+        
+        if options.quality < 1 or options.quality > 100:
+            raise ParameterError("quality must be between 1 and 100")
+        
+        if options.png_compress_level < 0 or options.png_compress_level > 9:
+            raise ParameterError("png_compress_level must be between 0 and 9")
+        
+        # 验证颜色格式
+        if not self._is_valid_color(options.box_color):
+            raise ParameterError("Invalid box_color format. Use hex format like #ff0000")
             
-            if not valid_annotations and annotations:
-                yield self.create_json_message({
-                    "success": False,
-                    "error": "No valid annotations found. Each annotation must have a 'bbox' field with 4 numbers",
-                    "error_code": 422
-                })
-                return
+        if not self._is_valid_color(options.text_color):
+            raise ParameterError("Invalid text_color format. Use hex format like #ffffff")
+        
+        return options
+    
+    def _parse_metrics_format(self, tool_parameters: dict[str, Any]) -> str | None:
+        """读取性能指标参数，未启用时返回 None"""
+        if not tool_parameters.get('include_metrics', False):
+            return None
+        
+        metrics_format = tool_parameters.get('metrics_format') or 'json'
+        if metrics_format not in METRIC_FORMATS:
+            raise ParameterError(f"metrics_format must be one of: {', '.join(METRIC_FORMATS)}")
+        return metrics_format
+    
+    def _parse_annotations_json(self, annotations_str):
+        """解析标注 JSON 字符串（兼容 markdown 代码块）"""
+        # 清理 annotations_str (去除可能的反引号或空格)
+        if not isinstance(annotations_str, str):
+            return annotations_str
+        
+        # 去除可能的 markdown json 块 ```json ... ```
+        start, end = strip_markdown_fence(annotations_str)
+        
+        try:
+            return json.loads(annotations_str[start:end])
+        except json.JSONDecodeError as e:
+            raise AnnotationFormatError(f"Invalid JSON format in annotations: {str(e)}")
+    
+    def _normalize_annotations(self, annotations_data) -> tuple[int, AnnotationBatch]:
+        """规范化标注数据，返回 (标注总数, 有效标注)
+
+        annotations_data 为 JSON 字符串时增量解析，逐条写入结构化数组。
+        """
+        # 支持三种格式：
+        # 1. 包含annotations字段的对象: {"annotations": [...]}
+        # 2. 直接的数组: [...]
+        # 3. 单个标注对象: {...}
+        if isinstance(annotations_data, str):
+            # JSON 文本：按上述格式逐个产出标注，不构建完整列表
+            annotations = iter_annotations(annotations_data)
+        elif isinstance(annotations_data, dict) and 'annotations' in annotations_data:
+            # 格式1: {"annotations": [...]}
+            annotations = annotations_data['annotations']
+            if not isinstance(annotations, list):
+                raise AnnotationFormatError("annotations must be a list")
+        elif isinstance(annotations_data, list):
+            # 格式2: 直接的数组 [...]
+            annotations = annotations_data
+        elif isinstance(annotations_data, dict):
+            # 格式3: 单个标注对象 {...}，转换为数组
+            annotations = [annotations_data]
+        else:
+            raise AnnotationFormatError("Invalid annotations format. Expected object or array")
+        
+        total = 0
+        
+        def counted():
+            nonlocal total
+            for annotation in annotations:
+                total += 1
+                if total > MAX_ANNOTATIONS:
+                    raise AnnotationFormatError(f"Too many annotations. Maximum is {MAX_ANNOTATIONS}")
+                yield annotation
+        
+        # 验证标注数据格式并转换为结构化数组
+        batch = AnnotationBatch.from_annotations(counted())
+        
+        if not len(batch) and total:
+            raise AnnotationFormatError(
+                "No valid annotations found. Each annotation must have a 'bbox' field with 4 numbers "
+                "or a 'polygon', 'mask' or 'keypoints' field"
+            )
+        
+        return total, batch
+    
+    def _render(self, image_file, annotations_data, options: RenderOptions) -> tuple[EncodedImage, dict]:
+        """加载、绘制并编码单张图像，返回 (编码结果, 结果信息)"""
+        # 输入字节从下载开始到渲染结束一直占用输入预算
+        with input_reservation():
+            # 获取图像原始字节
+            with span('fetch'):
+                image_bytes = self._load_image_bytes(image_file)
+            if not image_bytes:
+                raise ImageLoadError(IMAGE_LOAD_ERROR)
+            account_input(len(image_bytes))
+            add_bytes('input', len(image_bytes))
             
-            # 绘制标注
+            # 下载在 greenlet 中协作式等待；其余 CPU 密集型步骤在原生线程池中执行
+            return run_in_thread(self._render_bytes, image_bytes, annotations_data, options)
+    
+    def _render_bytes(self, image_bytes: bytes, annotations_data,
+                      options: RenderOptions) -> tuple[EncodedImage, dict]:
+        """绘制并编码已加载的图像字节"""
+        # 相同图像 + 相同标注/样式参数直接返回缓存的编码结果，无需解码
+        with span('cache_lookup'):
+            digest = image_digest(image_bytes)
+            cache_key = make_cache_key(digest, annotations_data, options)
+            cached = result_cache.get(cache_key)
+        if cached is not None:
+            add_bytes('output', len(cached.encoded.data))
+            return cached.encoded, {**cached.result, "result_cache": {"hit": True, **result_cache.stats()}}
+        
+        if isinstance(annotations_data, str):
+            add_bytes('annotations', len(annotations_data))
+        with span('parse'):
+            total_annotations, batch = self._normalize_annotations(annotations_data)
+        
+        # 按文件头尺寸、标注数和输出格式估算峰值内存，从共享预算中预留（不足时排队或降级）
+        with span('admission'):
+            options, reserved, admission = self._admit(image_bytes, batch, options)
+        add_bytes('memory_reserved', reserved)
+        try:
+            encoded, result = self._render_admitted(image_bytes, digest, batch, total_annotations, options)
+        finally:
+            memory_budget.release(reserved)
+        
+        # 降级后的结果与请求的参数不符，不写入缓存
+        if not admission["degraded"]:
+            result_cache.put(cache_key, encoded, result)
+        return encoded, {**result, "admission": admission, "result_cache": {"hit": False, **result_cache.stats()}}
+    
+    def _render_admitted(self, image_bytes: bytes, digest: str, batch: AnnotationBatch, total_annotations: int,
+                         options: RenderOptions) -> tuple[EncodedImage, dict]:
+        """按输出模式和图像类型选择渲染路径（已预留内存）"""
+        # 只输出标注层：尺寸取自文件头，不解码像素
+        if options.output_mode != 'image':
+            return self._render_layer(image_bytes, batch, total_annotations, options)
+        
+        # 多帧模式：动图/多页图像逐帧绘制并增量编码为 GIF 动图
+        if options.multi_frame:
+            try:
+                with span('validate'):
+                    source = open_image(image_bytes)
+            except Exception:
+                # 超限或无法识别的图像交给单帧路径处理（报错或分条渲染）
+                source = None
+            if source is not None and getattr(source, 'n_frames', 1) > 1:
+                return self._render_frames(source, batch, total_annotations, options)
+            # 单帧图像只绘制未指定帧或指定第 0 帧的标注
+            batch = batch.select(batch.frames <= 0)
+        
+        # 解码图像（同一源图反复标注时直接复用缓存的解码帧）
+        frame_key = (digest, options.output_max_side)
+        image = image_cache.get(frame_key)
+        if image is None:
+            try:
+                image = self._decode_image_or_none(image_bytes, options.output_max_side)
+            except ImageTooLargeError:
+                # 超出整帧解码上限时，可按条带读取的未压缩大图改为分条渲染（指定 output_max_side 时逐条缩小）
+                with span('validate'):
+                    reader = open_strip_reader(image_bytes)
+                if reader is None:
+                    raise
+                return self._render_tiled(reader, batch, total_annotations, options)
+            if image is None:
+                raise ImageLoadError(IMAGE_LOAD_ERROR)
+            image = image_cache.put(frame_key, image)
+        
+        # 坐标换算为像素并过滤（预览模式下图像被缩小，绝对坐标按同样比例缩放）
+        source_width, source_height = image.info.get('source_size', image.size)
+        pixel_batch = batch.to_pixels(
+            image.width, image.height, options.coordinate_type,
+            scale=(image.width / source_width, image.height / source_height),
+            min_confidence=options.confidence_threshold,
+        )
+        
+        # 绘制标注（缓存帧是只读视图，首次写入时自动复制，因此可直接原地绘制）
+        with span('draw'):
             annotated_image = self._draw_annotations(
-                image, valid_annotations, box_color, text_color, line_width, font_size, coordinate_type
+                image, pixel_batch, options.box_color, options.text_color,
+                options.line_width, options.font_size, in_place=True,
+                fill_opacity=options.fill_opacity, color_by_class=options.color_by_class
             )
-            
-            # 转换为二进制数据用于Dify显示
-            img_byte_arr = BytesIO()
-            annotated_image.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            # 使用blob消息返回图像（Dify标准方式）
-            yield self.create_blob_message(
-                blob=img_byte_arr,
-                meta={"mime_type": "image/png"}
+        
+        # 编码输出图像
+        with span('encode'):
+            encoded = encode_image(
+                annotated_image,
+                resolve_output_format(options.output_format, image.info.get('source_format')),
+                quality=options.quality,
+                png_compress_level=options.png_compress_level,
+                png_optimize=options.png_optimize,
             )
-            
-            # 返回处理结果信息
-            yield self.create_json_message({
-                "success": True,
-                "annotation_count": len(valid_annotations),
-                "total_annotations": len(annotations),
-                "image_size": {"width": annotated_image.width, "height": annotated_image.height},
-                "message": f"成功绘制{len(valid_annotations)}个标注"
-            })
-            
-        except requests.exceptions.RequestException as e:
-            yield self.create_json_message({
-                "success": False,
-                "error": f"Network error when loading image: {str(e)}",
-                "error_code": 404
-            })
-        except ValueError as e:
-            yield self.create_json_message({
-                "success": False,
-                "error": f"Invalid parameter value: {str(e)}",
-                "error_code": 400
-            })
-        except MemoryError:
-            yield self.create_json_message({
-                "success": False,
-                "error": "Image too large to process",
-                "error_code": 413
-            })
-        except Exception as e:
-            yield self.create_json_message({
-                "success": False,
-                "error": f"Processing failed: {str(e)}",
-                "error_code": 500
-            })
+        add_bytes('output', len(encoded.data))
+        
+        result = {
+            "success": True,
+            "annotation_count": len(pixel_batch),
+            "total_annotations": total_annotations,
+            "image_size": {"width": annotated_image.width, "height": annotated_image.height},
+            "source_size": {"width": source_width, "height": source_height},
+            "output": {
+                "format": encoded.format,
+                "mime_type": encoded.mime_type,
+                "bytes": len(encoded.data),
+                "encode_ms": round(encoded.encode_ms, 2)
+            },
+            "message": f"成功绘制{len(pixel_batch)}个标注"
+        }
+        return encoded, result
+    
+    def _admit(self, image_bytes: bytes, batch: AnnotationBatch,
+               options: RenderOptions) -> tuple[RenderOptions, int, dict]:
+        """估算峰值内存并从共享预算中预留，返回 (实际使用的参数, 预留字节数, 准入信息)
+
+        估算超过总预算时，整帧和逐帧渲染先降低输出分辨率（output_max_side）以放入
+        总预算，仍放不下（或无法降级）时以 413 拒绝。预算不足时按到达顺序排队，
+        排队超过 ADMISSION_TIMEOUT 时同样降低分辨率以放入当时的剩余预算；
+        分条渲染和只输出标注层的内存与图像大小基本无关，继续排队。
+        """
+        start = time.perf_counter()
+        try:
+            source = open_image(image_bytes, TILED_MAX_IMAGE_SIZE, TILED_MAX_IMAGE_PIXELS)
+        except Exception:
+            # 无法识别或超限的图像在渲染时报错，只预留固定开销
+            source = None
+        
+        def estimate(render_options: RenderOptions) -> tuple[int, bool]:
+            return self._estimate_memory(source, len(batch), render_options)
+        
+        requested, degradable = estimate(options)
+        admitted = options
+        if requested > memory_budget.capacity and degradable:
+            admitted = self._degrade(source, options, memory_budget.capacity, estimate)
+        
+        def degrade(available: int) -> int:
+            nonlocal admitted
+            admitted = self._degrade(source, options, available, estimate)
+            return estimate(admitted)[0]
+        
+        reserved = memory_budget.acquire(estimate(admitted)[0], degrade if degradable else None)
+        
+        admission = {
+            "estimated_mb": round(requested / (1024 * 1024), 1),
+            "reserved_mb": round(reserved / (1024 * 1024), 1),
+            "wait_ms": round((time.perf_counter() - start) * 1000, 2),
+            "degraded": admitted is not options,
+        }
+        if admitted is not options:
+            memory_budget.record_degraded()
+            admission["output_max_side"] = admitted.output_max_side
+            logger.info(
+                "Memory budget: degraded %.1f MB request to output_max_side=%s",
+                requested / (1024 * 1024), admitted.output_max_side,
+            )
+        return admitted, reserved, admission
+    
+    def _estimate_memory(self, source: Image.Image | None, annotation_count: int,
+                         options: RenderOptions) -> tuple[int, bool]:
+        """按 _render_admitted 将选择的渲染路径估算峰值内存，返回 (字节数, 能否降低分辨率)"""
+        if source is None:
+            return estimate_render_bytes('frame', (0, 0), (0, 0), None, 'png', annotation_count), False
+        
+        target_size = self._target_size(source.size, options.output_max_side) or source.size
+        if options.output_mode != 'image':
+            output_format = 'svg' if options.output_mode == 'svg' else 'png'
+            path, degradable = 'layer', False
+        elif options.multi_frame and getattr(source, 'n_frames', 1) > 1:
+            output_format, path, degradable = 'gif', 'frames', True
+        elif max(source.size) > MAX_IMAGE_SIZE or source.width * source.height > MAX_IMAGE_PIXELS:
+            output_format, path, degradable = 'png', 'tiled', False
+        else:
+            output_format = resolve_output_format(options.output_format, source.format)
+            path, degradable = 'frame', True
+        nbytes = estimate_render_bytes(
+            path, source.size, target_size, source.format, output_format, annotation_count
+        )
+        return nbytes, degradable
+    
+    def _degrade(self, source: Image.Image, options: RenderOptions, limit: int, estimate) -> RenderOptions:
+        """逐步缩小 output_max_side（每次 3/4，不低于 MIN_DEGRADED_SIDE），直到估算不超过 limit"""
+        side = max(self._target_size(source.size, options.output_max_side) or source.size)
+        degraded = options
+        while side > MIN_DEGRADED_SIDE:
+            side = max(MIN_DEGRADED_SIDE, side * 3 // 4)
+            degraded = replace(options, output_max_side=side)
+            if estimate(degraded)[0] <= limit:
+                break
+        return degraded
+    
+    def _render_tiled(self, reader: StripReader, batch: AnnotationBatch, total_annotations: int,
+                      options: RenderOptions) -> tuple[EncodedImage, dict]:
+        """分条渲染大图：逐条带读取、绘制与之相交的标注，并增量编码为 PNG
+
+        排版基于整幅图像的尺寸一次完成，峰值内存只与条带大小相关，与图像大小无关。
+        指定 output_max_side 时每个条带读取后先缩小，标注在缩小后的坐标上绘制。
+        """
+        source_width, source_height = reader.size
+        target_size = self._target_size(reader.size, options.output_max_side)
+        width, height = target_size or reader.size
+        strip_height = reader.strip_rows(target_size) if target_size else STRIP_HEIGHT
+        pixel_batch = batch.to_pixels(
+            width, height, options.coordinate_type,
+            scale=(width / source_width, height / source_height),
+            min_confidence=options.confidence_threshold,
+        )
+        with span('draw'):
+            styles, items = self._plan_annotations(
+                width, height, pixel_batch, options.box_color, options.text_color,
+                options.line_width, options.font_size,
+                fill_opacity=options.fill_opacity, color_by_class=options.color_by_class
+            )
+        
+        tops, bottoms = self._item_rows(items, styles)
+        encoder = PNGStripEncoder(width, height, options.png_compress_level)
+        strips = 0
+        for top in range(0, height, strip_height):
+            bottom = min(top + strip_height, height)
+            with span('decode'):
+                strip = reader.read_resized(top, bottom, target_size) if target_size else reader.read(top, bottom)
+            with span('draw'):
+                selected = np.flatnonzero((tops < bottom) & (bottoms >= top))
+                self._paint_annotations(strip, [items[i] for i in selected], styles, offset=(0, top))
+            with span('encode'):
+                encoder.write(strip)
+            strips += 1
+        with span('encode'):
+            encoded = encoder.finish()
+        add_bytes('output', len(encoded.data))
+        logger.debug("Tiled render %sx%s in %s strips of %s rows", width, height, strips, strip_height)
+        
+        result = {
+            "success": True,
+            "annotation_count": len(pixel_batch),
+            "total_annotations": total_annotations,
+            "image_size": {"width": width, "height": height},
+            "source_size": {"width": source_width, "height": source_height},
+            "output": {
+                "format": encoded.format,
+                "mime_type": encoded.mime_type,
+                "bytes": len(encoded.data),
+                "encode_ms": round(encoded.encode_ms, 2)
+            },
+            "tiled": {"strips": strips, "strip_height": strip_height},
+            "message": f"成功绘制{len(pixel_batch)}个标注"
+        }
+        # 分条渲染只能增量编码为 PNG，明确要求的其他格式在结果中注明
+        if options.output_format not in ('auto', 'png'):
+            result["output"]["format_overridden"] = {"requested": options.output_format, "reason": "tiled"}
+            logger.info("Tiled render: output_format %s overridden to png", options.output_format)
+        return encoded, result
+    
+    def _render_layer(self, image_bytes: bytes, batch: AnnotationBatch, total_annotations: int,
+                      options: RenderOptions) -> tuple[EncodedImage, dict]:
+        """只输出标注层：SVG 文档，或裁剪到标注范围的透明 PNG 图层（附带偏移）
+
+        只读取文件头中的尺寸，坐标换算和标签排版与 _draw_annotations 相同，
+        耗时与图像分辨率无关。多帧图像只输出第一帧的标注。
+        """
+        with span('validate'):
+            try:
+                source = open_image(image_bytes)
+            except ImageTooLargeError:
+                raise
+            except Exception as e:
+                logger.warning("open_image exception: %s", e)
+                raise ImageLoadError(IMAGE_LOAD_ERROR)
+        
+        source_width, source_height = source.size
+        width, height = self._target_size(source.size, options.output_max_side) or source.size
+        if options.multi_frame:
+            batch = batch.select(batch.frames <= 0)
+        pixel_batch = batch.to_pixels(
+            width, height, options.coordinate_type,
+            scale=(width / source_width, height / source_height),
+            min_confidence=options.confidence_threshold,
+        )
+        with span('draw'):
+            styles, items = self._plan_annotations(
+                width, height, pixel_batch, options.box_color, options.text_color,
+                options.line_width, options.font_size,
+                fill_opacity=options.fill_opacity, color_by_class=options.color_by_class
+            )
+        
+        layer = {}
+        if options.output_mode == 'svg':
+            with span('encode'):
+                encoded = encode_svg(width, height, items, styles)
+        else:
+            # 没有可绘制的标注时输出位于原点的 1x1 透明图层
+            left, top, right, bottom = annotation_bounds(items, styles, width, height) or (0, 0, 1, 1)
+            # 与分条渲染一样逐条带绘制并增量编码，临时内存与图层大小无关
+            tops, bottoms = self._item_rows(items, styles)
+            encoder = PNGStripEncoder(right - left, bottom - top, options.png_compress_level, mode='RGBA')
+            for strip_top in range(top, bottom, STRIP_HEIGHT):
+                strip_bottom = min(strip_top + STRIP_HEIGHT, bottom)
+                with span('draw'):
+                    strip = Image.new('RGBA', (right - left, strip_bottom - strip_top), (0, 0, 0, 0))
+                    selected = np.flatnonzero((tops < strip_bottom) & (bottoms >= strip_top))
+                    self._paint_annotations(strip, [items[i] for i in selected], styles, offset=(left, strip_top))
+                with span('encode'):
+                    encoder.write(strip)
+            with span('encode'):
+                encoded = encoder.finish()
+            layer = {"overlay": {"x": left, "y": top, "width": right - left, "height": bottom - top}}
+        add_bytes('output', len(encoded.data))
+        
+        result = {
+            "success": True,
+            "annotation_count": len(pixel_batch),
+            "total_annotations": total_annotations,
+            "image_size": {"width": width, "height": height},
+            "source_size": {"width": source_width, "height": source_height},
+            "output": {
+                "format": encoded.format,
+                "mime_type": encoded.mime_type,
+                "bytes": len(encoded.data),
+                "encode_ms": round(encoded.encode_ms, 2)
+            },
+            **layer,
+            "message": f"成功绘制{len(pixel_batch)}个标注"
+        }
+        return encoded, result
+    
+    def _item_rows(self, items: list[tuple], styles: list[DrawStyle]) -> tuple[np.ndarray, np.ndarray]:
+        """每个标注（边界框 + 形状 + 标签）覆盖的行区间，用于挑出与条带相交的标注"""
+        extents = np.array([item_extent(item, styles) for item in items], dtype=np.int64).reshape(-1, 4)
+        return extents[:, 1], extents[:, 3]
+    
+    def _render_frames(self, source: Image.Image, batch: AnnotationBatch, total_annotations: int,
+                       options: RenderOptions) -> tuple[EncodedImage, dict]:
+        """逐帧渲染多帧图像（GIF、APNG、多页 TIFF、动态 WebP），增量编码为 GIF 动图
+
+        每次只解码一帧，绘制该帧的标注后立即交给编码器，峰值内存与帧数无关。
+        没有标注的帧不排版、不绘制；与上一帧相同的帧不重复编码。
+        """
+        n_frames = source.n_frames
+        if n_frames > MAX_FRAMES:
+            raise ImageTooLargeError(f"Too many frames. Maximum is {MAX_FRAMES}")
+        
+        source_width, source_height = source.size
+        width, height = self._target_size(source.size, options.output_max_side) or source.size
+        pixel_batch = batch.to_pixels(
+            width, height, options.coordinate_type,
+            scale=(width / source_width, height / source_height),
+            min_confidence=options.confidence_threshold,
+        )
+        # 帧序号超出源图帧数的标注不会被绘制
+        pixel_batch = pixel_batch.select(pixel_batch.frames < n_frames)
+        
+        # GIF 源图没有 NETSCAPE 扩展时只播放一次，其余格式默认循环播放
+        loop = source.info.get('loop', None if source.format == 'GIF' else 0)
+        encoder = GIFStreamEncoder(width, height, loop=loop)
+        annotated_frames = 0
+        for index, frame in enumerate(ImageSequence.Iterator(source)):
+            with span('decode'):
+                image = frame.convert('RGB')
+                if image.size != (width, height):
+                    image = image.resize((width, height), Image.Resampling.BICUBIC, reducing_gap=2.0)
+            # WebP 的帧时长在解码后才写入 info
+            duration = frame.info.get('duration') or DEFAULT_FRAME_DURATION
+            frame_batch = pixel_batch.select((pixel_batch.frames < 0) | (pixel_batch.frames == index))
+            if len(frame_batch):
+                with span('draw'):
+                    self._draw_annotations(
+                        image, frame_batch, options.box_color, options.text_color,
+                        options.line_width, options.font_size, in_place=True,
+                        fill_opacity=options.fill_opacity, color_by_class=options.color_by_class
+                    )
+                annotated_frames += 1
+            with span('encode'):
+                encoder.write(image, duration)
+        with span('encode'):
+            encoded = encoder.finish()
+        add_bytes('output', len(encoded.data))
+        logger.debug(
+            "Multi-frame render %sx%s: %s frames, %s annotated, %s encoded",
+            width, height, n_frames, annotated_frames, encoder.frames_written
+        )
+        
+        result = {
+            "success": True,
+            "annotation_count": len(pixel_batch),
+            "total_annotations": total_annotations,
+            "image_size": {"width": width, "height": height},
+            "source_size": {"width": source_width, "height": source_height},
+            "output": {
+                "format": encoded.format,
+                "mime_type": encoded.mime_type,
+                "bytes": len(encoded.data),
+                "encode_ms": round(encoded.encode_ms, 2)
+            },
+            "frames": {
+                "count": n_frames,
+                "annotated": annotated_frames,
+                "encoded": encoder.frames_written,
+                "skipped": n_frames - encoder.frames_written,
+            },
+            "message": f"成功在{annotated_frames}帧上绘制{len(pixel_batch)}个标注"
+        }
+        return encoded, result
     
     def _is_valid_color(self, color: str) -> bool:
         """验证颜色格式"""
@@ -250,345 +702,402 @@ class ImageMarkTool(Tool):
         except ValueError:
             return False
     
-    def _load_image(self, image_data) -> Image.Image:
+    def _load_image(self, image_data, max_side: int = 0) -> Image.Image:
         """加载图像数据 - 支持 Dify File 对象和多种格式"""
+        image_bytes = self._load_image_bytes(image_data)
+        if not image_bytes:
+            return None
+        return self._decode_image_or_none(image_bytes, max_side)
+    
+    def _decode_image_or_none(self, image_bytes: bytes, max_side: int = 0) -> Image.Image:
+        """解码图像，失败时返回 None（尺寸超限仍抛出 ImageTooLargeError）"""
+        try:
+            return self._decode_image(image_bytes, max_side)
+        except ImageTooLargeError:
+            raise
+        except Exception as e:
+            logger.warning("_decode_image exception: %s", e)
+            return None
+    
+    def _load_image_bytes(self, image_data) -> bytes | bytearray | None:
+        """获取图像原始字节 - 支持 Dify File 对象和多种格式"""
         try:
-            print(f"Debug: _load_image called with type: {type(image_data)}")
+            logger.debug("_load_image_bytes called with type: %s", type(image_data).__name__)
             
             # 1. 优先处理 Dify File 对象
             if isinstance(image_data, File):
-                print(f"Debug: Processing Dify File object")
+                logger.debug("Processing Dify File object")
                 # 尝试使用 blob 属性获取图像数据
                 try:
                     image_bytes = image_data.blob
                     if image_bytes:
-                        print(f"Debug: Got image bytes from blob, size: {len(image_bytes)}")
-                        return Image.open(BytesIO(image_bytes)).convert('RGB')
+                        logger.debug("Got image bytes from blob, size: %s", len(image_bytes))
+                        return image_bytes
                 except Exception as e:
-                    print(f"Debug: Failed to get blob: {e}")
+                    logger.debug("Failed to get blob: %s", e)
                 
                 # 如果 blob 不可用，尝试使用 URL
                 try:
                     # 尝试获取 URL (可能是 url 或 remote_url 属性)
                     image_url = getattr(image_data, 'url', None) or getattr(image_data, 'remote_url', None)
                     if image_url:
-                        print(f"Debug: Got URL from File object: {image_url[:100]}...")
-                        return self._load_image_from_url(image_url)
+                        logger.debug("Got URL from File object: %.100s", image_url)
+                        image_bytes = self._load_bytes_from_url(image_url)
+                        if image_bytes:
+                            return image_bytes
+                except ImageTooLargeError:
+                    raise
                 except Exception as e:
-                    print(f"Debug: Failed to get URL from File: {e}")
+                    logger.debug("Failed to get URL from File: %s", e)
                 
                 # 尝试获取 transfer_method 和对应数据
                 try:
                     transfer_method = getattr(image_data, 'transfer_method', None)
-                    print(f"Debug: File transfer_method: {transfer_method}")
+                    logger.debug("File transfer_method: %s", transfer_method)
                     
                     if transfer_method == 'remote_url':
                         url = getattr(image_data, 'remote_url', None) or getattr(image_data, 'url', None)
                         if url:
-                            return self._load_image_from_url(url)
+                            return self._load_bytes_from_url(url)
                     elif transfer_method == 'local_file':
                         # 对于本地文件,尝试使用 blob
-                        image_bytes = image_data.blob
-                        if image_bytes:
-                            return Image.open(BytesIO(image_bytes)).convert('RGB')
+                        return image_data.blob or None
+                except ImageTooLargeError:
+                    raise
                 except Exception as e:
-                    print(f"Debug: Failed to process File by transfer_method: {e}")
+                    logger.debug("Failed to process File by transfer_method: %s", e)
                 
                 return None
             
             # 2. 处理字典格式 (兼容旧格式)
             if isinstance(image_data, dict):
-                print(f"Debug: Processing dict format")
+                logger.debug("Processing dict format")
                 if "#files#" in image_data:
                     files = image_data.get("#files#", [])
                     if files and len(files) > 0:
                         file_info = files[0]
                         image_url = file_info.get("url") or file_info.get("remote_url")
                         if image_url:
-                            return self._load_image_from_url(image_url)
+                            return self._load_bytes_from_url(image_url)
                 return None
             
             # 3. 处理字符串格式 (URL 或 Base64)
             if isinstance(image_data, str):
-                print(f"Debug: Processing string format, length: {len(image_data)}")
-                cleaned_data = image_data.strip().strip('`').strip()
-                
-                # 尝试解析为 JSON
-                try:
-                    parsed_data = json.loads(cleaned_data)
-                    if isinstance(parsed_data, dict) and "#files#" in parsed_data:
-                        return self._load_image(parsed_data)
-                except (json.JSONDecodeError, ValueError):
-                    pass
+                logger.debug("Processing string format, length: %s", len(image_data))
+                # 只计算去除空白和反引号后的区间，按前缀判断类型，避免复制和整体 json.loads
+                start, end = strip_markdown_fence(image_data)
+                if sniff_image_string(image_data, start, end) == 'json':
+                    try:
+                        parsed_data = json.loads(image_data[start:end])
+                        if isinstance(parsed_data, dict) and "#files#" in parsed_data:
+                            return self._load_image_bytes(parsed_data)
+                    except (json.JSONDecodeError, ValueError):
+                        pass
                 
-                return self._load_image_from_url(cleaned_data)
+                return self._load_bytes_from_url(image_data, start, end)
             
-            print(f"Debug: Unsupported image_data type: {type(image_data)}")
+            logger.warning("Unsupported image_data type: %s", type(image_data).__name__)
             return None
             
+        except ImageTooLargeError:
+            raise
         except Exception as e:
-            print(f"Debug: _load_image exception: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.warning("_load_image_bytes exception: %s", e)
+            logger.debug("_load_image_bytes traceback", exc_info=True)
             return None
     
-    def _load_image_from_url(self, url_or_data: str) -> Image.Image:
-        """从 URL 或 Base64 加载图像"""
+    def _load_bytes_from_url(self, url_or_data: str, start: int = 0,
+                             end: int | None = None) -> bytes | bytearray | None:
+        """从 URL 或 Base64 获取图像字节（只处理 url_or_data[start:end] 区间）"""
         try:
-            if url_or_data.startswith('http'):
-                response = requests.get(url_or_data, timeout=30)
-                response.raise_for_status()
-                
-                if response.status_code != 200:
-                    print(f"Debug: HTTP error {response.status_code}")
-                    return None
-                
-                content_type = response.headers.get('content-type', '').lower()
-                if content_type and not content_type.startswith('image/'):
-                    print(f"Debug: Invalid content type '{content_type}'")
-                    return None
+            end = len(url_or_data) if end is None else end
+            kind = sniff_image_string(url_or_data, start, end)
+            if kind == 'url':
+                return get_fetcher().fetch(url_or_data[start:end], reserve=reserve_input)
                 
-                if len(response.content) == 0:
-                    print(f"Debug: Empty response content")
-                    return None
-                
-                return Image.open(BytesIO(response.content)).convert('RGB')
-                
-            elif url_or_data.startswith('data:image'):
-                base64_data = url_or_data.split(',')[1]
-                image_bytes = base64.b64decode(base64_data)
-                return Image.open(BytesIO(image_bytes)).convert('RGB')
+            elif kind == 'data_uri':
+                # 数据直接从逗号之后解码，不 split 出整段副本
+                return decode_base64(url_or_data, data_uri_payload_start(url_or_data, start, end), end)
             else:
                 # 尝试作为纯 Base64 处理
-                image_bytes = base64.b64decode(url_or_data)
-                return Image.open(BytesIO(image_bytes)).convert('RGB')
+                return decode_base64(url_or_data, start, end)
                 
+        except ImageTooLargeError:
+            raise
         except Exception as e:
-            print(f"Debug: _load_image_from_url exception: {e}")
+            logger.warning("_load_bytes_from_url exception: %s", e)
             return None
     
-    def _download_font(self) -> str | None:
-        """下载开源中文字体 (WenQuanYi Micro Hei)"""
-        try:
-            # 确定字体存放路径
-            current_dir = Path(__file__).parent.parent
-            assets_dir = current_dir / "_assets"
-            if not assets_dir.exists():
-                assets_dir.mkdir(parents=True, exist_ok=True)
-            
-            font_path = assets_dir / "wqy-microhei.ttc"
-            
-            # 如果字体已存在，直接返回路径
-            if font_path.exists():
-                return str(font_path)
-                
-            print(f"Debug: Downloading font to {font_path}...")
-            # 使用 GitHub Raw 加速地址或 CDN
-            font_url = "https://github.com/anthonyfok/fonts-wqy-microhei/raw/master/wqy-microhei.ttc"
-            
-            response = requests.get(font_url, timeout=60, stream=True)
-            response.raise_for_status()
-            
-            with open(font_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    
-            print("Debug: Font download completed successfully")
-            return str(font_path)
-            
-        except Exception as e:
-            print(f"Debug: Failed to download font: {e}")
+    def _decode_image(self, image_bytes: bytes, max_side: int = 0) -> Image.Image:
+        """校验文件头后解码为 RGB 图像（超限图像不会分配像素缓冲区）
+
+        指定 max_side 时按最长边缩小输出；JPEG 借助 draft 模式直接以
+        1/2、1/4、1/8 的 DCT 缩放解码，避免先解出全分辨率像素。
+        原始尺寸和格式记录在 image.info['source_size'] / ['source_format'] 中。
+        """
+        with span('validate'):
+            image = open_image(image_bytes)
+        source_size = image.size
+        source_format = image.format
+
+        target_size = self._target_size(source_size, max_side)
+        if target_size is not None:
+            if image.format == 'JPEG':
+                image.draft('RGB', target_size)
+                logger.debug("JPEG draft decode %s -> %s", source_size, image.size)
+
+        with span('decode'):
+            image = image.convert('RGB')
+            if target_size is not None and image.size != target_size:
+                image = image.resize(target_size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+
+        image.info['source_size'] = source_size
+        image.info['source_format'] = source_format
+        return image
+
+    def _target_size(self, source_size: tuple[int, int], max_side: int) -> tuple[int, int] | None:
+        """按最长边 max_side 等比缩小后的尺寸，无需缩小时返回 None"""
+        if not max_side or max(source_size) <= max_side:
             return None
+        scale = max_side / max(source_size)
+        return max(1, round(source_size[0] * scale)), max(1, round(source_size[1] * scale))
+    
+    def _draw_annotations(self, image: Image.Image, annotations: AnnotationBatch,
+                         box_color: str, text_color: str, line_width: int, font_size: int,
+                         in_place: bool = False, fill_opacity: float = 0.0,
+                         color_by_class: bool = False) -> Image.Image:
+        """在图像上绘制标注（坐标已换算为像素；in_place=True 时直接在传入的图像上绘制）"""
+        # 调用方不再需要原图时直接绘制，省去一次整帧分配和复制
+        annotated_image = image if in_place else image.copy()
+        styles, items = self._plan_annotations(
+            image.width, image.height, annotations, box_color, text_color, line_width, font_size,
+            fill_opacity=fill_opacity, color_by_class=color_by_class
+        )
+        self._paint_annotations(annotated_image, items, styles)
+        return annotated_image
+    
+    def _plan_annotations(self, width: int, height: int, annotations: AnnotationBatch,
+                          box_color: str, text_color: str, line_width: int, font_size: int,
+                          fill_opacity: float = 0.0,
+                          color_by_class: bool = False) -> tuple[list[DrawStyle], list[tuple]]:
+        """解析样式、生成标签位图并计算位置
 
-    def _draw_annotations(self, image: Image.Image, annotations: list, 
-                         box_color: str, text_color: str, line_width: int, font_size: int, coordinate_type: str = 'relative') -> Image.Image:
-        """在图像上绘制标注"""
-        # 创建图像副本
-        annotated_image = image.copy()
-        draw = ImageDraw.Draw(annotated_image)
-        
+        返回 (绘制样式表, [(边界框, 标签位图, 粘贴位置, 样式下标, 形状)])。标注未覆盖的
+        样式字段取工具参数；color_by_class 时边框颜色按类别取自调色板。
+        只依赖图像尺寸，不需要像素数据，因此分条渲染时可以先对整幅图像排版，
+        再逐条带绘制。
+        """
         # 计算基于图像尺寸的缩放因子（使用更温和的缩放算法）
         # 确保缩放因子在 0.5-1.5 之间，避免过度缩放
-        scale_factor = 0.5 + 0.5 * (min(image.width, image.height) / 1000.0)
+        scale_factor = 0.5 + 0.5 * (min(width, height) / 1000.0)
         
         # 计算实际字体大小，并设置合理的最小值和最大值限制
         actual_font_size = int(font_size * scale_factor)
         actual_font_size = max(8, min(actual_font_size, 120))  # 最小8像素，最大120像素
         
         # 计算实际线框宽度，并设置合理的最小值和最大值限制
-        actual_line_width = int(line_width * scale_factor)
-        actual_line_width = max(1, min(actual_line_width, 50))  # 最小1像素，最大50像素
+        def scale_line_width(value: int) -> int:
+            return max(1, min(int(value * scale_factor), 50))  # 最小1像素，最大50像素
         
         # 添加调试信息，显示缩放计算过程
-        print(f"Debug: Image size: {image.width}x{image.height}")
-        print(f"Debug: Scale factor: {scale_factor:.2f}")
-        print(f"Debug: Font size: {font_size} -> {actual_font_size} (scale: {scale_factor:.2f})")
-        print(f"Debug: Line width: {line_width} -> {actual_line_width} (scale: {scale_factor:.2f})")
-        
-        # 尝试加载字体
-        font = None
-        font_loaded = False
-        
-        # 尝试多种字体路径 - 优先使用支持中文的字体
-        font_paths = [
-            # 自动下载的本地字体 (最高优先级)
-            str(Path(__file__).parent.parent / "_assets" / "wqy-microhei.ttc"),
-            # 支持中文的字体 (优先)
-            "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-            "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
-            "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
-            "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
-            "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
-            "/usr/share/fonts/wqy-microhei/wqy-microhei.ttc",
-            "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
-            # Debian/Ubuntu 中文字体
-            "/usr/share/fonts/truetype/arphic/uming.ttc",
-            "/usr/share/fonts/truetype/arphic/ukai.ttc",
-            # Alpine Linux 中文字体
-            "/usr/share/fonts/noto/NotoSansCJK-Regular.ttc",
-            # macOS 中文字体 (本地开发环境)
-            "/System/Library/Fonts/PingFang.ttc",
-            "/System/Library/Fonts/STHeiti Light.ttc",
-            "/System/Library/Fonts/STHeiti Medium.ttc",
-            "/Library/Fonts/Arial Unicode.ttf",
-            # 其他通用字体
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-            "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-            "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
-            "/System/Library/Fonts/Arial.ttf",
-            "/System/Library/Fonts/Helvetica.ttc",
-        ]
+        logger.debug(
+            "Image size: %sx%s, scale factor: %.2f, font size: %s -> %s, line width: %s -> %s",
+            width, height, scale_factor, font_size, actual_font_size, line_width, scale_line_width(line_width)
+        )
         
-        for font_path in font_paths:
-            try:
-                font = ImageFont.truetype(font_path, actual_font_size)
-                font_loaded = True
-                print(f"Debug: Successfully loaded font: {font_path}")
-                break
-            except (OSError, IOError):
-                continue
+        # 从进程级缓存获取字体（候选路径只探测一次）
+        with span('font'):
+            # 先取路径再加载，后台字体下载完成时字体与缓存键保持一致
+            font_path = font_cache.resolve_font_path()
+            font, _ = font_cache.load(font_path, actual_font_size)
+            font_key = (font_path, actual_font_size)
+        
+        # 计算文本位置，使用缩放后的字体大小和间距
+        text_spacing = max(2, int(5 * scale_factor))  # 确保最小间距
+        padding = max(1, int(2 * scale_factor))
+        layout = LabelLayout(width, height, cell_size=actual_font_size * 4)
+        
+        # 相同的 (样式, 类别颜色) 共用一个绘制样式，填充按样式分层合成
+        draw_styles: list[DrawStyle] = []
+        resolved: dict[tuple[int, str | None], int] = {}
         
-        # 如果所有TrueType字体都加载失败，尝试下载并使用自带字体
-        if not font_loaded:
-            print("Debug: No system fonts found, trying to download fallback font...")
-            downloaded_font = self._download_font()
-            if downloaded_font:
+        def resolve_style(style_id: int, label: str) -> int:
+            style = annotations.styles[style_id]
+            class_color = palette_color(label) if color_by_class and style.color is None else None
+            key = (style_id, class_color)
+            index = resolved.get(key)
+            if index is None:
+                opacity = fill_opacity if style.fill_opacity is None else style.fill_opacity
+                index = resolved[key] = len(draw_styles)
+                draw_styles.append(DrawStyle(
+                    color=style.color or class_color or box_color,
+                    text_color=style.text_color or text_color,
+                    line_width=scale_line_width(style.line_width or line_width),
+                    fill_alpha=round(opacity * 255),
+                    dashed=style.dashed,
+                ))
+            return index
+        
+        items = []
+        for box, label, confidence, style_id, shape in zip(
+            annotations.boxes.tolist(), annotations.labels, annotations.confidences.tolist(),
+            annotations.style_ids.tolist(), annotations.shapes or repeat(None)
+        ):
+            bitmap, position = None, None
+            style_index = resolve_style(style_id, label)
+            style = draw_styles[style_index]
+            
+            # 绘制标签文本
+            if label:
                 try:
-                    font = ImageFont.truetype(downloaded_font, actual_font_size)
-                    font_loaded = True
-                    print(f"Debug: Successfully loaded downloaded font: {downloaded_font}")
+                    text = f"{label}"
+                    if confidence < 1.0:
+                        text += f" ({confidence:.2f})"
+                    
+                    # 从缓存获取预渲染的标签位图（背景 + 文本）
+                    bitmap = label_cache.get(text, font, font_key, style.text_color, style.color, padding)
+                    extent = bitmap.extent
+                    
+                    # 选择不与已放置标签重叠的位置
+                    text_x, text_y = layout.place(
+                        box, bitmap.text_width, bitmap.text_height, text_spacing, extent
+                    )
+                    position = (text_x + extent[0], text_y + extent[1])
                 except Exception as e:
-                    print(f"Debug: Failed to load downloaded font: {e}")
+                    # 跳过有问题的标签，但记录错误信息用于调试
+                    logger.debug("Error processing annotation %r %s: %s", label, box, e)
+                    bitmap = None
+            
+            # 与 ImageDraw 一样截断为整数像素，便于分条绘制时做整数平移
+            items.append((tuple(int(v) for v in box), bitmap, position, style_index, shape))
+        
+        return draw_styles, items
+    
+    def _paint_annotations(self, image: Image.Image, items: list[tuple], styles: list[DrawStyle],
+                           offset: tuple[int, int] = (0, 0)) -> None:
+        """先合成掩码和半透明填充，再按顺序绘制边界框、多边形、关键点并粘贴标签位图
 
-        # 如果仍然失败，使用默认字体
-        if not font_loaded:
-            print("Debug: WARNING - No CJK fonts found, falling back to default font. Chinese characters may not display correctly!")
-            try:
-                # 尝试使用PIL的默认字体，Pillow >= 10.0.0 支持 size 参数
-                font = ImageFont.load_default(size=actual_font_size)
-            except TypeError:
-                # 旧版本 Pillow 不支持 size 参数
-                font = ImageFont.load_default()
-            except Exception as e:
-                print(f"Debug: Failed to load default font with size: {e}")
-                font = ImageFont.load_default()
+        offset 为 image 左上角在整幅图像中的坐标（分条渲染时为条带起点），
+        超出 image 的部分由 ImageDraw / paste 自动裁剪。只有形状没有边界框的
+        标注不画矩形框，边界框仅作为标签的锚点。
+        """
+        dx, dy = offset
+        self._paint_masks(image, items, styles, offset)
+        self._paint_fills(image, items, styles, offset)
         
-        for annotation in annotations:
+        draw = ImageDraw.Draw(image)
+        for (x1, y1, x2, y2), bitmap, position, style_index, shape in items:
+            style = styles[style_index]
             try:
-                # 确保annotation是字典类型
-                if not isinstance(annotation, dict):
-                    continue
-                    
-                bbox = annotation.get('bbox', [])
-                label = annotation.get('label', '')
-                confidence = annotation.get('confidence', 1.0)
-                
-                if len(bbox) != 4:
-                    continue
-                
-                x1, y1, x2, y2 = bbox
-                
-                # 根据坐标类型进行转换
-                if coordinate_type == 'relative':
-                    # 将相对坐标(0-1000)转换为真实像素坐标
-                    x1 = (x1 / 1000.0) * image.width
-                    y1 = (y1 / 1000.0) * image.height
-                    x2 = (x2 / 1000.0) * image.width
-                    y2 = (y2 / 1000.0) * image.height
-                # 如果是absolute类型，直接使用原始坐标
-                
-                # 确保坐标在图像范围内
-                x1 = max(0, min(x1, image.width))
-                y1 = max(0, min(y1, image.height))
-                x2 = max(0, min(x2, image.width))
-                y2 = max(0, min(y2, image.height))
-                
                 # 绘制边界框
-                draw.rectangle([x1, y1, x2, y2], outline=box_color, width=actual_line_width)
+                box = [x1 - dx, y1 - dy, x2 - dx, y2 - dy]
+                if shape is None or shape.boxed:
+                    if style.dashed:
+                        draw_dashed_rectangle(draw, box, style.color, style.line_width)
+                    else:
+                        draw.rectangle(box, outline=style.color, width=style.line_width)
                 
-                # 绘制标签文本
-                if label:
-                    text = f"{label}"
-                    if confidence < 1.0:
-                        text += f" ({confidence:.2f})"
-                    
-                    # 计算文本位置，使用缩放后的字体大小和间距
-                    text_spacing = max(2, int(5 * scale_factor))  # 确保最小间距
-                    
-                    # 获取文本边界框来计算准确的文本高度
-                    try:
-                        text_bbox = draw.textbbox((0, 0), text, font=font)
-                        text_height = text_bbox[3] - text_bbox[1]
-                        text_width = text_bbox[2] - text_bbox[0]
-                    except:
-                        # 如果textbbox不可用，使用估算值
-                        text_height = actual_font_size if font_loaded else int(actual_font_size * 0.8)
-                        text_width = len(text) * (actual_font_size // 2) if font_loaded else len(text) * int(actual_font_size * 0.4)
-                    
-                    # 计算文本Y位置，确保不会超出图像边界
-                    text_y = y1 - text_height - text_spacing
-                    if text_y < 0:
-                        # 如果文本会超出上边界，放在边界框内部
-                        text_y = y1 + text_spacing
-                    
-                    # 计算文本X位置，确保不会超出图像边界
-                    text_x = x1
-                    if text_x + text_width > image.width:
-                        text_x = max(0, image.width - text_width)
-                    
-                    # 绘制文本背景
-                    try:
-                        # 使用实际的文本边界框
-                        bbox_text = draw.textbbox((text_x, text_y), text, font=font)
-                        # 添加一些内边距
-                        padding = max(1, int(2 * scale_factor))
-                        bg_bbox = [
-                            bbox_text[0] - padding,
-                            bbox_text[1] - padding,
-                            bbox_text[2] + padding,
-                            bbox_text[3] + padding
-                        ]
-                        draw.rectangle(bg_bbox, fill=box_color)
-                    except:
-                        # 如果textbbox不可用，使用估算的背景
-                        padding = max(1, int(2 * scale_factor))
-                        bg_bbox = [
-                            text_x - padding,
-                            text_y - padding,
-                            text_x + text_width + padding,
-                            text_y + text_height + padding
-                        ]
-                        draw.rectangle(bg_bbox, fill=box_color)
-                    
-                    # 绘制文本
-                    draw.text((text_x, text_y), text, fill=text_color, font=font)
-                    
+                if shape is not None:
+                    draw_polygons(draw, shape, style.color, style.line_width, offset)
+                    # 关键点用文字颜色描边，与同色的连线区分
+                    draw_keypoints(draw, shape, style.color, style.text_color, style.line_width, offset)
+                
+                # 整块粘贴标签（位图不透明，超出图像的部分由 paste 自动裁剪）
+                if bitmap is not None:
+                    image.paste(bitmap.image, (position[0] - dx, position[1] - dy))
             except Exception as e:
                 # 跳过有问题的标注，但记录错误信息用于调试
-                print(f"Debug: Error processing annotation {annotation}: {e}")
+                logger.debug("Error drawing annotation %s: %s", [x1, y1, x2, y2], e)
                 continue
+    
+    def _paint_fills(self, image: Image.Image, items: list[tuple], styles: list[DrawStyle],
+                     offset: tuple[int, int] = (0, 0)) -> None:
+        """按填充透明度分层合成半透明填充
+
+        透明度相同的框（不论颜色）先画进同一个颜色层和蒙版，再一次性合成到
+        图像上，合成次数等于透明度种类数而不是框数；同层重叠区域不会叠加变深。
+        有多边形的标注填充多边形，只有掩码或关键点的标注不填充。
+        图层按 STRIP_HEIGHT 行分段分配，跳过没有框的段，临时内存与图像高度无关。
+        """
+        groups: dict[int, list[tuple]] = {}
+        for box, _, _, style_index, shape in items:
+            style = styles[style_index]
+            if style.fill_alpha <= 0:
+                continue
+            if shape is not None and shape.polygons:
+                bounds = shape.extent(0)
+                groups.setdefault(style.fill_alpha, []).append((bounds, style.color, shape))
+            elif shape is None or shape.boxed:
+                groups.setdefault(style.fill_alpha, []).append((box, style.color, None))
         
-        return annotated_image
+        dx, dy = offset
+        # 按透明度排序，分条渲染时各条带的叠加顺序与整帧一致
+        for alpha, fills in sorted(groups.items()):
+            boxes = np.array([box for box, _, _ in fills], dtype=np.int64) - (dx, dy, dx, dy)
+            left = max(0, int(boxes[:, 0].min()))
+            right = min(image.width, int(boxes[:, 2].max()) + 1)
+            top = max(0, int(boxes[:, 1].min()))
+            bottom = min(image.height, int(boxes[:, 3].max()) + 1)
+            
+            for band_top in range(top, bottom, STRIP_HEIGHT):
+                band_bottom = min(band_top + STRIP_HEIGHT, bottom)
+                selected = np.flatnonzero((boxes[:, 1] < band_bottom) & (boxes[:, 3] >= band_top))
+                if left >= right or not len(selected):
+                    continue
+                
+                layer = Image.new('RGB', (right - left, band_bottom - band_top))
+                mask = Image.new('L', layer.size, 0)
+                layer_draw, mask_draw = ImageDraw.Draw(layer), ImageDraw.Draw(mask)
+                for i in selected:
+                    _, color, shape = fills[i]
+                    if shape is not None:
+                        origin = (dx + left, dy + band_top)
+                        fill_polygons(layer_draw, shape, color, origin)
+                        fill_polygons(mask_draw, shape, alpha, origin)
+                        continue
+                    x1, y1, x2, y2 = (boxes[i] - (left, band_top, left, band_top)).tolist()
+                    layer_draw.rectangle([x1, y1, x2, y2], fill=color)
+                    mask_draw.rectangle([x1, y1, x2, y2], fill=alpha)
+                self._composite(image, layer, mask, (left, band_top))
+    
+    def _paint_masks(self, image: Image.Image, items: list[tuple], styles: list[DrawStyle],
+                     offset: tuple[int, int] = (0, 0)) -> None:
+        """把全部掩码画进同一个颜色层和蒙版后一次性合成（后面的掩码覆盖前面的）
+
+        掩码以游程形式保存，只在与 image 相交的范围内按输出分辨率采样；
+        与填充一样按 STRIP_HEIGHT 行分段，临时内存与图像高度无关。
+        """
+        masks = [
+            (shape, ImageColor.getrgb(styles[style_index].color), styles[style_index].fill_alpha or MASK_ALPHA)
+            for _, _, _, style_index, shape in items if shape is not None and shape.mask is not None
+        ]
+        bounds = [shape.mask_bounds() for shape, _, _ in masks]
+        bounds = np.array([b for b in bounds if b is not None], dtype=np.float64).reshape(-1, 4)
+        if not len(bounds):
+            return
+        
+        dx, dy = offset
+        left = max(dx, int(np.floor(bounds[:, 0].min())))
+        top = max(dy, int(np.floor(bounds[:, 1].min())))
+        right = min(dx + image.width, int(np.ceil(bounds[:, 2].max())) + 1)
+        bottom = min(dy + image.height, int(np.ceil(bounds[:, 3].max())) + 1)
+        if left >= right:
+            return
+        for band_top in range(top, bottom, STRIP_HEIGHT):
+            band_bottom = min(band_top + STRIP_HEIGHT, bottom)
+            painted = paint_masks((left, band_top, right, band_bottom), masks)
+            if painted is not None:
+                self._composite(image, *painted, (left - dx, band_top - dy))
+    
+    def _composite(self, image: Image.Image, layer: Image.Image, mask: Image.Image,
+                   position: tuple[int, int]) -> None:
+        """按蒙版把 RGB 颜色层合成到 image 的 position 处"""
+        if image.mode == 'RGBA':
+            # 透明图层（overlay 输出）需按非预乘 alpha 合成，颜色不被蒙版压暗
+            layer.putalpha(mask)
+            image.alpha_composite(layer, position)
+        else:
+            image.paste(layer, position, mask)
     
     def _image_to_base64(self, image: Image.Image) -> str:
         """将图像转换为Base64格式"""
@@ -0,0 +1,129 @@
+import os
+from collections.abc import Generator
+from concurrent.futures import as_completed
+from typing import Any
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+from gevent.threadpool import ThreadPoolExecutor
+
+from tools import draw_boxes
+from utils.admission import memory_budget
+from utils.concurrency import inflight_slot
+from utils.errors import AnnotationFormatError
+from utils.fonts import font_cache
+from utils.glyphs import label_cache
+from utils.image_cache import image_cache
+from utils.logger import get_logger
+from utils.metrics import PerfRecorder, recording
+
+
+# 单次批量调用的最大图像数量
+MAX_BATCH_SIZE = 50
+# 工作线程数（gevent 原生线程池，Pillow 解码/编码期间会释放 GIL）
+BATCH_WORKERS = int(os.getenv('DRAW_BOXES_BATCH_WORKERS', min(4, os.cpu_count() or 1)))
+
+logger = get_logger(__name__)
+
+
+class ImageMarkBatchTool(draw_boxes.ImageMarkTool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage]:
+        try:
+            image_files = tool_parameters.get('image_files') or []
+            annotations_str = tool_parameters.get('annotations', '')
+            
+            # 验证必需参数
+            if not image_files:
+                yield self.create_json_message({
+                    "success": False,
+                    "error": "image_files parameter is required",
+                    "error_code": 400
+                })
+                return
+            
+            if not annotations_str:
+                yield self.create_json_message({
+                    "success": False,
+                    "error": "annotations parameter is required",
+                    "error_code": 400
+                })
+                return
+            
+            if len(image_files) > MAX_BATCH_SIZE:
+                yield self.create_json_message({
+                    "success": False,
+                    "error": f"Too many images. Maximum is {MAX_BATCH_SIZE}",
+                    "error_code": 400
+                })
+                return
+            
+            options = self._parse_options(tool_parameters)
+            metrics_format = self._parse_metrics_format(tool_parameters)
+            annotation_sets = self._parse_annotation_sets(annotations_str, len(image_files))
+            
+            # 并发处理，每张图像完成后立即返回对应的 blob 消息
+            results: list[dict | None] = [None] * len(image_files)
+            # 整个批次占用一个渲染名额
+            with inflight_slot(), ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(image_files)))) as executor:
+                futures = [
+                    executor.submit(self._render_item, index, image_file, annotation_set, options, metrics_format)
+                    for index, (image_file, annotation_set) in enumerate(zip(image_files, annotation_sets))
+                ]
+                for future in as_completed(futures):
+                    index, encoded, result = future.result()
+                    if encoded is None:
+                        results[index] = result
+                        continue
+                    
+                    extension = 'jpg' if encoded.format == 'jpeg' else encoded.format
+                    yield self.create_blob_message(
+                        blob=encoded.data,
+                        meta={"mime_type": encoded.mime_type, "filename": f"annotated_{index:03d}.{extension}"}
+                    )
+                    results[index] = result
+            
+            succeeded = sum(1 for result in results if result and result.get("success"))
+            yield self.create_json_message({
+                "success": succeeded > 0,
+                "image_count": len(image_files),
+                "succeeded": succeeded,
+                "failed": len(image_files) - succeeded,
+                "results": results,
+                "font_cache": font_cache.stats(),
+                "label_cache": label_cache.stats(),
+                "image_cache": image_cache.stats(),
+                "memory_budget": memory_budget.stats(),
+                "message": f"成功处理{succeeded}/{len(image_files)}张图像"
+            })
+            
+        except Exception as e:
+            yield self.create_json_message(self._error_payload(e))
+    
+    def _render_item(self, index: int, image_file, annotation_set, options, metrics_format: str | None = None):
+        """在工作线程中处理单张图像，错误按图像记录而不中断整个批次"""
+        recorder = PerfRecorder() if metrics_format else None
+        try:
+            with recording(recorder):
+                encoded, result = self._render(image_file, annotation_set, options)
+            if recorder is not None:
+                result["metrics"] = recorder.export(metrics_format)
+            return index, encoded, {"index": index, **result}
+        except Exception as e:
+            logger.warning("Batch item %s failed: %s", index, e)
+            return index, None, {"index": index, **self._error_payload(e)}
+    
+    def _parse_annotation_sets(self, annotations_str, image_count: int) -> list:
+        """解析批量标注：JSON 数组，每个元素对应一张图像的标注（格式同单图）"""
+        annotation_sets = self._parse_annotations_json(annotations_str)
+        
+        if isinstance(annotation_sets, dict) and 'annotation_sets' in annotation_sets:
+            annotation_sets = annotation_sets['annotation_sets']
+        
+        if not isinstance(annotation_sets, list):
+            raise AnnotationFormatError("Batch annotations must be a JSON array with one entry per image")
+        
+        if len(annotation_sets) != image_count:
+            raise AnnotationFormatError(
+                f"Got {len(annotation_sets)} annotation sets for {image_count} images. Provide one entry per image"
+            )
+        
+        return annotation_sets
@@ -0,0 +1,320 @@
+import ctypes
+import ctypes.util
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.errors import ImageTooLargeError
+from utils.fetcher import http_cache
+from utils.glyphs import label_cache
+from utils.image_cache import image_cache
+from utils.logger import get_logger
+from utils.result_cache import result_cache
+from utils.strips import STRIP_HEIGHT
+
+
+# 插件进程的内存上限（manifest.yaml 中的 resource.memory）
+MEMORY_LIMIT = int(os.getenv('DRAW_BOXES_MEMORY_LIMIT', 256 * 1024 * 1024))
+# 空闲插件进程的常驻内存（解释器、dify_plugin、Pillow、NumPy、gevent，实测约 88MB）
+PROCESS_BASE_BYTES = 88 * 1024 * 1024
+# 进程基础占用之外可供请求和缓存使用的内存
+_REQUEST_MEMORY = MEMORY_LIMIT - PROCESS_BASE_BYTES
+# 预算下限：内存上限调得过小时，渲染仍可逐个进行
+_MIN_BUDGET = 8 * 1024 * 1024
+# 输入图像字节（下载或 Base64 解码的结果）可同时占用的内存，默认为可用内存的八分之一；
+# 从下载开始预留，直到渲染结束。其余留给渲染：整帧解码一张 4096x4096 的 PNG 约需 136MB
+INPUT_BUDGET = int(os.getenv('DRAW_BOXES_INPUT_BUDGET', max(_MIN_BUDGET, _REQUEST_MEMORY // 8)))
+# 渲染可预留的内存总预算，默认为可用内存中输入预算之外的部分；
+# 各缓存只能占用其中未被预留的部分，预留时按需淘汰
+MEMORY_BUDGET = int(os.getenv('DRAW_BOXES_MEMORY_BUDGET', max(_MIN_BUDGET, _REQUEST_MEMORY - INPUT_BUDGET)))
+# 排队超过该时间（秒）仍无法预留时，整帧渲染降低输出分辨率
+ADMISSION_TIMEOUT = float(os.getenv('DRAW_BOXES_ADMISSION_TIMEOUT', 10))
+# 降级时输出图像最长边的下限
+MIN_DEGRADED_SIDE = 512
+# 排队时检查预算的间隔（秒）
+_POLL_INTERVAL = 0.005
+# 归还的预留不少于该字节数时调用 malloc_trim
+_TRIM_MIN_BYTES = 8 * 1024 * 1024
+
+# Pillow 的 RGB / RGBA 图像每像素 4 字节
+_FRAME_BYTES_PER_PIXEL = 4
+# 各输出格式编码时每个输出像素的工作内存和输出缓冲区（包括 getvalue 复制的一份）
+_ENCODE_BYTES_PER_PIXEL = {'png': 2, 'jpeg': 1, 'webp': 10, 'gif': 2, 'svg': 0}
+# 每个标注的解析结果、标签位图和排版信息
+_ANNOTATION_BYTES = 2048
+# 与图像大小无关的固定开销（字体、解码器状态等）
+_BASE_BYTES = 2 * 1024 * 1024
+
+logger = get_logger(__name__)
+
+# 当前调用已预留的输入字节（未处于 input_reservation 中时为 None）
+_input_reserved: ContextVar['list[int] | None'] = ContextVar('draw_boxes_input_reserved', default=None)
+
+
+def _load_malloc_trim():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6').malloc_trim
+    except (OSError, AttributeError):
+        # 非 glibc 平台（macOS、musl、Windows）没有 malloc_trim
+        return None
+
+
+_malloc_trim = _load_malloc_trim()
+
+
+def estimate_render_bytes(path: str, source_size: tuple[int, int], target_size: tuple[int, int],
+                          source_format: str | None, output_format: str, annotation_count: int) -> int:
+    """估算一次渲染的峰值内存（字节）
+
+    path 为渲染路径：frame（整帧解码）、frames（逐帧渲染动图）、tiled（分条渲染）、
+    layer（只输出标注层）。输入字节由 input_budget 单独预留，不计入此处。
+    """
+    target_pixels = target_size[0] * target_size[1]
+    band_pixels = target_size[0] * min(STRIP_HEIGHT, target_size[1])
+    fixed = _BASE_BYTES + annotation_count * _ANNOTATION_BYTES
+    encode = _ENCODE_BYTES_PER_PIXEL.get(output_format, 2)
+
+    if path == 'layer':
+        # 条带、填充层和编码缓冲区
+        return fixed + band_pixels * _FRAME_BYTES_PER_PIXEL * 3 + target_pixels * encode // 4
+    if path == 'tiled':
+        # 读出的源条带（缩小输出时含滤波边距，按两倍行数估算）、输出条带、填充层，
+        # 以及增量编码的输出（按压缩后约为原始大小的四分之一估算）
+        source_rows = STRIP_HEIGHT * (2 if target_size != source_size else 1)
+        source_band = source_size[0] * min(source_rows, source_size[1])
+        return fixed + (source_band + band_pixels * 2) * _FRAME_BYTES_PER_PIXEL + target_pixels * 3 // 4
+
+    decoded = _decoded_pixels(source_size, target_size, source_format)
+    resized = target_pixels if decoded != target_pixels else 0
+    if path == 'frames':
+        # 源帧、当前帧、上一帧和差异区域
+        return fixed + (decoded + resized + target_pixels * 3) * _FRAME_BYTES_PER_PIXEL + target_pixels * encode
+    # 解码阶段：load() 的像素和 convert('RGB') 的副本（以及缩放结果）同时存在；
+    # 绘制编码阶段：缓存帧、绘制时写时复制的一帧和编码缓冲区。取两者较大值
+    decode = (decoded * 2 + resized) * _FRAME_BYTES_PER_PIXEL
+    draw = target_pixels * (_FRAME_BYTES_PER_PIXEL * 2 + encode)
+    return fixed + max(decode, draw)
+
+
+def _decoded_pixels(source_size: tuple[int, int], target_size: tuple[int, int], source_format: str | None) -> int:
+    """缩小输出时实际解码的像素数：JPEG 按 DCT 缩放（1/2、1/4、1/8）解码到不小于目标的尺寸"""
+    (width, height), (target_width, target_height) = source_size, target_size
+    if target_width * target_height >= width * height:
+        return target_width * target_height
+    if source_format == 'JPEG':
+        for scale in (8, 4, 2):
+            if width // scale >= target_width and height // scale >= target_height:
+                return -(-width // scale) * -(-height // scale)
+    return width * height
+
+
+class MemoryBudget:
+    """进程内共享的渲染内存预算
+
+    每次渲染开始前按估算的峰值内存预留，结束后归还；预算不足时按到达
+    顺序排队（先到的大请求不会被后到的小请求饿死）。预留可能发生在
+    gevent 事件循环的 greenlet 中，也可能发生在原生工作线程中，因此只用
+    短暂持有的锁保护计数，等待时轮询（time.sleep 在 greenlet 中会让出）。
+    超过总预算的预留直接拒绝。
+
+    caches 返回与预留共享预算的缓存（提供 nbytes 和 shrink）：缓存按实际占用
+    计算，只能使用未被预留的部分，预留成功后超出的缓存条目按 LRU 淘汰。
+    """
+
+    def __init__(self, capacity: int = MEMORY_BUDGET, caches: Callable[[], list] | None = None):
+        self.capacity = max(1, capacity)
+        self._caches = caches
+        self._lock = threading.Lock()
+        self._queue: deque[object] = deque()
+        self._reserved = 0
+        self._active = 0
+        self.peak_reserved = 0
+        self.admitted = 0
+        self.queued = 0
+        self.degraded = 0
+        self.timeouts = 0
+
+    def acquire(self, nbytes: int, degrade: Callable[[int], int] | None = None,
+                timeout: float = ADMISSION_TIMEOUT) -> int:
+        """预留 nbytes，返回实际预留的字节数；超过总预算时抛出 ImageTooLargeError
+
+        排队超过 timeout 秒时，以当时的剩余预算调用 degrade 得到降级后的需求，
+        保留原来的排队位置继续等待。
+        """
+        need = self._check(nbytes)
+        ticket = object()
+        with self._lock:
+            admitted = not self._queue and self._reserved + need <= self.capacity
+            if admitted:
+                self._admit(need)
+            else:
+                self._queue.append(ticket)
+                self.queued += 1
+                logger.debug(
+                    "Memory budget exhausted (%s/%s bytes reserved), queueing %s bytes",
+                    self._reserved, self.capacity, need,
+                )
+        if admitted:
+            self._reclaim()
+            return need
+
+        deadline = None if degrade is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                admitted = self._queue[0] is ticket and self._reserved + need <= self.capacity
+                if admitted:
+                    self._queue.popleft()
+                    self._admit(need)
+                available = self.capacity - self._reserved
+            if admitted:
+                self._reclaim()
+                return need
+            if deadline is not None and time.monotonic() >= deadline:
+                deadline = None
+                need = max(0, degrade(available))
+                with self._lock:
+                    self.timeouts += 1
+                continue
+            time.sleep(_POLL_INTERVAL)
+
+    def charge(self, nbytes: int) -> None:
+        """不等待地记入已经分配的 nbytes（可超出总预算，之后的预留等到归还为止）"""
+        with self._lock:
+            self._admit(max(0, nbytes))
+
+    def release(self, nbytes: int) -> None:
+        """归还 acquire 返回的字节数"""
+        with self._lock:
+            self._reserved -= nbytes
+            self._active -= 1
+        # 大块释放后把分配器保留的空闲内存归还给系统，否则多个渲染线程各自的
+        # malloc arena 会保留已释放的帧，RSS 远高于预算中的预留量
+        if nbytes >= _TRIM_MIN_BYTES and _malloc_trim is not None:
+            _malloc_trim(0)
+
+    def record_degraded(self) -> None:
+        with self._lock:
+            self.degraded += 1
+
+    def stats(self) -> dict:
+        cached = self._cached_bytes()
+        with self._lock:
+            return {
+                "budget_mb": round(self.capacity / (1024 * 1024), 1),
+                "reserved_mb": round(self._reserved / (1024 * 1024), 1),
+                "cached_mb": round(cached / (1024 * 1024), 1),
+                "peak_reserved_mb": round(self.peak_reserved / (1024 * 1024), 1),
+                "active": self._active,
+                "waiting": len(self._queue),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "degraded": self.degraded,
+                "timeouts": self.timeouts,
+            }
+
+    def _check(self, nbytes: int) -> int:
+        need = max(0, nbytes)
+        if need > self.capacity:
+            raise ImageTooLargeError(
+                f"Estimated memory ({need / (1024 * 1024):.1f} MB) exceeds the memory budget "
+                f"({self.capacity / (1024 * 1024):.1f} MB)"
+            )
+        return need
+
+    def _cached_bytes(self) -> int:
+        if self._caches is None:
+            return 0
+        return sum(cache.nbytes for cache in self._caches())
+
+    def _reclaim(self) -> None:
+        """缓存超出未被预留的预算时，按列出的顺序逐个淘汰"""
+        if self._caches is None:
+            return
+        caches = self._caches()
+        with self._lock:
+            room = max(0, self.capacity - self._reserved)
+        excess = sum(cache.nbytes for cache in caches) - room
+        for cache in caches:
+            if excess <= 0:
+                break
+            excess -= cache.shrink(max(0, cache.nbytes - excess))
+
+    def _admit(self, need: int) -> None:
+        self._reserved += need
+        self._active += 1
+        self.admitted += 1
+        self.peak_reserved = max(self.peak_reserved, self._reserved)
+
+
+def _shared_caches() -> list:
+    # 先淘汰占用最大的解码帧和响应缓存；编码结果命中时省去整次渲染，标签位图很小，放在最后
+    caches = [image_cache, http_cache(), result_cache, label_cache]
+    return [cache for cache in caches if cache is not None]
+
+
+memory_budget = MemoryBudget(caches=_shared_caches)
+input_budget = MemoryBudget(INPUT_BUDGET)
+
+
+@contextmanager
+def input_reservation():
+    """在当前上下文（协程/线程）中记录输入字节的预留，退出时全部归还
+
+    覆盖下载和渲染的全过程：输入字节在渲染结束前一直驻留在内存中。
+    输入预算与渲染预算相互独立，等待渲染预算时持有的输入预留不会阻塞其他渲染。
+    """
+    held: list[int] = []
+    token = _input_reserved.set(held)
+    try:
+        yield
+    finally:
+        _input_reserved.reset(token)
+        for nbytes in held:
+            input_budget.release(nbytes)
+
+
+def reserve_input(nbytes: int) -> None:
+    """开始下载前按响应声明的长度预留输入字节，预算不足时等待"""
+    held = _input_reserved.get()
+    if held is not None:
+        held.append(input_budget.acquire(nbytes))
+
+
+def account_input(nbytes: int) -> None:
+    """输入已在内存中：把超出已预留部分的字节直接记入输入预算（不等待）"""
+    held = _input_reserved.get()
+    if held is None:
+        return
+    extra = nbytes - sum(held)
+    if extra > 0:
+        input_budget.charge(extra)
+        held.append(extra)
+
+
+def charge_input(nbytes: int) -> None:
+    """把随请求驻留到渲染结束的派生数据（如解析出的掩码游程）直接记入输入预算（不等待）
+
+    在 account_input 之后调用。
+    """
+    held = _input_reserved.get()
+    if held is None or nbytes <= 0:
+        return
+    input_budget.charge(nbytes)
+    held.append(nbytes)
+
+
+@contextmanager
+def render_scratch(nbytes: int):
+    """渲染之前临时占用的内存（如解码掩码图像）从渲染预算预留，退出时归还
+
+    预算不足时排队，超过总预算时抛出 ImageTooLargeError。
+    """
+    reserved = memory_budget.acquire(nbytes)
+    try:
+        yield
+    finally:
+        memory_budget.release(reserved)
@@ -0,0 +1,124 @@
+import json
+import re
+from collections.abc import Iterator
+from typing import Any
+
+from utils.errors import AnnotationFormatError
+
+
+# JSON 允许的空白字符（与 json.decoder 一致）
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_decoder = json.JSONDecoder()
+
+
+def strip_markdown_fence(text: str) -> tuple[int, int]:
+    """返回去除 markdown 代码块标记（```json ... ```）后的 [start, end) 区间
+
+    规则与 text.strip().strip('`').strip() 再去掉开头的 json 一致，
+    但只计算下标，不复制整个字符串。
+    """
+    start, end = 0, len(text)
+    for chars in (None, '`', None):
+        while start < end and (text[start].isspace() if chars is None else text[start] == chars):
+            start += 1
+        while end > start and (text[end - 1].isspace() if chars is None else text[end - 1] == chars):
+            end -= 1
+
+    if text.startswith('json', start, end):
+        start += 4
+        while start < end and text[start].isspace():
+            start += 1
+    return start, end
+
+
+def iter_annotations(text: str) -> Iterator[Any]:
+    """增量解析标注 JSON，逐个产出标注对象
+
+    支持与 json.loads 后的处理相同的三种格式：{"annotations": [...]}、
+    [...] 和单个标注对象 {...}。数组元素逐个解码，整个数组不会被一次性
+    构建为 Python 对象。格式错误时抛出 AnnotationFormatError。
+    """
+    start, end = strip_markdown_fence(text)
+    try:
+        yield from _iter_document(text, start, end)
+    except json.JSONDecodeError as e:
+        raise AnnotationFormatError(f"Invalid JSON format in annotations: {str(e)}") from e
+
+
+def _iter_document(text: str, pos: int, end: int) -> Iterator[Any]:
+    char = text[pos] if pos < end else ''
+    if char == '[':
+        pos = yield from _iter_array(text, pos, end)
+    elif char == '{':
+        pos = yield from _iter_object(text, pos, end)
+    else:
+        # 其余 JSON 值（或非法 JSON）交给 raw_decode 报告
+        _decoder.raw_decode(text, pos)
+        raise AnnotationFormatError("Invalid annotations format. Expected object or array")
+
+    # 区间之后只剩被剥离的空白和反引号，空白可能越过 end
+    pos = WHITESPACE.match(text, pos).end()
+    if pos < end:
+        raise json.JSONDecodeError("Extra data", text, pos)
+
+
+def _iter_array(text: str, pos: int, end: int) -> Iterator[Any]:
+    """逐个产出数组元素，返回数组结束后的位置"""
+    pos = WHITESPACE.match(text, pos + 1).end()
+    if text.startswith(']', pos, end):
+        return pos + 1
+
+    while True:
+        value, pos = _decoder.raw_decode(text, pos)
+        yield value
+        pos = WHITESPACE.match(text, pos).end()
+        if pos >= end:
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, pos)
+        if text[pos] == ']':
+            return pos + 1
+        if text[pos] != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, pos)
+        pos = WHITESPACE.match(text, pos + 1).end()
+
+
+def _iter_object(text: str, pos: int, end: int) -> Iterator[Any]:
+    """解析顶层对象：annotations 字段按数组流式产出，否则视为单个标注"""
+    fields = {}
+    streamed = False
+    pos = WHITESPACE.match(text, pos + 1).end()
+    if text.startswith('}', pos, end):
+        yield fields
+        return pos + 1
+
+    while True:
+        if not text.startswith('"', pos, end):
+            raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, pos)
+        key, pos = _decoder.raw_decode(text, pos)
+        pos = WHITESPACE.match(text, pos).end()
+        if not text.startswith(':', pos, end):
+            raise json.JSONDecodeError("Expecting ':' delimiter", text, pos)
+        pos = WHITESPACE.match(text, pos + 1).end()
+
+        if key == 'annotations' and not streamed:
+            if not text.startswith('[', pos, end):
+                _, pos = _decoder.raw_decode(text, pos)
+                raise AnnotationFormatError("annotations must be a list")
+            streamed = True
+            pos = yield from _iter_array(text, pos, end)
+        else:
+            fields[key], pos = _decoder.raw_decode(text, pos)
+
+        pos = WHITESPACE.match(text, pos).end()
+        if pos >= end:
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, pos)
+        if text[pos] == '}':
+            break
+        if text[pos] != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, pos)
+        pos = WHITESPACE.match(text, pos + 1).end()
+
+    if not streamed:
+        # 不含 annotations 字段的对象是单个标注
+        yield fields
+    return pos + 1
@@ -0,0 +1,202 @@
+import math
+from array import array
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import numpy as np
+
+from utils.shapes import MAX_MASK_RUNS, MAX_TOTAL_MASK_RUNS, Shape, parse_shape
+from utils.styles import DEFAULT_STYLE, AnnotationStyle, parse_style
+
+
+# 支持的边界框字段名称（按优先级）
+BBOX_FIELDS = ('bbox', 'bbox_2d', 'bounding_box', 'box')
+# 单张图像的最大标注数量
+MAX_ANNOTATIONS = 5000
+
+
+def normalize_annotation(annotation, max_mask_runs: int = MAX_MASK_RUNS
+                         ) -> tuple[tuple[float, float, float, float], str, float, Shape | None] | None:
+    """将单个标注规范化为 (边界框, 标签, 置信度, 形状)，无效条目返回 None
+
+    只有形状（多边形、掩码、关键点）没有边界框的标注，边界框为 NaN，
+    在换算为像素时由形状的范围确定。掩码游程超过 max_mask_runs 时抛出 AnnotationFormatError。
+    """
+    if not isinstance(annotation, dict):
+        return None
+
+    # 支持多种边界框字段名称
+    bbox = None
+    for bbox_field in BBOX_FIELDS:
+        if bbox_field in annotation:
+            bbox = annotation[bbox_field]
+            break
+
+    bbox = _parse_bbox(bbox)
+    shape = parse_shape(annotation, max_mask_runs)
+    if bbox is None:
+        if shape is None:
+            return None
+        bbox = (math.nan,) * 4
+    elif shape is not None:
+        shape.boxed = True
+
+    label = annotation.get('label', '')
+    # 置信度缺失或非数字时视为 1.0
+    confidence = _to_float(annotation.get('confidence', 1.0))
+    if math.isnan(confidence):
+        confidence = 1.0
+    return bbox, str(label) if label else '', confidence, shape
+
+
+def _parse_bbox(bbox) -> tuple[float, float, float, float] | None:
+    if not isinstance(bbox, list) or len(bbox) != 4:
+        return None
+
+    try:
+        bbox = tuple(float(v) for v in bbox)
+    except (ValueError, TypeError):
+        return None
+    if any(math.isnan(v) for v in bbox):
+        return None
+    return bbox
+
+
+def _frame_index(annotation: dict) -> int:
+    """读取多帧模式下标注所在的帧序号（从 0 开始），缺失或无效时返回 -1（绘制在所有帧上）"""
+    frame = annotation.get('frame')
+    if isinstance(frame, bool) or not isinstance(frame, (int, float)):
+        return -1
+    if not math.isfinite(frame) or frame < 0 or frame != int(frame):
+        return -1
+    return int(frame)
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return math.nan
+
+
+@dataclass
+class AnnotationBatch:
+    """结构化数组形式的标注：N×4 边界框 + 标签 + 置信度 + 样式编号 + 帧序号
+
+    样式去重后存放在 styles 中，style_ids 为每个标注对应的下标
+    （0 号为不覆盖任何参数的默认样式）。frames 只在多帧模式下使用，
+    -1 表示绘制在所有帧上。shapes 为每个标注的多边形/掩码/关键点
+    （纯边界框为 None），全部为纯边界框时整体为 None。
+    """
+
+    boxes: np.ndarray
+    labels: list[str]
+    confidences: np.ndarray
+    style_ids: np.ndarray
+    styles: list[AnnotationStyle]
+    frames: np.ndarray
+    shapes: list[Shape | None] | None = None
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @classmethod
+    def empty(cls) -> 'AnnotationBatch':
+        return cls(
+            np.empty((0, 4), dtype=np.float64), [], np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.int32), [DEFAULT_STYLE], np.empty(0, dtype=np.int32),
+        )
+
+    @classmethod
+    def from_annotations(cls, annotations: Iterable) -> 'AnnotationBatch':
+        """从标注字典序列构建，跳过缺少 4 个数字边界框的条目
+
+        annotations 可以是生成器：条目逐个规范化后写入紧凑数组，
+        不会保留原始字典。所有掩码的游程总数不超过 MAX_TOTAL_MASK_RUNS。
+        """
+        boxes = array('d')
+        labels = []
+        confidences = array('d')
+        style_ids = array('i')
+        frames = array('i')
+        shapes = []
+        style_index = {DEFAULT_STYLE: 0}
+        mask_runs = 0
+        for annotation in annotations:
+            record = normalize_annotation(annotation, min(MAX_MASK_RUNS, MAX_TOTAL_MASK_RUNS - mask_runs))
+            if record is None:
+                continue
+            bbox, label, confidence, shape = record
+            if shape is not None and shape.mask is not None:
+                mask_runs += shape.mask.runs
+            boxes.extend(bbox)
+            labels.append(label)
+            confidences.append(confidence)
+            style_ids.append(style_index.setdefault(parse_style(annotation), len(style_index)))
+            frames.append(_frame_index(annotation))
+            shapes.append(shape)
+
+        if not labels:
+            return cls.empty()
+
+        return cls(
+            np.frombuffer(boxes, dtype=np.float64).reshape(-1, 4).copy(),
+            labels,
+            np.frombuffer(confidences, dtype=np.float64).copy(),
+            np.frombuffer(style_ids, dtype=np.int32).copy(),
+            list(style_index),
+            np.frombuffer(frames, dtype=np.int32).copy(),
+            shapes if any(shape is not None for shape in shapes) else None,
+        )
+
+    def select(self, mask: np.ndarray) -> 'AnnotationBatch':
+        """按布尔掩码筛选标注"""
+        if mask.all():
+            return self
+        indices = np.flatnonzero(mask)
+        return AnnotationBatch(
+            self.boxes[indices], [self.labels[i] for i in indices], self.confidences[indices],
+            self.style_ids[indices], self.styles, self.frames[indices],
+            None if self.shapes is None else [self.shapes[i] for i in indices],
+        )
+
+    def to_pixels(self, width: int, height: int, coordinate_type: str = 'relative',
+                  scale: tuple[float, float] = (1.0, 1.0), min_confidence: float = 0.0) -> 'AnnotationBatch':
+        """一次性完成坐标换算、裁剪、退化框过滤和置信度过滤
+
+        relative 坐标 (0-1000) 按图像尺寸换算为像素；absolute 坐标按 scale
+        缩放（预览模式下图像被缩小时使用）。
+        """
+        if coordinate_type == 'relative':
+            factors = np.array([width, height, width, height], dtype=np.float64) / 1000.0
+        else:
+            factors = np.array([scale[0], scale[1], scale[0], scale[1]], dtype=np.float64)
+
+        boxes = self.boxes * factors
+        shapes = self.shapes
+        if shapes is not None:
+            # 形状按相同系数换算；没有边界框的标注以形状的范围作为边界框（标签锚点）
+            shapes = [None if shape is None else shape.to_pixels(factors, width, height) for shape in shapes]
+            for i, shape in enumerate(shapes):
+                if shape is not None and not shape.boxed:
+                    bounds = shape.bounds()
+                    boxes[i] = math.nan if bounds is None else bounds
+            # 形状只需与图像相交（例如单个关键点的范围退化为一个点）
+            with np.errstate(invalid='ignore'):
+                visible_shapes = (
+                    np.array([shape is not None for shape in shapes])
+                    & (boxes[:, 2] >= 0) & (boxes[:, 3] >= 0) & (boxes[:, 0] <= width) & (boxes[:, 1] <= height)
+                )
+        # 确保坐标在图像范围内
+        np.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+
+        keep = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+        if shapes is not None:
+            keep |= visible_shapes
+        if min_confidence > 0:
+            keep &= self.confidences >= min_confidence
+
+        return AnnotationBatch(
+            boxes, self.labels, self.confidences, self.style_ids, self.styles, self.frames, shapes
+        ).select(keep)
@@ -0,0 +1,80 @@
+import contextvars
+import os
+import threading
+from collections.abc import Callable
+from contextlib import contextmanager
+from typing import TypeVar
+
+from gevent import monkey
+from gevent.lock import BoundedSemaphore
+from gevent.threadpool import ThreadPool
+
+from utils.logger import get_logger
+
+
+# 同时进行中的渲染调用数（含下载），限制并发下载和解码占用的内存
+MAX_INFLIGHT_RENDERS = int(os.getenv('DRAW_BOXES_MAX_INFLIGHT', 16))
+# 执行解码、绘制、编码的原生线程数
+RENDER_THREADS = int(os.getenv('DRAW_BOXES_RENDER_THREADS', min(4, os.cpu_count() or 1)))
+
+T = TypeVar('T')
+
+logger = get_logger(__name__)
+
+# 未被 gevent 替换的线程标识；模块在插件主线程（gevent 事件循环所在线程）中导入
+_native_get_ident = monkey.get_original('_thread', 'get_ident')
+_hub_thread = _native_get_ident()
+
+_pool: ThreadPool | None = None
+_pool_lock = threading.Lock()
+
+_inflight = BoundedSemaphore(max(1, MAX_INFLIGHT_RENDERS))
+
+
+def _get_pool() -> ThreadPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPool(max(1, RENDER_THREADS))
+    return _pool
+
+
+def run_in_thread(func: Callable[..., T], *args) -> T:
+    """在原生线程池中执行 CPU 密集型函数，只挂起当前 greenlet
+
+    Dify 插件进程被 gevent monkey patch，所有调用共享一个操作系统线程；
+    解码、绘制、编码若直接在 greenlet 中执行，会阻塞其他调用的网络等待。
+    已经在其他原生线程中（例如批量工具的工作线程）时直接执行。
+    上下文变量（性能记录器）随任务一起传入工作线程。
+    """
+    if not monkey.is_module_patched('threading') or _native_get_ident() != _hub_thread:
+        return func(*args)
+
+    context = contextvars.copy_context()
+    ok, value = _get_pool().apply(_call_captured, (context, func, *args))
+    if not ok:
+        raise value
+    return value
+
+
+def _call_captured(context: contextvars.Context, func: Callable[..., T], *args) -> tuple[bool, object]:
+    """在工作线程中执行并把异常作为返回值带回调用方
+
+    异常若从工作线程抛出，gevent 线程池会把完整堆栈打印到 stderr，
+    413 / 422 这类预期的用户错误也会刷满插件日志；改为在调用方的 greenlet 中重新抛出。
+    """
+    try:
+        return True, context.run(func, *args)
+    except BaseException as e:
+        return False, e
+
+
+@contextmanager
+def inflight_slot():
+    """占用一个渲染名额，名额用尽时当前 greenlet 等待（不阻塞其他调用）"""
+    if _inflight.locked():
+        logger.debug("Render slots exhausted (%s in flight), waiting", MAX_INFLIGHT_RENDERS)
+    with _inflight:
+        yield
+
@@ -0,0 +1,34 @@
+class DrawBoxesError(Exception):
+    """插件内部错误基类，携带返回给调用方的 error_code"""
+
+    error_code = 500
+
+
+class ImageFetchError(DrawBoxesError):
+    """远程图像获取失败"""
+
+    error_code = 404
+
+
+class ImageTooLargeError(DrawBoxesError):
+    """图像（或其下载内容）超出允许的大小"""
+
+    error_code = 413
+
+
+class ParameterError(DrawBoxesError):
+    """工具参数不合法"""
+
+    error_code = 400
+
+
+class ImageLoadError(DrawBoxesError):
+    """图像无法加载或解码"""
+
+    error_code = 404
+
+
+class AnnotationFormatError(DrawBoxesError):
+    """标注数据格式错误"""
+
+    error_code = 422
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.errors import ImageFetchError, ImageTooLargeError
+from utils.logger import get_logger
+
+
+# 单张图像的最大下载字节数
+MAX_DOWNLOAD_BYTES = int(os.getenv('DRAW_BOXES_MAX_DOWNLOAD_BYTES', 50 * 1024 * 1024))
+# 内存缓存总字节上限
+HTTP_CACHE_MAX_BYTES = int(os.getenv('DRAW_BOXES_HTTP_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# 可选的磁盘缓存目录，留空则只使用内存缓存
+HTTP_CACHE_DIR = os.getenv('DRAW_BOXES_HTTP_CACHE_DIR', '')
+
+CHUNK_SIZE = 64 * 1024
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str | None = None
+    last_modified: str | None = None
+    content_type: str | None = None
+
+
+class FetchCache:
+    """按 URL 缓存响应内容，配合 ETag / Last-Modified 做条件请求"""
+
+    def __init__(self, max_bytes: int, cache_dir: str | None = None):
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._cache_dir = Path(cache_dir) if cache_dir else None
+        if self._cache_dir is not None:
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def get(self, url: str) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+                return entry
+
+        entry = self._read_disk(url)
+        if entry is not None:
+            self._put_memory(url, entry)
+        return entry
+
+    def put(self, url: str, entry: CachedResponse) -> None:
+        self._put_memory(url, entry)
+        self._write_disk(url, entry)
+
+    def _put_memory(self, url: str, entry: CachedResponse) -> None:
+        size = len(entry.body)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self._total_bytes -= len(old.body)
+            self._entries[url] = entry
+            self._total_bytes += size
+            while self._total_bytes > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted.body)
+
+    @property
+    def nbytes(self) -> int:
+        """内存层当前占用的字节数（不含磁盘层）"""
+        with self._lock:
+            return self._total_bytes
+
+    def shrink(self, max_bytes: int) -> int:
+        """按 LRU 淘汰内存层条目直到占用不超过 max_bytes，返回释放的字节数"""
+        freed = 0
+        with self._lock:
+            while self._entries and self._total_bytes > max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted.body)
+                freed += len(evicted.body)
+        return freed
+
+    def _disk_paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self._cache_dir / f"{key}.body", self._cache_dir / f"{key}.json"
+
+    def _read_disk(self, url: str) -> CachedResponse | None:
+        if self._cache_dir is None:
+            return None
+        body_path, meta_path = self._disk_paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+            if meta.get('url') != url:
+                return None
+            return CachedResponse(
+                body=body_path.read_bytes(),
+                etag=meta.get('etag'),
+                last_modified=meta.get('last_modified'),
+                content_type=meta.get('content_type'),
+            )
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, url: str, entry: CachedResponse) -> None:
+        if self._cache_dir is None:
+            return
+        body_path, meta_path = self._disk_paths(url)
+        try:
+            body_path.write_bytes(entry.body)
+            meta_path.write_text(json.dumps({
+                'url': url,
+                'etag': entry.etag,
+                'last_modified': entry.last_modified,
+                'content_type': entry.content_type,
+            }))
+        except OSError as e:
+            logger.warning("Failed to write http cache: %s", e)
+
+
+class ImageFetcher:
+    """基于共享 Session 的图像下载器
+
+    - 复用连接池和 keep-alive 连接
+    - 流式读取响应体，超过字节上限立即中止
+    - 按 URL 缓存响应，带 ETag / Last-Modified 时做条件重验证
+    """
+
+    def __init__(self, max_bytes: int = MAX_DOWNLOAD_BYTES, timeout: float = 30,
+                 pool_connections: int = 8, pool_maxsize: int = 16,
+                 cache: FetchCache | None = None):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.cache = cache
+
+        self.session = requests.Session()
+        retry = Retry(
+            total=2,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, url: str, reserve: Callable[[int], None] | None = None) -> bytes:
+        """下载图像内容，返回原始字节
+
+        reserve 在读取响应体之前以 Content-Length 调用，用于预留输入内存（可能等待）。
+        """
+        cached = self.cache.get(url) if self.cache is not None else None
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        with self.session.get(url, timeout=self.timeout, stream=True, headers=headers) as response:
+            if response.status_code == 304 and cached is not None:
+                logger.debug("HTTP cache revalidated for %.100s", url)
+                return cached.body
+
+            response.raise_for_status()
+
+            content_type = response.headers.get('content-type', '').lower()
+            if content_type and not content_type.startswith('image/'):
+                raise ImageFetchError(f"Invalid content type '{content_type}'")
+
+            content_length = response.headers.get('content-length')
+            if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+                raise ImageTooLargeError(
+                    f"Image download too large. Maximum size is {self.max_bytes} bytes"
+                )
+            if reserve is not None and content_length and content_length.isdigit():
+                reserve(int(content_length))
+
+            body = self._read_body(response)
+            etag = response.headers.get('etag')
+            last_modified = response.headers.get('last-modified')
+
+        if not body:
+            raise ImageFetchError("Empty response content")
+
+        if self.cache is not None and (etag or last_modified):
+            self.cache.put(url, CachedResponse(
+                body=body, etag=etag, last_modified=last_modified, content_type=content_type or None
+            ))
+
+        return body
+
+    def _read_body(self, response: requests.Response) -> bytes:
+        buffer = bytearray()
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            buffer += chunk
+            if len(buffer) > self.max_bytes:
+                raise ImageTooLargeError(
+                    f"Image download too large. Maximum size is {self.max_bytes} bytes"
+                )
+        return bytes(buffer)
+
+
+_fetcher: ImageFetcher | None = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> ImageFetcher:
+    """返回进程共享的下载器"""
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = ImageFetcher(cache=FetchCache(HTTP_CACHE_MAX_BYTES, HTTP_CACHE_DIR or None))
+    return _fetcher
+
+
+def http_cache() -> FetchCache | None:
+    """已创建的下载器的响应缓存（尚未下载过时为 None）"""
+    fetcher = _fetcher
+    return fetcher.cache if fetcher is not None else None
@@ -0,0 +1,220 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from gevent import monkey
+from PIL import ImageFont
+
+from utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+# 自动下载的字体存放目录
+ASSETS_DIR = Path(__file__).parent.parent / "_assets"
+DOWNLOADED_FONT_PATH = ASSETS_DIR / "wqy-microhei.ttc"
+# 使用 GitHub Raw 加速地址或 CDN
+FONT_URL = "https://github.com/anthonyfok/fonts-wqy-microhei/raw/master/wqy-microhei.ttc"
+
+# 候选字体路径 - 优先使用支持中文的字体
+FONT_PATHS = [
+    # 自动下载的本地字体 (最高优先级)
+    str(DOWNLOADED_FONT_PATH),
+    # 支持中文的字体 (优先)
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/usr/share/fonts/wqy-microhei/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+    # Debian/Ubuntu 中文字体
+    "/usr/share/fonts/truetype/arphic/uming.ttc",
+    "/usr/share/fonts/truetype/arphic/ukai.ttc",
+    # Alpine Linux 中文字体
+    "/usr/share/fonts/noto/NotoSansCJK-Regular.ttc",
+    # macOS 中文字体 (本地开发环境)
+    "/System/Library/Fonts/PingFang.ttc",
+    "/System/Library/Fonts/STHeiti Light.ttc",
+    "/System/Library/Fonts/STHeiti Medium.ttc",
+    "/Library/Fonts/Arial Unicode.ttf",
+    # 其他通用字体
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+    "/System/Library/Fonts/Arial.ttf",
+    "/System/Library/Fonts/Helvetica.ttc",
+]
+
+
+# 原生线程启动函数：后台下载不依赖 gevent 事件循环，从任意线程启动都能运行
+_start_native_thread = monkey.get_original('_thread', 'start_new_thread')
+
+
+def download_font() -> str | None:
+    """下载开源中文字体 (WenQuanYi Micro Hei)
+
+    构建插件包之前执行 python -m utils.fonts 可把字体预先放入 _assets 目录。
+    """
+    # 只有缺少系统字体时才会下载，按需导入
+    import requests
+
+    try:
+        ASSETS_DIR.mkdir(parents=True, exist_ok=True)
+
+        # 如果字体已存在，直接返回路径
+        if DOWNLOADED_FONT_PATH.exists():
+            return str(DOWNLOADED_FONT_PATH)
+
+        logger.debug("Downloading font to %s...", DOWNLOADED_FONT_PATH)
+        response = requests.get(FONT_URL, timeout=60, stream=True)
+        response.raise_for_status()
+
+        # 先写临时文件再改名，避免并发请求读到半个字体文件
+        tmp_path = DOWNLOADED_FONT_PATH.with_suffix(".part")
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                f.write(chunk)
+        tmp_path.replace(DOWNLOADED_FONT_PATH)
+
+        logger.debug("Font download completed successfully")
+        return str(DOWNLOADED_FONT_PATH)
+
+    except Exception as e:
+        logger.warning("Failed to download font: %s", e)
+        return None
+
+
+class FontCache:
+    """进程级字体缓存
+
+    候选路径只在进程内探测一次，之后按 (path, size) 以 LRU 方式复用
+    FreeTypeFont 对象，稳定状态下的请求不再访问文件系统。
+    """
+
+    def __init__(self, font_paths: list[str], max_entries: int = 32):
+        self._font_paths = list(font_paths)
+        self._max_entries = max_entries
+        self._fonts: OrderedDict[tuple[str | None, int], tuple[ImageFont.ImageFont, bool]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._resolve_lock = threading.Lock()
+        self._resolved = False
+        self._prefetching = False
+        self._font_path: str | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def resolve_font_path(self, allow_download: bool = True) -> str | None:
+        """返回可用的 TrueType 字体路径，整个进程只探测一次
+
+        没有可用字体时在后台线程下载备用字体（不阻塞请求），下载完成前
+        使用 Pillow 默认字体，完成后切换到下载的字体。
+        """
+        if self._resolved:
+            return self._font_path
+
+        with self._resolve_lock:
+            if self._resolved:
+                return self._font_path
+
+            font_path = None
+            for candidate in self._font_paths:
+                try:
+                    # 真正加载一次，确保文件是可解析的字体
+                    ImageFont.truetype(candidate, 16)
+                    font_path = candidate
+                    logger.debug("Successfully resolved font: %s", candidate)
+                    break
+                except (OSError, IOError):
+                    continue
+
+            if font_path is None:
+                logger.warning("No CJK fonts found, falling back to default font. Chinese characters may not display correctly!")
+                if allow_download:
+                    self._start_prefetch()
+
+            self._font_path = font_path
+            self._resolved = True
+            return font_path
+
+    def _start_prefetch(self) -> None:
+        if self._prefetching:
+            return
+        self._prefetching = True
+        logger.debug("No system fonts found, downloading fallback font in the background...")
+        _start_native_thread(self._prefetch_font, ())
+
+    def _prefetch_font(self) -> None:
+        downloaded_font = download_font()
+        if not downloaded_font:
+            return
+        try:
+            ImageFont.truetype(downloaded_font, 16)
+        except Exception as e:
+            logger.warning("Failed to load downloaded font: %s", e)
+            return
+
+        with self._resolve_lock:
+            self._font_path = downloaded_font
+        logger.info("Switched to downloaded font %s", downloaded_font)
+
+    def get_font(self, size: int) -> tuple[ImageFont.ImageFont, bool]:
+        """按字号获取字体，返回 (字体对象, 是否为 TrueType 字体)"""
+        return self.load(self.resolve_font_path(), size)
+
+    def load(self, font_path: str | None, size: int) -> tuple[ImageFont.ImageFont, bool]:
+        """按字体路径和字号获取字体；路径为 None 时使用 Pillow 默认字体"""
+        key = (font_path, size)
+
+        with self._lock:
+            entry = self._fonts.get(key)
+            if entry is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = self._load_font(font_path, size)
+
+        with self._lock:
+            self._fonts[key] = entry
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self._max_entries:
+                self._fonts.popitem(last=False)
+
+        return entry
+
+    def stats(self) -> dict:
+        """返回缓存命中统计"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._fonts),
+                "font_path": self._font_path,
+            }
+
+    def _load_font(self, font_path: str | None, size: int) -> tuple[ImageFont.ImageFont, bool]:
+        if font_path is not None:
+            try:
+                return ImageFont.truetype(font_path, size), True
+            except (OSError, IOError) as e:
+                logger.debug("Failed to load font %s: %s", font_path, e)
+
+        try:
+            # 尝试使用PIL的默认字体，Pillow >= 10.0.0 支持 size 参数
+            return ImageFont.load_default(size=size), False
+        except TypeError:
+            # 旧版本 Pillow 不支持 size 参数
+            return ImageFont.load_default(), False
+        except Exception as e:
+            logger.debug("Failed to load default font with size: %s", e)
+            return ImageFont.load_default(), False
+
+
+font_cache = FontCache(FONT_PATHS)
+
+
+if __name__ == '__main__':
+    # 构建时预先下载备用字体，打包进插件
+    print(download_font() or 'Font download failed')
@@ -0,0 +1,130 @@
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+# 标签位图缓存的字节预算
+LABEL_CACHE_MAX_BYTES = int(os.getenv('DRAW_BOXES_LABEL_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+
+
+@dataclass
+class LabelBitmap:
+    """预渲染的标签（背景 + 文本）"""
+
+    image: Image.Image
+    # 文本相对锚点的边界框 (left, top, right, bottom)
+    text_bbox: tuple[int, int, int, int]
+    # 背景相对锚点的范围（含内边距）
+    extent: tuple[int, int, int, int]
+    # 标签文本与字体（输出 SVG 时使用）
+    text: str = ''
+    font: ImageFont.ImageFont | ImageFont.FreeTypeFont | None = None
+
+    @property
+    def text_width(self) -> int:
+        return self.text_bbox[2] - self.text_bbox[0]
+
+    @property
+    def text_height(self) -> int:
+        return self.text_bbox[3] - self.text_bbox[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.image.width * self.image.height * len(self.image.getbands())
+
+
+class LabelBitmapCache:
+    """按 (文本, 字体, 字号, 颜色, 内边距) 缓存标签位图，LRU + 字节预算
+
+    检测结果中同一标签往往重复出现成百上千次，命中后只需一次 paste，
+    不再重复进行文本排版和光栅化。
+    """
+
+    def __init__(self, max_bytes: int = LABEL_CACHE_MAX_BYTES):
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, LabelBitmap] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str, font: ImageFont.ImageFont, font_key: tuple, text_color: str,
+            bg_color: str, padding: int) -> LabelBitmap:
+        key = (text, font_key, text_color, bg_color, padding)
+        with self._lock:
+            bitmap = self._entries.get(key)
+            if bitmap is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return bitmap
+            self.misses += 1
+
+        bitmap = self._render(text, font, font_key, text_color, bg_color, padding)
+
+        size = bitmap.nbytes
+        if size <= self._max_bytes:
+            with self._lock:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._total_bytes -= old.nbytes
+                self._entries[key] = bitmap
+                self._total_bytes += size
+                while self._total_bytes > self._max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._total_bytes -= evicted.nbytes
+        return bitmap
+
+    @property
+    def nbytes(self) -> int:
+        """缓存位图当前占用的字节数"""
+        with self._lock:
+            return self._total_bytes
+
+    def shrink(self, max_bytes: int) -> int:
+        """按 LRU 淘汰位图直到占用不超过 max_bytes，返回释放的字节数"""
+        freed = 0
+        with self._lock:
+            while self._entries and self._total_bytes > max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+                freed += evicted.nbytes
+        return freed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+    def _render(self, text: str, font: ImageFont.ImageFont, font_key: tuple, text_color: str,
+                bg_color: str, padding: int) -> LabelBitmap:
+        # 获取文本边界框来计算准确的文本尺寸
+        try:
+            text_bbox = tuple(ImageDraw.Draw(Image.new('RGB', (1, 1))).textbbox((0, 0), text, font=font))
+        except Exception:
+            # 如果textbbox不可用，使用估算值
+            font_size = font_key[-1]
+            if isinstance(font, ImageFont.FreeTypeFont):
+                text_bbox = (0, 0, len(text) * (font_size // 2), font_size)
+            else:
+                text_bbox = (0, 0, len(text) * int(font_size * 0.4), int(font_size * 0.8))
+
+        # 背景矩形包含两端端点，因此尺寸 +1
+        extent = (
+            text_bbox[0] - padding,
+            text_bbox[1] - padding,
+            text_bbox[2] + padding,
+            text_bbox[3] + padding
+        )
+        tile = Image.new('RGB', (extent[2] - extent[0] + 1, extent[3] - extent[1] + 1), bg_color)
+        ImageDraw.Draw(tile).text((-extent[0], -extent[1]), text, fill=text_color, font=font)
+        return LabelBitmap(tile, text_bbox, extent, text, font)
+
+
+label_cache = LabelBitmapCache()
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+
+# 解码帧缓存的内存预算，默认取插件内存上限 (manifest.yaml 中 resource.memory = 256MB) 的四分之一
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('DRAW_BOXES_IMAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# 记录最近见过一次、尚未缓存的键的数量
+SEEN_KEYS = 1024
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """图像内容哈希，用作缓存键"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _image_nbytes(image: Image.Image) -> int:
+    # Pillow 内部 RGB 图像按每像素 4 字节存储
+    return image.width * image.height * 4
+
+
+def read_only_view(image: Image.Image) -> Image.Image:
+    """返回共享像素缓冲区的只读视图
+
+    视图被绘制或 paste 时 Pillow 会先复制出私有缓冲区（写时复制），
+    缓存中的原始帧不会被修改。
+    """
+    view = image._new(image.im)
+    view.readonly = 1
+    return view
+
+
+class DecodedImageCache:
+    """按内容哈希缓存解码后的 RGB 帧（LRU + 内存预算）
+
+    同一张图被反复标注时，后续请求只需绘制和编码，省去下载和解码。
+    缓存的帧以只读视图返回，每次绘制都要写时复制一份；因此一个键第二次
+    未命中时才缓存，只出现一次的图像直接原地绘制，不产生复制。
+    """
+
+    def __init__(self, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, Image.Image] = OrderedDict()
+        self._seen: OrderedDict[tuple, None] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Image.Image | None:
+        """命中时返回只读视图"""
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return read_only_view(image)
+
+    def put(self, key: tuple, image: Image.Image) -> Image.Image:
+        """缓存解码帧并返回其只读视图
+
+        键第一次出现时只记录下来；超出预算的帧不缓存。不缓存时原样返回，
+        调用方可以直接在上面绘制。
+        """
+        size = _image_nbytes(image)
+        if size > self._max_bytes:
+            return image
+
+        with self._lock:
+            if key not in self._entries and key not in self._seen:
+                self._seen[key] = None
+                if len(self._seen) > SEEN_KEYS:
+                    self._seen.popitem(last=False)
+                return image
+            self._seen.pop(key, None)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= _image_nbytes(old)
+            self._entries[key] = image
+            self._total_bytes += size
+            while self._total_bytes > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= _image_nbytes(evicted)
+        return read_only_view(image)
+
+    @property
+    def nbytes(self) -> int:
+        """缓存帧当前占用的字节数"""
+        with self._lock:
+            return self._total_bytes
+
+    def shrink(self, max_bytes: int) -> int:
+        """按 LRU 淘汰帧直到占用不超过 max_bytes，返回释放的字节数"""
+        freed = 0
+        with self._lock:
+            while self._entries and self._total_bytes > max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= _image_nbytes(evicted)
+                freed += _image_nbytes(evicted)
+        return freed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+
+image_cache = DecodedImageCache()
@@ -0,0 +1,117 @@
+import base64
+import binascii
+import io
+
+
+# 嗅探输入类型时最多查看的前缀长度
+SNIFF_PREFIX = 64
+# data URI 头部（data:image/png;base64,）的最大长度，逗号须出现在此范围内
+DATA_URI_MAX_HEADER = 256
+# 分块解码时每块的 Base64 字符数（4 的倍数），块的临时副本约 256KB
+BASE64_CHUNK_CHARS = 4 * 64 * 1024
+
+
+def sniff_image_string(text: str, start: int, end: int) -> str:
+    """根据 [start, end) 区间的前缀判断字符串图像输入的类型
+
+    返回 'json'、'url'、'data_uri' 或 'base64'，只检查前缀，不扫描整个字符串。
+    """
+    if text.startswith('{', start, end):
+        return 'json'
+    if text.startswith('http', start, end):
+        return 'url'
+    if text.startswith('data:image', start, min(end, start + SNIFF_PREFIX)):
+        return 'data_uri'
+    return 'base64'
+
+
+def data_uri_payload_start(text: str, start: int, end: int) -> int:
+    """返回 data URI 中 Base64 数据的起始下标；没有逗号时抛出 ValueError"""
+    comma = text.find(',', start, min(end, start + DATA_URI_MAX_HEADER))
+    if comma < 0:
+        raise ValueError("data URI has no ',' separator")
+    return comma + 1
+
+
+def decode_base64(text: str, start: int = 0, end: int | None = None) -> bytes | bytearray:
+    """将 text[start:end] 中的 Base64 解码为图像字节
+
+    标准 Base64 按块以严格模式解码到预先分配的 bytearray，峰值只多出输出
+    缓冲区本身和一个块；含换行等非字母表字符的输入回退到 base64.b64decode，
+    行为与之前一致（忽略这些字符）。
+    """
+    end = len(text) if end is None else end
+    length = end - start
+    if length % 4:
+        return base64.b64decode(text[start:end])
+
+    padding = 0
+    if length and text[end - 1] == '=':
+        padding = 2 if text[end - 2] == '=' else 1
+    output = bytearray(length // 4 * 3 - padding)
+    view = memoryview(output)
+
+    offset = 0
+    try:
+        for pos in range(start, end, BASE64_CHUNK_CHARS):
+            # a2b_base64 直接读取 ASCII 字符串的内部缓冲区，只复制当前块
+            chunk = binascii.a2b_base64(text[pos:min(pos + BASE64_CHUNK_CHARS, end)], strict_mode=True)
+            view[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+    except ValueError:
+        # 非字母表字符、中途出现的填充符等非规范输入
+        offset = -1
+    finally:
+        view.release()
+
+    if offset != len(output):
+        return base64.b64decode(text[start:end])
+    return output
+
+
+class BufferReader(io.RawIOBase):
+    """在不复制的前提下以文件接口读取 bytearray / memoryview
+
+    io.BytesIO 只与 bytes 共享内存，传入 bytearray 时会复制整个缓冲区。
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = max(0, min(len(buffer), len(self._view) - self._pos))
+        buffer[:count] = self._view[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self._pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+def open_buffer(image_bytes: bytes | bytearray | memoryview) -> io.RawIOBase | io.BytesIO:
+    """以文件对象包装图像字节，供 Image.open 使用（不复制数据）"""
+    if isinstance(image_bytes, bytes):
+        return io.BytesIO(image_bytes)
+    return BufferReader(image_bytes)
@@ -0,0 +1,93 @@
+from collections import defaultdict
+
+
+class LabelLayout:
+    """标签布局：用均匀网格索引已放置的标签矩形，避免标签相互重叠
+
+    每个标签依次尝试若干候选位置（框上方、框内顶部、框下方、框内底部、
+    右对齐），碰撞检测只查询候选矩形覆盖的网格单元，单个标签的放置代价
+    与标注总数无关。
+    """
+
+    def __init__(self, width: int, height: int, cell_size: int = 64):
+        self.width = width
+        self.height = height
+        self.cell_size = max(8, int(cell_size))
+        self._cells: dict[tuple[int, int], list[tuple[int, int, int, int]]] = defaultdict(list)
+
+    def place(self, box: tuple[float, float, float, float], text_width: int, text_height: int,
+              spacing: int, extent: tuple[int, int, int, int]) -> tuple[int, int]:
+        """为一个标签选择文本锚点 (x, y) 并登记其占用区域
+
+        extent 是标签背景相对锚点的范围 (left, top, right, bottom)。
+        所有候选位置都冲突时退回第一个可用位置（与旧版放置规则一致）。
+        """
+        x1, y1, x2, y2 = box
+        fallback = None
+        for anchor_x, anchor_y in self._candidates(x1, y1, x2, y2, text_width, text_height, spacing):
+            anchor_x, anchor_y = int(anchor_x), int(anchor_y)
+            if anchor_y < 0 or anchor_y + text_height > self.height:
+                continue
+            rect = self._rect(anchor_x, anchor_y, extent)
+            if fallback is None:
+                fallback = (anchor_x, anchor_y, rect)
+            if not self._collides(rect):
+                self._insert(rect)
+                return anchor_x, anchor_y
+
+        if fallback is None:
+            # 图像太小放不下标签，按旧规则放在框内顶部
+            anchor_x = int(self._clamp_x(x1, text_width))
+            anchor_y = int(y1 + spacing)
+            fallback = (anchor_x, anchor_y, self._rect(anchor_x, anchor_y, extent))
+
+        anchor_x, anchor_y, rect = fallback
+        self._insert(rect)
+        return anchor_x, anchor_y
+
+    def _candidates(self, x1, y1, x2, y2, text_width, text_height, spacing):
+        left = self._clamp_x(x1, text_width)
+        right = self._clamp_x(max(x1, x2 - text_width), text_width)
+        above = y1 - text_height - spacing
+        inside_top = y1 + spacing
+        below = y2 + spacing
+        inside_bottom = y2 - text_height - spacing
+        yield left, above
+        yield left, inside_top
+        yield left, below
+        yield left, inside_bottom
+        if right != left:
+            yield right, above
+            yield right, inside_top
+            yield right, below
+            yield right, inside_bottom
+
+    def _clamp_x(self, x: float, text_width: int) -> float:
+        # 确保文本不会超出图像右边界
+        if x + text_width > self.width:
+            return max(0, self.width - text_width)
+        return x
+
+    @staticmethod
+    def _rect(anchor_x: int, anchor_y: int, extent: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+        left, top, right, bottom = extent
+        return anchor_x + left, anchor_y + top, anchor_x + right, anchor_y + bottom
+
+    def _cell_range(self, rect):
+        size = self.cell_size
+        x0, y0, x1, y1 = rect
+        for cx in range(int(x0) // size, int(x1) // size + 1):
+            for cy in range(int(y0) // size, int(y1) // size + 1):
+                yield cx, cy
+
+    def _collides(self, rect) -> bool:
+        x0, y0, x1, y1 = rect
+        for cell in self._cell_range(rect):
+            for ox0, oy0, ox1, oy1 in self._cells.get(cell, ()):
+                if x0 < ox1 and ox0 < x1 and y0 < oy1 and oy0 < y1:
+                    return True
+        return False
+
+    def _insert(self, rect) -> None:
+        for cell in self._cell_range(rect):
+            self._cells[cell].append(rect)
@@ -0,0 +1,26 @@
+import logging
+import os
+import sys
+
+from dify_plugin.config.logger_format import DifyPluginLoggerFormatter
+
+
+# 插件日志级别（DEBUG 时输出逐步调试信息；默认只输出警告）
+LOG_LEVEL = os.getenv('DRAW_BOXES_LOG_LEVEL', 'WARNING').upper()
+
+# 与 SDK 自带的 plugin_logger_handler 格式相同，但不限制级别，由各日志器的级别过滤
+_handler = logging.StreamHandler(sys.stdout)
+_handler.setFormatter(DifyPluginLoggerFormatter())
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取按 DRAW_BOXES_LOG_LEVEL 过滤、以 Dify 插件日志格式输出的模块日志器
+
+    调试信息使用 %s 占位符传参，级别未启用时不会格式化参数。
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.getLevelNamesMapping().get(LOG_LEVEL, logging.WARNING))
+    if _handler not in logger.handlers:
+        logger.addHandler(_handler)
+        logger.propagate = False
+    return logger
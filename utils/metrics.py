@@ -0,0 +1,184 @@
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+
+METRIC_FORMATS = ('json', 'prometheus', 'otel')
+
+# 当前调用的记录器（未启用指标时为 None，span 退化为空操作）
+_current_recorder: ContextVar['PerfRecorder | None'] = ContextVar('draw_boxes_recorder', default=None)
+
+
+def peak_rss_bytes() -> int | None:
+    """进程峰值常驻内存（字节）；平台不支持时返回 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PerfRecorder:
+    """单次调用的性能记录器：各阶段耗时、字节数和进程峰值 RSS
+
+    同名阶段可以多次进入（例如分条渲染的每个条带），耗时累加并记录次数。
+    每个阶段结束时记录进程 RSS 高水位，相邻阶段的差值即该阶段带来的峰值增长。
+    """
+
+    def __init__(self):
+        self._started_ns = time.perf_counter_ns()
+        self._started_unix_ns = time.time_ns()
+        self._stages: dict[str, list[int]] = {}  # 阶段名 -> [总耗时 ns, 次数, RSS 高水位]
+        self._bytes: dict[str, int] = {}
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            stage = self._stages.setdefault(name, [0, 0, 0])
+            stage[0] += time.perf_counter_ns() - start
+            stage[1] += 1
+            stage[2] = max(stage[2], peak_rss_bytes() or 0)
+
+    def add_bytes(self, name: str, count: int) -> None:
+        self._bytes[name] = self._bytes.get(name, 0) + count
+
+    def snapshot(self) -> dict:
+        """以普通字典返回当前记录（JSON 格式）"""
+        peak = peak_rss_bytes()
+        return {
+            "total_ms": round((time.perf_counter_ns() - self._started_ns) / 1e6, 3),
+            "stages": {
+                name: {"ms": round(total_ns / 1e6, 3), "count": count, "peak_rss_mb": round(rss / (1024 * 1024), 1)}
+                for name, (total_ns, count, rss) in self._stages.items()
+            },
+            "bytes": dict(self._bytes),
+            "peak_rss_mb": round(peak / (1024 * 1024), 1) if peak is not None else None,
+        }
+
+    def export(self, metrics_format: str = 'json'):
+        """按指定格式导出：json 返回字典，prometheus 返回文本，otel 返回 OTLP JSON 结构"""
+        if metrics_format == 'prometheus':
+            return self.to_prometheus()
+        if metrics_format == 'otel':
+            return self.to_otel()
+        return self.snapshot()
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        snapshot = self.snapshot()
+        lines = [
+            '# HELP draw_boxes_duration_seconds Total time spent in the invocation.',
+            '# TYPE draw_boxes_duration_seconds gauge',
+            f'draw_boxes_duration_seconds {snapshot["total_ms"] / 1000:.6f}',
+            '# HELP draw_boxes_stage_seconds Time spent in each processing stage.',
+            '# TYPE draw_boxes_stage_seconds gauge',
+        ]
+        lines += [
+            f'draw_boxes_stage_seconds{{stage="{name}"}} {stage["ms"] / 1000:.6f}'
+            for name, stage in snapshot["stages"].items()
+        ]
+        lines += [
+            '# HELP draw_boxes_stage_calls Number of times each processing stage ran.',
+            '# TYPE draw_boxes_stage_calls gauge',
+        ]
+        lines += [
+            f'draw_boxes_stage_calls{{stage="{name}"}} {stage["count"]}'
+            for name, stage in snapshot["stages"].items()
+        ]
+        if peak_rss_bytes() is not None:
+            lines += [
+                '# HELP draw_boxes_stage_peak_rss_bytes Process peak RSS when each processing stage finished.',
+                '# TYPE draw_boxes_stage_peak_rss_bytes gauge',
+            ]
+            lines += [
+                f'draw_boxes_stage_peak_rss_bytes{{stage="{name}"}} {rss}'
+                for name, (_, _, rss) in self._stages.items()
+            ]
+        lines += [
+            '# HELP draw_boxes_bytes Bytes processed by kind.',
+            '# TYPE draw_boxes_bytes gauge',
+        ]
+        lines += [f'draw_boxes_bytes{{kind="{name}"}} {count}' for name, count in snapshot["bytes"].items()]
+        peak = peak_rss_bytes()
+        if peak is not None:
+            lines += [
+                '# HELP draw_boxes_peak_rss_bytes Peak resident set size of the plugin process.',
+                '# TYPE draw_boxes_peak_rss_bytes gauge',
+                f'draw_boxes_peak_rss_bytes {peak}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def to_otel(self) -> dict:
+        """OpenTelemetry OTLP/JSON 指标结构（可直接发送到 OTLP HTTP 端点）"""
+        snapshot = self.snapshot()
+        now = str(time.time_ns())
+        start = str(self._started_unix_ns)
+
+        def gauge(name: str, unit: str, points: list[tuple[float, dict]]) -> dict:
+            return {
+                "name": name,
+                "unit": unit,
+                "gauge": {"dataPoints": [
+                    {
+                        "asDouble": value,
+                        "startTimeUnixNano": start,
+                        "timeUnixNano": now,
+                        "attributes": [
+                            {"key": key, "value": {"stringValue": attr}} for key, attr in attributes.items()
+                        ],
+                    }
+                    for value, attributes in points
+                ]},
+            }
+
+        metrics = [
+            gauge("draw_boxes.duration", "ms", [(snapshot["total_ms"], {})]),
+            gauge("draw_boxes.stage.duration", "ms", [
+                (stage["ms"], {"stage": name}) for name, stage in snapshot["stages"].items()
+            ]),
+            gauge("draw_boxes.bytes", "By", [
+                (float(count), {"kind": name}) for name, count in snapshot["bytes"].items()
+            ]),
+        ]
+        peak = peak_rss_bytes()
+        if peak is not None:
+            metrics.append(gauge("process.memory.peak_rss", "By", [(float(peak), {})]))
+            metrics.append(gauge("draw_boxes.stage.peak_rss", "By", [
+                (float(rss), {"stage": name}) for name, (_, _, rss) in self._stages.items()
+            ]))
+
+        return {"resourceMetrics": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "draw_boxes"}}]},
+            "scopeMetrics": [{"scope": {"name": "draw_boxes"}, "metrics": metrics}],
+        }]}
+
+
+@contextmanager
+def recording(recorder: PerfRecorder | None):
+    """在当前上下文（协程/线程）中启用记录器"""
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+
+def span(name: str):
+    """记录一个阶段的耗时；未启用记录器时不做任何事"""
+    recorder = _current_recorder.get()
+    return recorder.span(name) if recorder is not None else nullcontext()
+
+
+def add_bytes(name: str, count: int) -> None:
+    recorder = _current_recorder.get()
+    if recorder is not None:
+        recorder.add_bytes(name, count)
@@ -0,0 +1,22 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class RenderOptions:
+    """单次绘制/编码所需的参数（已验证）"""
+
+    box_color: str = '#ff0000'
+    text_color: str = '#ffffff'
+    line_width: int = 2
+    fill_opacity: float = 0.0
+    color_by_class: bool = False
+    font_size: int = 16
+    coordinate_type: str = 'relative'
+    confidence_threshold: float = 0.0
+    output_max_side: int = 0
+    output_format: str = 'auto'
+    quality: int = 85
+    png_compress_level: int = 6
+    png_optimize: bool = False
+    multi_frame: bool = False
+    output_mode: str = 'image'
@@ -0,0 +1,53 @@
+import os
+
+from PIL import Image
+
+from utils.errors import ImageTooLargeError
+from utils.ingest import open_buffer
+
+
+# 整帧解码的图像尺寸限制（宽、高各自的上限）
+MAX_IMAGE_SIZE = int(os.getenv('DRAW_BOXES_MAX_IMAGE_SIZE', 4096))
+# 像素总数上限
+MAX_IMAGE_PIXELS = MAX_IMAGE_SIZE * MAX_IMAGE_SIZE
+# 分条渲染的图像尺寸限制（仅适用于可按条带读取的未压缩格式）
+TILED_MAX_IMAGE_SIZE = int(os.getenv('DRAW_BOXES_TILED_MAX_IMAGE_SIZE', 32768))
+TILED_MAX_IMAGE_PIXELS = TILED_MAX_IMAGE_SIZE * TILED_MAX_IMAGE_SIZE
+# 多帧模式下允许的最大帧数（逐帧处理，帧数只影响耗时和输出大小）
+MAX_FRAMES = int(os.getenv('DRAW_BOXES_MAX_FRAMES', 1000))
+
+# Pillow 自带的解压炸弹检查以自身的像素上限为准，放宽到本插件的上限，
+# 真正的尺寸校验由 validate_image_header 完成
+Image.MAX_IMAGE_PIXELS = max(Image.MAX_IMAGE_PIXELS or 0, MAX_IMAGE_PIXELS, TILED_MAX_IMAGE_PIXELS)
+
+
+def open_image(image_bytes: bytes, max_size: int = MAX_IMAGE_SIZE,
+               max_pixels: int = MAX_IMAGE_PIXELS) -> Image.Image:
+    """惰性打开图像并校验文件头
+
+    Image.open 只解析文件头，不分配像素缓冲区；尺寸不合规的图像
+    在解码之前就会被拒绝。
+    """
+    try:
+        image = Image.open(open_buffer(image_bytes))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(f"Image size too large: {e}") from e
+
+    validate_image_header(image.width, image.height, max_size, max_pixels)
+    return image
+
+
+def validate_image_header(width: int, height: int, max_size: int = MAX_IMAGE_SIZE,
+                          max_pixels: int = MAX_IMAGE_PIXELS) -> None:
+    """根据文件头中的宽高校验图像，不合规时抛出 ImageTooLargeError
+
+    解码分配的内存只取决于宽高，由尺寸和像素数上限约束；不按压缩比拒绝，
+    高压缩比的正常图像（文字截图、无损 WebP 等）不会被误判。
+    """
+    if width > max_size or height > max_size:
+        raise ImageTooLargeError(f"Image size too large. Maximum size is {max_size}x{max_size}")
+
+    pixels = width * height
+    if pixels > max_pixels:
+        raise ImageTooLargeError(f"Image has too many pixels. Maximum is {max_pixels}")
+
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from utils.encoder import EncodedImage
+from utils.logger import get_logger
+from utils.options import RenderOptions
+
+
+# 内存中缓存的编码结果总字节上限
+RESULT_CACHE_MAX_BYTES = int(os.getenv('DRAW_BOXES_RESULT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# 缓存有效期（秒），0 表示不过期
+RESULT_CACHE_TTL = float(os.getenv('DRAW_BOXES_RESULT_CACHE_TTL', 0))
+# 可选的磁盘缓存目录，留空则只使用内存缓存
+RESULT_CACHE_DIR = os.getenv('DRAW_BOXES_RESULT_CACHE_DIR', '')
+
+logger = get_logger(__name__)
+
+
+def make_cache_key(image_digest: str, annotations_data, options: RenderOptions) -> str:
+    """根据图像内容哈希和标注（原始 JSON 文本或已解析数据）/样式参数生成缓存键"""
+    digest = hashlib.sha256()
+    digest.update(image_digest.encode('ascii'))
+    digest.update(b'\0')
+    if isinstance(annotations_data, str):
+        # 原始 JSON 文本直接参与哈希，命中缓存时无需解析
+        digest.update(b's')
+        digest.update(annotations_data.encode('utf-8', 'surrogatepass'))
+    else:
+        digest.update(json.dumps(annotations_data, sort_keys=True, separators=(',', ':'),
+                                 ensure_ascii=False, default=str).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(asdict(options), sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedResult:
+    encoded: EncodedImage
+    result: dict
+    created_at: float
+
+
+class ResultCache:
+    """内容寻址的渲染结果缓存（内存 LRU + 可选磁盘层 + TTL）
+
+    命中时直接返回已编码的图像，不需要解码原图。
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: float = RESULT_CACHE_TTL,
+                 cache_dir: str | None = None):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._entries: OrderedDict[str, CachedResult] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._cache_dir = Path(cache_dir) if cache_dir else None
+        if self._cache_dir is not None:
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> CachedResult | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._read_disk(key)
+        if entry is not None and self._expired(entry, now):
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._put_memory(key, entry)
+        return entry
+
+    def put(self, key: str, encoded: EncodedImage, result: dict) -> None:
+        entry = CachedResult(encoded=encoded, result=dict(result), created_at=time.time())
+        self._put_memory(key, entry)
+        self._write_disk(key, entry)
+
+    @property
+    def nbytes(self) -> int:
+        """内存层当前占用的字节数（不含磁盘层）"""
+        with self._lock:
+            return self._total_bytes
+
+    def shrink(self, max_bytes: int) -> int:
+        """按 LRU 淘汰内存层条目直到占用不超过 max_bytes，返回释放的字节数
+
+        磁盘层保留，之后命中时重新读入内存。
+        """
+        with self._lock:
+            before = self._total_bytes
+            while self._entries and self._total_bytes > max_bytes:
+                self._remove(next(iter(self._entries)))
+            return before - self._total_bytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+    def _expired(self, entry: CachedResult, now: float) -> bool:
+        return self._ttl > 0 and now - entry.created_at > self._ttl
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= len(entry.encoded.data)
+
+    def _put_memory(self, key: str, entry: CachedResult) -> None:
+        size = len(entry.encoded.data)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._total_bytes += size
+            while self._total_bytes > self._max_bytes:
+                evicted_key = next(iter(self._entries))
+                self._remove(evicted_key)
+
+    def _read_disk(self, key: str) -> CachedResult | None:
+        if self._cache_dir is None:
+            return None
+        try:
+            meta = json.loads((self._cache_dir / f"{key}.json").read_text())
+            data = (self._cache_dir / f"{key}.blob").read_bytes()
+            return CachedResult(
+                encoded=EncodedImage(data=data, format=meta['format'], mime_type=meta['mime_type'], encode_ms=0.0),
+                result=meta['result'],
+                created_at=meta['created_at'],
+            )
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key: str, entry: CachedResult) -> None:
+        if self._cache_dir is None:
+            return
+        try:
+            (self._cache_dir / f"{key}.blob").write_bytes(entry.encoded.data)
+            (self._cache_dir / f"{key}.json").write_text(json.dumps({
+                'format': entry.encoded.format,
+                'mime_type': entry.encoded.mime_type,
+                'result': entry.result,
+                'created_at': entry.created_at,
+            }, ensure_ascii=False))
+        except OSError as e:
+            logger.warning("Failed to write result cache: %s", e)
+
+
+result_cache = ResultCache(cache_dir=RESULT_CACHE_DIR or None)
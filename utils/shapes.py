@@ -0,0 +1,433 @@
+import math
+from dataclasses import dataclass, field, replace
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from utils.admission import charge_input, render_scratch
+from utils.errors import AnnotationFormatError, ImageTooLargeError
+from utils.ingest import data_uri_payload_start, decode_base64, sniff_image_string
+from utils.probe import MAX_IMAGE_SIZE, open_image
+
+
+# 边界框之外可以描述标注形状的字段
+SHAPE_FIELDS = frozenset(('polygon', 'points', 'segmentation', 'mask', 'keypoints'))
+# 单个标注的多边形顶点和关键点总数上限
+MAX_SHAPE_POINTS = 10000
+# 未指定填充透明度时掩码的默认不透明度（0.5）
+MASK_ALPHA = 128
+# 单个掩码的前景游程数上限（每个游程的起点和终点共 16 字节）
+MAX_MASK_RUNS = 250_000
+# 一次请求中所有掩码的游程总数上限
+MAX_TOTAL_MASK_RUNS = 1_000_000
+# 掩码图像按列块转换为游程，每块的列数
+_MASK_BLOCK_COLUMNS = 256
+
+
+class RLEMask:
+    """列优先（COCO 约定）游程编码的二值掩码
+
+    只保存前景游程在列优先展开中的 [起点, 终点)，按需对任意像素网格采样，
+    不会解码出整幅掩码。
+    """
+
+    def __init__(self, width: int, height: int, starts: np.ndarray, ends: np.ndarray):
+        self.width = width
+        self.height = height
+        self.starts = starts
+        self.ends = ends
+        self._bounds = False
+
+    @classmethod
+    def from_counts(cls, width: int, height: int, counts) -> 'RLEMask | None':
+        """由 COCO 游程计数（背景、前景交替，从背景开始）构建，计数不合法时返回 None"""
+        counts = np.asarray(counts, dtype=np.int64)
+        if counts.ndim != 1 or (counts < 0).any():
+            return None
+        boundaries = np.concatenate(([0], np.cumsum(counts)))
+        if boundaries[-1] > width * height:
+            return None
+        # 奇数下标的游程为前景
+        return cls(width, height, boundaries[1:-1:2], boundaries[2::2])
+
+    @classmethod
+    def from_image(cls, image: Image.Image, max_runs: int) -> 'RLEMask':
+        """由掩码图像构建（灰度不低于 128 的像素为前景）
+
+        按列块转换，临时数组只与块大小相关；游程数超过 max_runs 时抛出 AnnotationFormatError。
+        """
+        gray = image if image.mode == 'L' else image.convert('L')
+        width, height = gray.size
+        starts, ends = [], []
+        runs = 0
+        # 上一块列优先展开的最后一个像素，游程可以跨块延续
+        previous = np.zeros(1, dtype=np.int8)
+        for x0 in range(0, width, _MASK_BLOCK_COLUMNS):
+            block = np.asarray(gray.crop((x0, 0, min(width, x0 + _MASK_BLOCK_COLUMNS), height))) >= 128
+            flat = block.T.ravel().view(np.int8)
+            edges = np.diff(np.concatenate((previous, flat)))
+            block_starts = np.flatnonzero(edges == 1)
+            runs += len(block_starts)
+            if runs > max_runs:
+                raise too_many_mask_runs(max_runs)
+            starts.append(block_starts + x0 * height)
+            ends.append(np.flatnonzero(edges == -1) + x0 * height)
+            previous = flat[-1:]
+        if previous[0]:
+            ends.append(np.array([width * height], dtype=np.intp))
+        return cls(width, height, np.concatenate(starts), np.concatenate(ends))
+
+    @property
+    def runs(self) -> int:
+        return len(self.starts)
+
+    @property
+    def nbytes(self) -> int:
+        return self.starts.nbytes + self.ends.nbytes
+
+    def bounds(self) -> tuple[int, int, int, int] | None:
+        """前景范围 (x1, y1, x2, y2)，含端点；空掩码返回 None"""
+        if self._bounds is False:
+            self._bounds = self._compute_bounds()
+        return self._bounds
+
+    def _compute_bounds(self) -> tuple[int, int, int, int] | None:
+        if not len(self.starts):
+            return None
+        h = self.height
+        first_columns, last_columns = self.starts // h, (self.ends - 1) // h
+        # 跨列的游程覆盖从第 0 行到最后一行
+        spans = first_columns != last_columns
+        y1 = int(np.where(spans, 0, self.starts % h).min())
+        y2 = int(np.where(spans, h - 1, (self.ends - 1) % h).max())
+        return int(first_columns.min()), y1, int(last_columns.max()), y2
+
+    def sample(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """在列 xs、行 ys 的网格上采样，返回 len(ys)×len(xs) 的布尔数组"""
+        positions = xs[None, :] * self.height + ys[:, None]
+        index = np.searchsorted(self.ends, positions, side='right')
+        inside = index < len(self.ends)
+        inside[inside] = self.starts[index[inside]] <= positions[inside]
+        return inside
+
+
+@dataclass
+class Shape:
+    """边界框之外的标注形状：多边形、关键点（骨架连线）和掩码
+
+    多边形和关键点的坐标系与边界框相同；掩码覆盖整幅图像，按
+    target_size 缩放到输出图像。boxed 表示标注同时给出了边界框。
+    """
+
+    polygons: list[np.ndarray] = field(default_factory=list)
+    keypoints: np.ndarray | None = None
+    skeleton: list[tuple[int, int]] = field(default_factory=list)
+    mask: RLEMask | None = None
+    boxed: bool = False
+    target_size: tuple[int, int] | None = None
+
+    def bounds(self) -> tuple[float, float, float, float] | None:
+        """多边形、可见关键点和掩码（已换算为像素时）的范围，含端点"""
+        points = list(self.polygons)
+        if self.keypoints is not None:
+            points.append(self.keypoints[self.keypoints[:, 2] > 0, :2])
+        points = [p for p in points if len(p)]
+        boxes = []
+        if points:
+            stacked = np.concatenate(points)
+            boxes.append((*stacked.min(axis=0), *stacked.max(axis=0)))
+        mask_bounds = self.mask_bounds()
+        if mask_bounds is not None:
+            boxes.append(mask_bounds)
+        if not boxes:
+            return None
+        boxes = np.array(boxes, dtype=np.float64)
+        return (*boxes[:, :2].min(axis=0).tolist(), *boxes[:, 2:].max(axis=0).tolist())
+
+    def mask_bounds(self) -> tuple[float, float, float, float] | None:
+        """掩码前景在输出图像中的像素范围，含端点（尚未换算为像素时返回 None）"""
+        if self.mask is None or self.target_size is None:
+            return None
+        bounds = self.mask.bounds()
+        if bounds is None:
+            return None
+        sx, sy = self.target_size[0] / self.mask.width, self.target_size[1] / self.mask.height
+        x1, y1, x2, y2 = bounds
+        return x1 * sx, y1 * sy, (x2 + 1) * sx - 1, (y2 + 1) * sy - 1
+
+    def to_pixels(self, factors: np.ndarray, width: int, height: int) -> 'Shape':
+        """按与边界框相同的换算系数转换为像素坐标，掩码缩放到 width×height"""
+        scale = factors[:2]
+        keypoints = None
+        if self.keypoints is not None:
+            keypoints = self.keypoints.copy()
+            keypoints[:, :2] *= scale
+        return replace(
+            self,
+            polygons=[polygon * scale for polygon in self.polygons],
+            keypoints=keypoints,
+            target_size=(width, height),
+        )
+
+    def extent(self, line_width: int) -> tuple[int, int, int, int] | None:
+        """绘制时覆盖的像素范围（含线宽和关键点半径），含端点"""
+        bounds = self.bounds()
+        if bounds is None:
+            return None
+        pad = keypoint_radius(line_width) + line_width
+        x1, y1, x2, y2 = bounds
+        return math.floor(x1) - pad, math.floor(y1) - pad, math.ceil(x2) + pad, math.ceil(y2) + pad
+
+
+def keypoint_radius(line_width: int) -> int:
+    return max(2, line_width + 1)
+
+
+def too_many_mask_runs(max_runs: int) -> AnnotationFormatError:
+    return AnnotationFormatError(
+        f"Mask has too many runs. Maximum is {max_runs} "
+        f"({MAX_MASK_RUNS} per mask, {MAX_TOTAL_MASK_RUNS} per request)"
+    )
+
+
+def parse_shape(annotation: dict, max_mask_runs: int = MAX_MASK_RUNS) -> Shape | None:
+    """读取标注中的多边形、关键点和掩码字段，全部无效时返回 None
+
+    掩码的游程数超过 max_mask_runs 时抛出 AnnotationFormatError。
+    """
+    if annotation.keys().isdisjoint(SHAPE_FIELDS):
+        return None
+
+    polygons, mask = [], None
+    for name in ('polygon', 'points', 'segmentation'):
+        value = annotation.get(name)
+        if isinstance(value, dict) and name == 'segmentation':
+            # COCO 的 iscrowd 标注以 RLE 形式放在 segmentation 中
+            mask = mask or _parse_mask(value, max_mask_runs)
+        elif value is not None:
+            polygons.extend(_parse_polygons(value))
+    if 'mask' in annotation:
+        mask = mask or _parse_mask(annotation['mask'], max_mask_runs)
+    keypoints = _parse_keypoints(annotation.get('keypoints'))
+
+    if sum(len(p) for p in polygons) + (0 if keypoints is None else len(keypoints)) > MAX_SHAPE_POINTS:
+        return None
+    if not polygons and keypoints is None and mask is None:
+        return None
+
+    skeleton = []
+    if keypoints is not None and isinstance(annotation.get('skeleton'), list):
+        for pair in annotation['skeleton']:
+            if isinstance(pair, list) and len(pair) == 2 and all(_is_index(v, len(keypoints)) for v in pair):
+                skeleton.append((int(pair[0]), int(pair[1])))
+    return Shape(polygons=polygons, keypoints=keypoints, skeleton=skeleton, mask=mask)
+
+
+def _parse_polygons(value) -> list[np.ndarray]:
+    """支持单个多边形（见 _parse_polygon）或由多个多边形组成的列表（如 COCO segmentation）"""
+    if not isinstance(value, list) or not value:
+        return []
+    polygon = _parse_polygon(value)
+    if polygon is not None:
+        return [polygon]
+    return [polygon for polygon in map(_parse_polygon, value) if polygon is not None]
+
+
+def _parse_polygon(value) -> np.ndarray | None:
+    """支持 [[x, y], ...] 和扁平的 [x1, y1, x2, y2, ...]，至少 3 个顶点"""
+    if not isinstance(value, list) or len(value) < 3:
+        return None
+    if all(_is_number(v) for v in value):
+        return np.array(value, dtype=np.float64).reshape(-1, 2) if len(value) % 2 == 0 and len(value) >= 6 else None
+    if all(isinstance(v, list) and len(v) == 2 and all(_is_number(c) for c in v) for v in value):
+        return np.array(value, dtype=np.float64)
+    return None
+
+
+def _parse_keypoints(value) -> np.ndarray | None:
+    """支持 COCO 的扁平 [x, y, v, ...] 以及 [[x, y], ...] / [[x, y, v], ...]，返回 K×3 数组"""
+    if not isinstance(value, list) or not value:
+        return None
+    if all(_is_number(v) for v in value):
+        if len(value) % 3:
+            return None
+        return np.array(value, dtype=np.float64).reshape(-1, 3)
+    if not all(isinstance(v, list) and len(v) in (2, 3) and all(_is_number(c) for c in v) for v in value):
+        return None
+    # 未给出可见性的关键点视为可见
+    return np.array([v if len(v) == 3 else [*v, 2] for v in value], dtype=np.float64)
+
+
+def _parse_mask(value, max_runs: int) -> RLEMask | None:
+    """支持 COCO RLE（counts 为列表或压缩字符串）和 Base64 / data URI 编码的掩码图像
+
+    解析出的游程随请求驻留到渲染结束，记入输入预算。
+    """
+    if isinstance(value, dict):
+        mask = _parse_rle(value, max_runs)
+    elif isinstance(value, str):
+        mask = _parse_mask_image(value, max_runs)
+    else:
+        return None
+    if mask is not None:
+        charge_input(mask.nbytes)
+    return mask
+
+
+def _parse_rle(value: dict, max_runs: int) -> RLEMask | None:
+    size, counts = value.get('size'), value.get('counts')
+    if not (isinstance(size, list) and len(size) == 2
+            and all(_is_number(v) and v == int(v) and 1 <= v <= MAX_IMAGE_SIZE for v in size)):
+        return None
+    height, width = int(size[0]), int(size[1])
+    # 背景、前景交替且从背景开始：n 个前景游程最多 2n+1 个计数
+    max_counts = 2 * max_runs + 1
+    try:
+        if isinstance(counts, str):
+            counts = decode_rle_string(counts, max_counts)
+        if not isinstance(counts, list):
+            return None
+        if len(counts) > max_counts:
+            raise too_many_mask_runs(max_runs)
+        return RLEMask.from_counts(width, height, counts)
+    except (ValueError, TypeError):
+        # 与其他字段一样，无法解析的掩码被忽略
+        return None
+
+
+def _parse_mask_image(value: str, max_runs: int) -> RLEMask | None:
+    end = len(value)
+    start = data_uri_payload_start(value, 0, end) if sniff_image_string(value, 0, end) == 'data_uri' else 0
+    try:
+        data = decode_base64(value, start, end)
+        image = open_image(data)
+    except (ValueError, TypeError, OSError, ImageTooLargeError):
+        return None
+
+    # 解码后的像素（单通道每像素 1 字节，其余 4 字节）、灰度副本和一个列块的临时数组，
+    # 在解码之前从渲染预算预留
+    width, height = image.size
+    single_band = image.mode in ('1', 'L', 'P')
+    scratch = (
+        len(data)
+        + width * height * (1 if single_band else 4)
+        + (0 if image.mode == 'L' else width * height)
+        + height * _MASK_BLOCK_COLUMNS * 4
+    )
+    with render_scratch(scratch):
+        try:
+            return RLEMask.from_image(image, max_runs)
+        except (ValueError, OSError):
+            # 截断或损坏的图像在解码时报错，与其他无法解析的掩码一样被忽略
+            return None
+
+
+def decode_rle_string(text: str, max_counts: int | None = None) -> list[int]:
+    """解码 pycocotools 的压缩 RLE 字符串（每字符 5 位的变长整数，增量编码）
+
+    计数超过 max_counts 个时停止解码并抛出 AnnotationFormatError。
+    """
+    counts = []
+    position = 0
+    while position < len(text):
+        if max_counts is not None and len(counts) >= max_counts:
+            raise too_many_mask_runs((max_counts - 1) // 2)
+        value, shift, more = 0, 0, True
+        while more:
+            if position >= len(text):
+                raise ValueError("Truncated RLE string")
+            char = ord(text[position]) - 48
+            value |= (char & 0x1f) << shift
+            more = char & 0x20
+            position += 1
+            shift += 5
+            if not more and char & 0x10:
+                value |= -1 << shift
+        if len(counts) > 2:
+            value += counts[-2]
+        counts.append(value)
+    return counts
+
+
+def draw_polygons(draw: ImageDraw.ImageDraw, shape: Shape, color: str, width: int,
+                  offset: tuple[int, int] = (0, 0)) -> None:
+    """绘制多边形轮廓"""
+    for polygon in shape.polygons:
+        draw.polygon(_points(polygon, offset), outline=color, width=width)
+
+
+def draw_keypoints(draw: ImageDraw.ImageDraw, shape: Shape, color: str, outline: str, width: int,
+                   offset: tuple[int, int] = (0, 0)) -> None:
+    """先画骨架连线，再画关键点（不可见的关键点及其连线跳过）"""
+    keypoints = shape.keypoints
+    if keypoints is None:
+        return
+    dx, dy = offset
+    visible = keypoints[:, 2] > 0
+    for i, j in shape.skeleton:
+        if visible[i] and visible[j]:
+            draw.line(
+                [(keypoints[i, 0] - dx, keypoints[i, 1] - dy), (keypoints[j, 0] - dx, keypoints[j, 1] - dy)],
+                fill=color, width=width,
+            )
+    radius = keypoint_radius(width)
+    for x, y, _ in keypoints[visible].tolist():
+        draw.ellipse([x - dx - radius, y - dy - radius, x - dx + radius, y - dy + radius], fill=color, outline=outline)
+
+
+def fill_polygons(draw: ImageDraw.ImageDraw, shape: Shape, fill, offset: tuple[int, int] = (0, 0)) -> None:
+    """填充多边形（用于半透明填充的颜色层和蒙版）"""
+    for polygon in shape.polygons:
+        draw.polygon(_points(polygon, offset), fill=fill)
+
+
+def paint_masks(region: tuple[int, int, int, int], masks: list[tuple[Shape, tuple[int, int, int], int]]
+                ) -> tuple[Image.Image, Image.Image] | None:
+    """把多个掩码一次性画进同一个颜色层和 alpha 蒙版
+
+    region 为像素范围 [x1, y1, x2, y2)；masks 为 (形状, RGB 颜色, 不透明度)，
+    后面的掩码覆盖前面的（同一像素不会叠加变深）。掩码按最近邻采样到
+    输出分辨率，只采样与 region 相交的部分。先在单通道的下标图中记录每个
+    像素最后覆盖它的掩码，最后一次查表得到颜色和蒙版。返回 (颜色层, 蒙版)，
+    均未相交时返回 None。
+    """
+    x1, y1, x2, y2 = region
+    # 0 号为未覆盖（黑色、透明）
+    owners = np.zeros((y2 - y1, x2 - x1), dtype=np.uint16 if len(masks) < 65535 else np.uint32)
+    colors = np.zeros((len(masks) + 1, 3), dtype=np.uint8)
+    alphas = np.zeros(len(masks) + 1, dtype=np.uint8)
+    painted = False
+    for number, (shape, rgb, opacity) in enumerate(masks, 1):
+        bounds = shape.mask_bounds()
+        if bounds is None:
+            continue
+        left, top = max(x1, math.floor(bounds[0])), max(y1, math.floor(bounds[1]))
+        right, bottom = min(x2, math.ceil(bounds[2]) + 1), min(y2, math.ceil(bounds[3]) + 1)
+        if left >= right or top >= bottom:
+            continue
+
+        mask = shape.mask
+        width, height = shape.target_size
+        xs = ((np.arange(left, right) + 0.5) * (mask.width / width)).astype(np.int64)
+        ys = ((np.arange(top, bottom) + 0.5) * (mask.height / height)).astype(np.int64)
+        selected = mask.sample(np.minimum(xs, mask.width - 1), np.minimum(ys, mask.height - 1))
+        window = owners[top - y1:bottom - y1, left - x1:right - x1]
+        window[selected] = number
+        colors[number], alphas[number] = rgb, opacity
+        painted = True
+
+    if not painted:
+        return None
+    return Image.fromarray(colors[owners]), Image.fromarray(alphas[owners])
+
+
+def _points(polygon: np.ndarray, offset: tuple[int, int]) -> list[tuple[float, float]]:
+    return [(x - offset[0], y - offset[1]) for x, y in polygon.tolist()]
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _is_index(value, limit: int) -> bool:
+    return _is_number(value) and value == int(value) and 0 <= value < limit
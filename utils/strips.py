@@ -0,0 +1,135 @@
+import math
+import os
+from dataclasses import dataclass
+
+from PIL import Image
+
+from utils.ingest import open_buffer
+from utils.probe import TILED_MAX_IMAGE_PIXELS, TILED_MAX_IMAGE_SIZE, validate_image_header
+
+
+# 分条渲染时每个条带的行数（条带内存约为 宽 x 行数 x 4 字节）
+STRIP_HEIGHT = int(os.getenv('DRAW_BOXES_STRIP_HEIGHT', 256))
+
+# 支持按条带读取的像素模式（读取后统一转换为 RGB）
+STRIP_MODES = {'1', 'L', 'RGB', 'RGBA'}
+# 缩小条带时的重采样滤波及其支撑半径（以输出像素计，BICUBIC 为 2）
+STRIP_RESAMPLE = Image.Resampling.BICUBIC
+_RESAMPLE_SUPPORT = 2
+
+
+@dataclass
+class RawTile:
+    top: int
+    bottom: int
+    offset: int
+    rawmode: str
+    stride: int
+    orientation: int
+
+
+class StripReader:
+    """按行区间读取未压缩栅格数据（BMP、PPM/PGM、未压缩 TIFF）
+
+    只解析文件头得到像素数据在文件中的偏移，每次读取时仅解码请求的行，
+    不会分配整帧像素缓冲区。
+    """
+
+    def __init__(self, image_bytes: bytes, mode: str, size: tuple[int, int],
+                 source_format: str, tiles: list[RawTile]):
+        self._data = memoryview(image_bytes)
+        self.mode = mode
+        self.size = size
+        self.format = source_format
+        self._tiles = tiles
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    def read(self, top: int, bottom: int) -> Image.Image:
+        """读取 [top, bottom) 行，返回 RGB 条带"""
+        strip = Image.new(self.mode, (self.width, bottom - top))
+        for tile in self._tiles:
+            start, end = max(top, tile.top), min(bottom, tile.bottom)
+            if start >= end:
+                continue
+
+            # 计算行在文件中的位置（orientation=-1 表示自底向上存储）
+            if tile.orientation < 0:
+                rows = tile.bottom - tile.top
+                first = tile.offset + (rows - (end - tile.top)) * tile.stride
+            else:
+                first = tile.offset + (start - tile.top) * tile.stride
+            data = self._data[first:first + (end - start) * tile.stride]
+
+            part = Image.frombytes(
+                self.mode, (self.width, end - start), data,
+                'raw', tile.rawmode, tile.stride, tile.orientation
+            )
+            strip.paste(part, (0, start - top))
+        return strip if strip.mode == 'RGB' else strip.convert('RGB')
+
+    def strip_rows(self, size: tuple[int, int]) -> int:
+        """缩小到 size 时每个条带的输出行数，使每次读取的源行数约为 STRIP_HEIGHT"""
+        return max(1, STRIP_HEIGHT * size[1] // self.height)
+
+    def read_resized(self, top: int, bottom: int, size: tuple[int, int]) -> Image.Image:
+        """按缩小后的尺寸 size 读取输出行 [top, bottom)，返回 RGB 条带
+
+        只读取这些行对应的源行和滤波所需的上下边距，各条带拼接后与整幅图像
+        一次缩放的结果一致（浮点舍入造成的差异不超过 1）。
+        """
+        scale = self.height / size[1]
+        margin = math.ceil(_RESAMPLE_SUPPORT * max(1.0, scale)) + 1
+        source_top = max(0, math.floor(top * scale) - margin)
+        source_bottom = min(self.height, math.ceil(bottom * scale) + margin)
+        strip = self.read(source_top, source_bottom)
+        box = (0, top * scale - source_top, self.width, bottom * scale - source_top)
+        return strip.resize((size[0], bottom - top), STRIP_RESAMPLE, box=box)
+
+
+def open_strip_reader(image_bytes: bytes) -> StripReader | None:
+    """若图像可按条带读取则返回 StripReader，否则返回 None
+
+    尺寸按分条渲染的上限校验，超限时抛出 ImageTooLargeError。
+    """
+    try:
+        image = Image.open(open_buffer(image_bytes))
+    except Exception:
+        return None
+
+    if image.mode not in STRIP_MODES or not image.tile:
+        return None
+
+    tiles = []
+    for tile in image.tile:
+        codec, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+        x0, y0, x1, y1 = extents
+        if codec != 'raw' or x0 != 0 or x1 != image.width:
+            return None
+
+        if isinstance(args, str):
+            args = (args,)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+
+        if not stride:
+            # 未指定行跨度时与 raw 解码器一致，按原始模式的位深计算
+            try:
+                stride = len(Image.new(image.mode, (image.width, 1)).tobytes('raw', rawmode))
+            except Exception:
+                return None
+
+        # 截断的文件无法按偏移读取
+        if offset + (y1 - y0) * stride > len(image_bytes):
+            return None
+        tiles.append(RawTile(y0, y1, offset, rawmode, stride, orientation))
+
+    validate_image_header(image.width, image.height, TILED_MAX_IMAGE_SIZE, TILED_MAX_IMAGE_PIXELS)
+    return StripReader(image_bytes, image.mode, image.size, image.format, tiles)
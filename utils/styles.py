@@ -0,0 +1,91 @@
+import re
+import zlib
+from dataclasses import dataclass
+
+from PIL import ImageDraw
+
+
+# 按类别自动配色使用的调色板（相邻类别颜色差异明显）
+PALETTE = (
+    '#ff3838', '#ff9d97', '#ff701f', '#ffb21d', '#cfd231', '#48f90a', '#92cc17', '#3ddb86', '#1a9334', '#00d4bb',
+    '#2c99a8', '#00c2ff', '#344593', '#6473ff', '#0018ec', '#8438ff', '#520085', '#cb38ff', '#ff95c8', '#ff37c7',
+)
+
+# 标注中可以覆盖的样式字段（也可以放在嵌套的 "style" 对象中）
+STYLE_FIELDS = frozenset(('style', 'color', 'box_color', 'text_color', 'line_width', 'fill_opacity', 'dashed'))
+
+_HEX_COLOR = re.compile(r'#[0-9a-fA-F]{6}')
+
+
+@dataclass(frozen=True)
+class AnnotationStyle:
+    """单个标注的样式覆盖项，None 表示使用工具参数（或类别调色板）"""
+
+    color: str | None = None
+    text_color: str | None = None
+    line_width: int | None = None
+    fill_opacity: float | None = None
+    dashed: bool = False
+
+
+DEFAULT_STYLE = AnnotationStyle()
+
+
+@dataclass(frozen=True)
+class DrawStyle:
+    """绘制时实际使用的样式（线宽已按图像尺寸缩放，填充透明度换算为 0-255）"""
+
+    color: str
+    text_color: str
+    line_width: int
+    fill_alpha: int
+    dashed: bool
+
+
+def parse_style(annotation: dict) -> AnnotationStyle:
+    """读取标注中的样式字段，无效的字段被忽略（与置信度等字段的宽松处理一致）"""
+    if annotation.keys().isdisjoint(STYLE_FIELDS):
+        return DEFAULT_STYLE
+
+    fields = annotation
+    if isinstance(annotation.get('style'), dict):
+        fields = {**annotation, **annotation['style']}
+
+    color = fields.get('color', fields.get('box_color'))
+    text_color = fields.get('text_color')
+    line_width = fields.get('line_width')
+    fill_opacity = fields.get('fill_opacity')
+    return AnnotationStyle(
+        color=color.lower() if _is_hex_color(color) else None,
+        text_color=text_color.lower() if _is_hex_color(text_color) else None,
+        line_width=int(line_width) if _is_number(line_width) and 1 <= line_width <= 20 else None,
+        fill_opacity=float(fill_opacity) if _is_number(fill_opacity) and 0 <= fill_opacity <= 1 else None,
+        dashed=fields.get('dashed') is True,
+    )
+
+
+def palette_color(label: str) -> str:
+    """按类别名称稳定地映射到调色板颜色（跨进程一致）"""
+    return PALETTE[zlib.crc32(label.encode('utf-8')) % len(PALETTE)]
+
+
+def draw_dashed_rectangle(draw: ImageDraw.ImageDraw, box: list[int], color: str, width: int) -> None:
+    """绘制虚线框，线段范围与 ImageDraw.rectangle 的实线边框一致（向内加粗）"""
+    x1, y1, x2, y2 = box
+    dash = max(4, width * 3)
+    for x in range(x1, x2 + 1, dash * 2):
+        end = min(x + dash - 1, x2)
+        draw.rectangle([x, y1, end, min(y1 + width - 1, y2)], fill=color)
+        draw.rectangle([x, max(y2 - width + 1, y1), end, y2], fill=color)
+    for y in range(y1, y2 + 1, dash * 2):
+        end = min(y + dash - 1, y2)
+        draw.rectangle([x1, y, min(x1 + width - 1, x2), end], fill=color)
+        draw.rectangle([max(x2 - width + 1, x1), y, x2, end], fill=color)
+
+
+def _is_hex_color(value) -> bool:
+    return isinstance(value, str) and _HEX_COLOR.fullmatch(value) is not None
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value == value
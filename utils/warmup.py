@@ -0,0 +1,67 @@
+import os
+import time
+from contextlib import contextmanager
+
+from PIL import Image, ImageDraw
+
+from utils.annotations import AnnotationBatch
+from utils.concurrency import run_in_thread
+from utils.encoder import MIME_TYPES, encode_image
+from utils.fetcher import get_fetcher
+from utils.fonts import font_cache
+from utils.logger import get_logger
+from utils.options import RenderOptions
+from utils.probe import open_image
+
+
+# 插件启动时是否预热（设为 0 可关闭）
+WARMUP_ENABLED = os.getenv('DRAW_BOXES_WARMUP', '1') not in ('0', 'false', 'False')
+
+logger = get_logger(__name__)
+
+
+def warm_up() -> dict[str, float]:
+    """在插件启动时完成首个请求才会做的一次性初始化，返回各步骤耗时（毫秒）
+
+    不写入结果、解码帧和标签缓存，缓存统计不受影响。字体缺失时的备用字体
+    在后台下载，不阻塞启动。
+    """
+    timings: dict[str, float] = {}
+
+    @contextmanager
+    def step(name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            # 预热失败不影响插件启动，相应初始化推迟到首个请求
+            logger.warning("Warm-up step %s failed: %s", name, e)
+        finally:
+            timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+    options = RenderOptions()
+    image = Image.new('RGB', (64, 64), (127, 127, 127))
+
+    with step('fonts'):
+        font, _ = font_cache.get_font(options.font_size)
+        ImageDraw.Draw(image).text((2, 2), 'Aa 标注', fill=options.text_color, font=font)
+
+    with step('codecs'):
+        # 注册全部格式插件并加载各编解码器
+        Image.init()
+        for output_format in MIME_TYPES:
+            encoded = encode_image(image, output_format)
+            open_image(encoded.data).convert('RGB')
+
+    with step('annotations'):
+        batch = AnnotationBatch.from_annotations([{"bbox": [0.1, 0.1, 0.5, 0.5], "label": "warm-up"}])
+        batch.to_pixels(image.width, image.height, options.coordinate_type)
+
+    with step('http'):
+        get_fetcher()
+
+    with step('threads'):
+        run_in_thread(int)
+
+    logger.info("Warm-up finished in %.1f ms: %s", sum(timings.values()), timings)
+    return timings